@@ -0,0 +1,100 @@
+"""
+Per-request deadlines and admission control for the API.
+
+Every request gets a latency budget (X-Request-Deadline-Ms header, or
+API_DEFAULT_DEADLINE_MS) that fetch and inference stages read through
+model.deadline. At most API_MAX_INFLIGHT requests do full work at once; a
+request that cannot get a slot within API_MAX_QUEUE_WAIT_MS is degraded
+(served from cache only, never triggering a fetch) instead of queueing
+without bound.
+"""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, jsonify, request
+
+from model.deadline import DeadlineExceeded, remaining, reset_deadline, set_deadline
+
+API_MAX_INFLIGHT = int(os.getenv("API_MAX_INFLIGHT", "32"))
+API_MAX_QUEUE_WAIT_MS = float(os.getenv("API_MAX_QUEUE_WAIT_MS", "200"))
+API_DEFAULT_DEADLINE_MS = float(os.getenv("API_DEFAULT_DEADLINE_MS", "10000"))
+API_MAX_DEADLINE_MS = float(os.getenv("API_MAX_DEADLINE_MS", "30000"))
+DEADLINE_HEADER = "X-Request-Deadline-Ms"
+
+
+class Overloaded(RuntimeError):
+    """Degraded request with nothing cached to serve."""
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = API_MAX_INFLIGHT, max_queue_wait_ms: float = API_MAX_QUEUE_WAIT_MS):
+        self.max_inflight = max_inflight
+        self.max_queue_wait = max_queue_wait_ms / 1000
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._stats = {"inflight": 0, "admitted": 0, "degraded": 0, "deadline_exceeded": 0}
+
+    def admit(self) -> bool:
+        """Waits up to the queue threshold (or the remaining budget) for a slot."""
+        wait = self.max_queue_wait
+        left = remaining()
+        if left is not None:
+            wait = max(min(wait, left), 0.0)
+        admitted = self._slots.acquire(timeout=wait)
+        with self._lock:
+            if admitted:
+                self._stats["inflight"] += 1
+                self._stats["admitted"] += 1
+            else:
+                self._stats["degraded"] += 1
+        return admitted
+
+    def release(self):
+        with self._lock:
+            self._stats["inflight"] -= 1
+        self._slots.release()
+
+    def record_deadline_exceeded(self):
+        with self._lock:
+            self._stats["deadline_exceeded"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"max_inflight": self.max_inflight, **self._stats}
+
+
+admission = AdmissionController()
+
+
+def request_budget_secs() -> float:
+    raw = request.headers.get(DEADLINE_HEADER)
+    try:
+        budget_ms = float(raw) if raw is not None else API_DEFAULT_DEADLINE_MS
+    except ValueError:
+        budget_ms = API_DEFAULT_DEADLINE_MS
+    return min(max(budget_ms, 0.0), API_MAX_DEADLINE_MS) / 1000
+
+
+def deadline_aware(handler):
+    """
+    Runs the handler under the request's deadline. Sets g.degraded when the
+    request was shed from full processing; DeadlineExceeded becomes a 504.
+    """
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        token = set_deadline(request_budget_secs())
+        g.request_started = time.monotonic()
+        admitted = admission.admit()
+        g.degraded = not admitted
+        try:
+            return handler(*args, **kwargs)
+        except DeadlineExceeded as e:
+            admission.record_deadline_exceeded()
+            return jsonify({"message": str(e)}), 504
+        finally:
+            if admitted:
+                admission.release()
+            reset_deadline(token)
+    return wrapper
@@ -1,24 +1,208 @@
-from flask import Flask, request, jsonify
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-from run_fico_pipeline import predict_fico, credit_to_interest_and_loan
-from model.walletEtl import get_wallet_features
-import numpy as np
-import pandas as pd
+from admission import Overloaded, admission, deadline_aware
+from cluster import cluster_status, gather, gather_cached, owner_of, sharded
+
+# Heavy modules (pandas, xgboost, the pickled model) are imported on
+# first use or by warm_up(), so importing this module stays within the
+# startup budget checked by `python serve.py --check-startup`.
 
 app = Flask(__name__)
 CORS(app)
 
+TX_PAGE_DEFAULT = 50
+TX_PAGE_MAX = 500
+LEADERBOARD_MAX = 100
+WALLET_ADDRESS = re.compile(r"0x[0-9a-fA-F]{40}")
+
+_ready = threading.Event()
+_warm_up_lock = threading.Lock()
+_warm_up_pid = None
+
+def warm_up():
+    """
+    Imports the scoring stack, loads the model artifacts and runs one prediction
+    so the first real request pays none of it. Flips /ready when done.
+    """
+    import numpy as np
+    import run_fico_pipeline
+    import model.feature_cache  # noqa: F401 (pandas, explorer client, local store)
+    from model.features import MODEL_FEATURES
+
+    run_fico_pipeline.load_model_artifacts()
+    run_fico_pipeline.scores_from_features(np.zeros((1, len(MODEL_FEATURES))))
+    _ready.set()
+
+def start_background_warm_up():
+    """Starts warm_up() once per process (workers forked after warm-up are already ready)."""
+    global _warm_up_pid
+    if _ready.is_set() or _warm_up_pid == os.getpid():
+        return
+    with _warm_up_lock:
+        if _warm_up_pid == os.getpid():
+            return
+        _warm_up_pid = os.getpid()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+@app.before_request
+def ensure_warm_up():
+    start_background_warm_up()
+
+def load_scored_snapshot(wallet, chain):
+    """
+    Returns the wallet's (possibly stale) snapshot and its FICO score, scoring
+    and caching the score if this snapshot has not been scored yet.
+    Degraded requests only read the cache: no fetch, no inference, so the
+    score is None when the cached snapshot was never scored.
+    """
+    from model.feature_cache import get_wallet_snapshot, load_snapshot, save_score
+    from run_fico_pipeline import score_wallet_features
+
+    if g.get("degraded"):
+        snapshot = load_snapshot(wallet, chain)
+        if snapshot is None:
+            raise Overloaded("Server is overloaded and has no cached data for this wallet")
+        return snapshot, snapshot.score
+
+    snapshot = get_wallet_snapshot(wallet, chain)
+    score = snapshot.score
+    if score is None:
+        score = float(score_wallet_features(snapshot.summary_df, snapshot.tx_df, wallet, chain))
+        save_score(wallet, chain, snapshot.fetched_at, score)
+    return snapshot, score
+
+def freshness(snapshot):
+    return {
+        "stale": snapshot.stale,
+        "data_age_seconds": round(snapshot.age_seconds, 1),
+        "degraded": bool(g.get("degraded"))
+    }
+
+def sum_histograms(bodies):
+    import numpy as np
+    from model.score_index import N_BUCKETS
+
+    total = np.zeros(N_BUCKETS, dtype=np.int64)
+    for body in bodies:
+        if body["histogram"]:
+            buckets, wallets = np.array(body["histogram"], dtype=np.int64).T
+            np.add.at(total, buckets, wallets)
+    return total
+
+def population_position(kind, chain, score, cached=False):
+    """
+    Percentile and rank of `score` among every indexed wallet, summed over the
+    cluster's shards. cached=True counts the other shards from their score
+    histograms as of the last background refresh instead of asking them now.
+    Shards add up only when every node has its own store (see serve.py).
+    """
+    from model.score_index import counts, counts_from_histogram, percentile_from_counts
+
+    below, tied, population = counts(kind, chain, score)
+    if cached:
+        peers = gather_cached("/api/score-index", {"kind": kind, "chain": chain, "histogram": 1}, sum_histograms)
+        peer_counts = [] if peers is None else [counts_from_histogram(peers, score)]
+    else:
+        peer_counts = [
+            (peer["below"], peer["tied"], peer["population"])
+            for peer in gather("/api/score-index", {"kind": kind, "chain": chain, "score": score})
+        ]
+    for peer_below, peer_tied, peer_population in peer_counts:
+        below += peer_below
+        tied += peer_tied
+        population += peer_population
+    return {**percentile_from_counts(score, below, tied, population), "below": below, "tied": tied}
+
+def network_features(wallet, chain):
+    """Counterparty-graph position of the wallet among every stored transaction (None until first built)."""
+    from model.feature_cache import cached_network_features
+
+    row = cached_network_features(wallet, chain)
+    if row is None:
+        return None
+    avg_score = row["counterparty_avg_score"]
+    return {
+        "counterparties": int(row["degree"]),
+        "scored_counterparties": int(row["scored_counterparties"]),
+        "counterparty_avg_score": None if avg_score != avg_score else round(float(avg_score), 2)
+    }
+
+def wallet_error(wallet):
+    """400 response for a missing or malformed address (checked before any explorer call), else None."""
+    if not wallet:
+        return jsonify({"message": "Missing wallet_address"}), 400
+    if not isinstance(wallet, str) or not WALLET_ADDRESS.fullmatch(wallet):
+        return jsonify({"message": "wallet_address must be a 0x-prefixed 20-byte hex address"}), 400
+    return None
+
+def chain_error(chain):
+    """400 response for a non-string chain, else None."""
+    if not isinstance(chain, str):
+        return jsonify({"message": "chain must be a string"}), 400
+    return None
+
+def timestamp_to_date(ts):
+    if not ts:
+        return None
+    return datetime.utcfromtimestamp(float(ts)).strftime("%Y-%m-%d")
+
+def upstream_error_response(e):
+    # Safe to import here: any of these exceptions means the modules are loaded
+    from requests import RequestException
+    from model.circuit_breaker import CircuitOpenError
+    from model.deadline import DeadlineExceeded
+    from model.explorer_scheduler import ExplorerError, SchedulerSaturated
+
+    if isinstance(e, (Overloaded, SchedulerSaturated)):
+        return jsonify({"message": str(e)}), 503, {"Retry-After": "1"}
+    if isinstance(e, CircuitOpenError):
+        return jsonify({"message": str(e)}), 503
+    if isinstance(e, DeadlineExceeded):
+        admission.record_deadline_exceeded()
+        return jsonify({"message": str(e)}), 504
+    if isinstance(e, TimeoutError):
+        return jsonify({"message": str(e)}), 504
+    if isinstance(e, RequestException):
+        # Request URLs carry API keys, so don't echo the exception text
+        return jsonify({"message": "Upstream explorer request failed"}), 502
+    if isinstance(e, ExplorerError):
+        return jsonify({"message": str(e)}), 502
+    return jsonify({"message": str(e)}), 500
+
 @app.route("/api/fico-score", methods=["POST"])
+@sharded
+@deadline_aware
 def fico_score():
     data = request.get_json()
     wallet = data.get("wallet_address")
-    chain = data.get("chain", "flow-evm").lower()
+    chain = data.get("chain", "flow-evm")
 
-    if not wallet:
-        return jsonify({"message": "Missing wallet_address"}), 400
+    error = wallet_error(wallet) or chain_error(chain)
+    if error:
+        return error
+    chain = chain.lower()
+
+    if chain == "all":
+        if g.degraded:
+            return jsonify({"message": "Server is overloaded; cross-chain scoring is unavailable"}), 503, {"Retry-After": "1"}
+        return cross_chain_fico_score(wallet, data.get("chains"))
 
     try:
-        score = predict_fico(wallet, chain=chain)
+        from run_fico_pipeline import credit_to_interest_and_loan
+
+        snapshot, score = load_scored_snapshot(wallet, chain)
+        if score is None:
+            # Degraded and never scored: answer with the cached features only
+            return jsonify({
+                "fico_score": None,
+                "features": snapshot.summary_df.iloc[0].to_dict(),
+                **freshness(snapshot)
+            })
         interest, amount = credit_to_interest_and_loan(score)
         if score < 30:  # Lowered from 60 to 30
             interest = None
@@ -26,23 +210,48 @@ def fico_score():
         return jsonify({
             "fico_score": round(score, 2),
             "interest_rate": interest,
-            "max_loan_amount": amount
+            "max_loan_amount": amount,
+            **freshness(snapshot)
         })
     except Exception as e:
-        return jsonify({"message": str(e)}), 500
+        return upstream_error_response(e)
+
+def cross_chain_fico_score(wallet, chains=None):
+    """`chain: "all"` scores the address over every explorer chain (or `chains`) merged."""
+    try:
+        from run_fico_pipeline import credit_to_interest_and_loan, predict_fico_cross_chain
+
+        result = predict_fico_cross_chain(wallet, chains=chains)
+        interest, amount = credit_to_interest_and_loan(result.score)
+        return jsonify({
+            "fico_score": round(result.score, 2),
+            "interest_rate": interest,
+            "max_loan_amount": amount,
+            "chains": result.chains,
+            "stale": result.stale
+        })
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        return upstream_error_response(e)
 
 @app.route("/api/wallet-analytics", methods=["POST"])
+@sharded
+@deadline_aware
 def wallet_analytics():
     data = request.get_json()
     wallet = data.get("wallet_address")
-    chain = data.get("chain", "flow-evm").lower()
+    chain = data.get("chain", "flow-evm")
 
-    if not wallet:
-        return jsonify({"message": "Missing wallet_address"}), 400
+    error = wallet_error(wallet) or chain_error(chain)
+    if error:
+        return error
+    chain = chain.lower()
 
     try:
-        summary_df, tx_df = get_wallet_features(wallet, chain=chain)
-        
+        snapshot, score = load_scored_snapshot(wallet, chain)
+        summary_df, tx_df = snapshot.summary_df, snapshot.tx_df
+
         if summary_df.empty:
             return jsonify({
                 "wallet_stats": {
@@ -89,33 +298,116 @@ def wallet_analytics():
                 "total_transactions": int(wallet_data["tx_count"]),
                 "avg_transaction_value": round(float(wallet_data["avg_tx_value_eth"]), 6),
                 "active_days": int(wallet_data["active_days"]),
-                "total_volume_eth": round(float(tx_df["value_eth"].sum() if not tx_df.empty else 0), 6),
-                "incoming_transactions": len([tx for _, tx in tx_df.iterrows() if str(tx.get("to", "")).lower() == wallet.lower()]) if not tx_df.empty else 0,
-                "outgoing_transactions": len([tx for _, tx in tx_df.iterrows() if str(tx.get("from", "")).lower() == wallet.lower()]) if not tx_df.empty else 0,
-                "first_transaction_date": None,
-                "last_transaction_date": None,
-                "recent_transactions_30d": 0
+                "total_volume_eth": round(float(wallet_data["total_volume_eth"]), 6),
+                "incoming_transactions": int(wallet_data["incoming_tx_count"]),
+                "outgoing_transactions": int(wallet_data["outgoing_tx_count"]),
+                "first_transaction_date": timestamp_to_date(wallet_data["first_tx_timestamp"]),
+                "last_transaction_date": timestamp_to_date(wallet_data["last_tx_timestamp"]),
+                "recent_transactions_30d": int(wallet_data["tx_count_30d"])
             },
-            "fico_score": predict_fico(wallet, chain=chain),
-            "transactions": transactions
+            "token_analytics": {
+                "token_transfers": int(wallet_data["token_transfer_count"]),
+                "tokens": int(wallet_data["token_count"]),
+                "volume_usd": round(float(wallet_data["token_volume_usd"]), 2),
+                "incoming_usd": round(float(wallet_data["token_in_volume_usd"]), 2),
+                "outgoing_usd": round(float(wallet_data["token_out_volume_usd"]), 2),
+                "stablecoin_volume_usd": round(float(wallet_data["stablecoin_volume_usd"]), 2),
+                "top_token_share": round(float(wallet_data["top_token_volume_share"]), 4),
+                "unpriced_transfers": int(wallet_data["unpriced_transfer_count"]),
+                # Zeros until the batch-lane token fetch after a first interactive fetch lands
+                "pending": bool(wallet_data.get("token_features_pending", 0.0))
+            },
+            "network": None if g.degraded else network_features(wallet, chain),
+            "fico_score": score,
+            "transactions": transactions,
+            **freshness(snapshot)
         })
     except Exception as e:
-        return jsonify({"message": str(e)}), 500
+        return upstream_error_response(e)
+
+@app.route("/api/transactions", methods=["GET"])
+@sharded
+def wallet_transactions():
+    """
+    One page of the wallet's stored history, newest first, streamed as NDJSON:
+    a line per transaction, then {"page": {"count", "next_cursor", "backfilling"}}.
+    next_cursor is null once the full history has been paged; while older
+    history is being fetched from the explorer ("backfilling"), retry with it.
+    Only wallets already scored on this chain are backfilled.
+
+    Query: wallet_address, chain, cursor, limit, direction (in/out),
+    since/until (unix seconds, until exclusive), fields (comma-separated).
+    """
+    from model.tx_store import decode_cursor, encode_cursor, iter_wallet_transactions
+
+    args = request.args
+    wallet = args.get("wallet_address")
+    chain = args.get("chain", "flow-evm").lower()
+    error = wallet_error(wallet)
+    if error:
+        return error
+    try:
+        cursor = args.get("cursor") or None
+        if cursor:
+            decode_cursor(cursor)
+        limit = min(max(int(args.get("limit", TX_PAGE_DEFAULT)), 1), TX_PAGE_MAX)
+        since = int(args["since"]) if args.get("since") else None
+        until = int(args["until"]) if args.get("until") else None
+        direction = args.get("direction") or None
+        if direction not in (None, "in", "out"):
+            raise ValueError("direction must be 'in' or 'out'")
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+    fields = [f for f in args.get("fields", "").split(",") if f]
+
+    # One row past the page tells us whether there is a next page
+    rows = iter_wallet_transactions(chain, wallet, cursor, limit + 1, direction, since, until)
+
+    def generate():
+        count, next_cursor, has_more = 0, cursor, False
+        for tx in rows:
+            if count == limit:
+                has_more = True
+                break
+            record = {**tx.record, "tx_id": tx.tx_id, "direction": tx.direction}
+            if fields:
+                record = {name: record.get(name) for name in fields}
+            yield json.dumps(record) + "\n"
+            count += 1
+            next_cursor = encode_cursor(tx.timestamp, tx.tx_id)
+
+        backfilling = False
+        if not has_more:
+            # Reached the oldest stored row: fetch older history unless the range excludes it
+            if since is None:
+                from model.feature_cache import schedule_backfill
+                backfilling = schedule_backfill(wallet, chain)
+            if not backfilling:
+                next_cursor = None
+        yield json.dumps({"page": {"count": count, "next_cursor": next_cursor, "backfilling": backfilling}}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 @app.route("/api/karma-score", methods=["POST"])
+@sharded
+@deadline_aware
 def karma_score():
     data = request.get_json()
     wallet = data.get("wallet_address")
-    chain = data.get("chain", "flow-evm").lower()
+    chain = data.get("chain", "flow-evm")
 
-    if not wallet:
-        return jsonify({"message": "Missing wallet_address"}), 400
+    error = wallet_error(wallet) or chain_error(chain)
+    if error:
+        return error
+    chain = chain.lower()
 
     try:
-        # Get FICO score and wallet analytics
-        fico = predict_fico(wallet, chain=chain)
-        summary_df, tx_df = get_wallet_features(wallet, chain=chain)
-        
+        # Get FICO score and wallet analytics from a single snapshot
+        snapshot, fico = load_scored_snapshot(wallet, chain)
+        if fico is None:
+            raise Overloaded("Server is overloaded and this wallet has no cached score")
+        summary_df = snapshot.summary_df
+
         if summary_df.empty:
             return jsonify({
                 "karma_score": 0,
@@ -130,25 +422,29 @@ def karma_score():
 
         wallet_data = summary_df.iloc[0]
         
-        # Calculate Karma components (0-100 scale)
-        age_score = min(wallet_data["wallet_age_days"] / 365 * 100, 100)
-        
-        frequency_score = min(wallet_data["tx_count"] / 100 * 100, 100)
-        
-        consistency_score = min(wallet_data["active_days"] / 30 * 100, 100) if wallet_data["active_days"] > 0 else 0
-        
+        # Calculate Karma components (0-100 scale) from the summary's wallet-level features
+        from model.features import KARMA_FEATURES, compute_wallet_features
+        components = compute_wallet_features(
+            snapshot.tx_df, wallet, KARMA_FEATURES,
+            {name: wallet_data[name] for name in ("wallet_age_days", "tx_count", "active_days")}
+        )
+        age_score = components["karma_age_score"]
+        frequency_score = components["karma_frequency_score"]
+        consistency_score = components["karma_consistency_score"]
+
         credit_score = fico
-        
-        # Weighted Karma score
-        karma = (age_score * 0.2 + frequency_score * 0.25 + consistency_score * 0.25 + credit_score * 0.3)
-        
-        # Risk assessment
-        if karma >= 80:
-            risk_level = "LOW"
-        elif karma >= 60:
-            risk_level = "MEDIUM"
-        else:
-            risk_level = "HIGH"
+
+        # Weighted Karma score and risk band, same tables as portfolio re-pricing
+        from underwriting import karma_scores, risk_levels
+        karma = float(karma_scores(age_score, frequency_score, consistency_score, credit_score))
+        risk_level = str(risk_levels(karma))
+
+        # Where this wallet sits among everyone scored so far (skipped when shedding load)
+        population = None
+        if not g.degraded:
+            from model.score_index import record_score
+            record_score("karma", chain, wallet, karma)
+            population = population_position("karma", chain, karma, cached=True)
 
         return jsonify({
             "karma_score": round(karma, 1),
@@ -158,16 +454,129 @@ def karma_score():
                 "transaction_consistency": round(consistency_score, 1),
                 "creditworthiness": round(credit_score, 1)
             },
-            "risk_level": risk_level
+            "risk_level": risk_level,
+            "population": population,
+            **freshness(snapshot)
         })
     except Exception as e:
-        return jsonify({"message": str(e)}), 500
+        return upstream_error_response(e)
+
+@app.route("/api/score-index", methods=["GET"])
+@sharded
+def score_index():
+    """
+    Population position of a wallet's latest score (?wallet_address=) or of any
+    ?score=, and the number of wallets scoring in [?min, ?max]. ?kind=fico|karma.
+    ?histogram=1 lists this node's own shard as [bucket, wallets] pairs.
+    """
+    from model.score_index import SCORE_KINDS, SCORE_MAX, SCORE_MIN, count_between, histogram, latest_score
+
+    kind = request.args.get("kind", "fico")
+    chain = request.args.get("chain", "flow-evm").lower()
+    if kind not in SCORE_KINDS:
+        return jsonify({"message": f"kind must be one of {list(SCORE_KINDS)}"}), 400
+    if request.args.get("histogram"):
+        counts = histogram(kind, chain)
+        buckets = counts.nonzero()[0]
+        return jsonify({"kind": kind, "chain": chain, "histogram": [[int(b), int(counts[b])] for b in buckets]})
+    wallet = request.args.get("wallet_address")
+    score = request.args.get("score", type=float)
+    low = request.args.get("min", type=float)
+    high = request.args.get("max", type=float)
+
+    if wallet:
+        score = latest_score(kind, chain, wallet)
+        if score is None:
+            return jsonify({"message": f"No {kind} score indexed for this wallet on {chain}"}), 404
+    result = {"kind": kind, "chain": chain, "wallet_address": wallet}
+    if score is not None:
+        result.update(population_position(kind, chain, score))
+    if low is not None or high is not None or score is None:
+        low = SCORE_MIN if low is None else low
+        high = SCORE_MAX if high is None else high
+        in_range = count_between(kind, chain, low, high)
+        for peer in gather("/api/score-index", {"kind": kind, "chain": chain, "min": low, "max": high}):
+            in_range += peer["in_range"]
+        result.update({"min": low, "max": high, "in_range": in_range})
+    return jsonify(result)
+
+@app.route("/api/leaderboard", methods=["GET"])
+def score_leaderboard():
+    # ?kind=fico|karma&chain=...&order=top|bottom&limit=N, optionally within ?min= / ?max=
+    from model.score_index import SCORE_KINDS, leaderboard
+
+    kind = request.args.get("kind", "fico")
+    chain = request.args.get("chain", "flow-evm").lower()
+    order = request.args.get("order", "top")
+    if kind not in SCORE_KINDS or order not in ("top", "bottom"):
+        return jsonify({"message": f"kind must be one of {list(SCORE_KINDS)} and order top or bottom"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), LEADERBOARD_MAX)
+    low = request.args.get("min", type=float)
+    high = request.args.get("max", type=float)
+
+    top = order == "top"
+    wallets = leaderboard(kind, chain, limit, top=top, low=low, high=high)
+    params = {"kind": kind, "chain": chain, "order": order, "limit": limit}
+    params.update({k: v for k, v in (("min", low), ("max", high)) if v is not None})
+    for peer in gather("/api/leaderboard", params):
+        wallets.extend(peer["wallets"])
+    # A wallet indexed on two nodes (its owner changed with the membership) is listed once, latest score
+    latest = {}
+    for entry in wallets:
+        if entry["wallet"] not in latest or entry["updated_at"] > latest[entry["wallet"]]["updated_at"]:
+            latest[entry["wallet"]] = entry
+    # Each shard is already sorted; merge and keep the best `limit`
+    wallets = sorted(latest.values(), key=lambda w: (w["score"], w["wallet"]), reverse=top)
+    return jsonify({"kind": kind, "chain": chain, "order": order, "wallets": wallets[:limit]})
+
+@app.route("/api/upstream-status", methods=["GET"])
+def upstream_status():
+    from model.circuit_breaker import breaker_states
+    from model.explorer_scheduler import get_scheduler
+
+    return jsonify({
+        "circuit_breakers": breaker_states(),
+        "admission": admission.stats(),
+        "explorer_scheduler": get_scheduler().stats()
+    })
+
+@app.route("/api/shadow-status", methods=["GET"])
+def shadow_status():
+    # Candidate models vs production, from the background shadow scorer
+    from shadow import get_shadow_scorer, shadow_summary
+
+    since = request.args.get("since", type=float)
+    return jsonify({"scorer": get_shadow_scorer().stats(), "models": shadow_summary(since)})
+
+@app.route("/api/feature-drift", methods=["GET"])
+def feature_drift():
+    # Live MODEL_FEATURES distribution (all workers on this node) vs the production scaler
+    from feature_drift import drift_report
+
+    return jsonify(drift_report())
+
+@app.route("/api/cluster", methods=["GET"])
+def cluster_info():
+    # ?wallet_address=...&chain=... also reports which node owns that wallet
+    status = cluster_status()
+    wallet = request.args.get("wallet_address")
+    if wallet:
+        status["owner"] = owner_of(request.args.get("chain", "flow-evm"), wallet)
+    return jsonify(status)
 
 @app.route("/", methods=["GET"])
 def health_check():
     return jsonify({"status": "healthy", "message": "OnChain FICO API is running"})
 
+@app.route("/ready", methods=["GET"])
+def readiness_check():
+    # Liveness stays on "/"; this only reports ready once the model is warm
+    if _ready.is_set():
+        return jsonify({"status": "ready"})
+    return jsonify({"status": "warming_up"}), 503
+
 if __name__ == "__main__":
-    import os
+    start_background_warm_up()
     port = int(os.environ.get("PORT", 5000))
+    os.environ.setdefault("KARMA_NODE_URL", f"http://127.0.0.1:{port}")
     app.run(host="0.0.0.0", port=port, debug=False)
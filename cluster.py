@@ -0,0 +1,420 @@
+"""
+Consistent-hash sharding of wallets across API nodes.
+
+Each (chain, wallet) has one owner node, picked on a hash ring with
+CLUSTER_VNODES virtual nodes per member, so its snapshot cache and in-flight
+fetch deduplication live in one place. Scoring requests that land on another
+node are proxied to the owner. Adding or removing a node only moves the keys
+on the ring arcs it gains or loses (about 1/N of them), and an unreachable
+owner's keys fall through to the next node on the ring until it is back.
+
+Membership comes from KARMA_CLUSTER_FILE (one base URL per line, re-read
+when it changes) or KARMA_CLUSTER_NODES (comma-separated base URLs), and
+KARMA_NODE_URL names this node. With no membership every request is served
+locally. Requests marked as coming from another member (forwarded or
+gather() sub-queries) are only honoured with KARMA_CLUSTER_SECRET, or when
+no secret is set, from a member's address, which needs every member on its
+own address (serve.py refuses to start a cluster where they share one). A
+node serving a wallet it does not own (failover) leaves it out of its
+population index, so cluster-wide counts never see it twice.
+
+Each node keeps its shard in its own store: snapshots, transaction history,
+the population index, drift and shadow statistics. Only the explorer
+rate-limit buckets live in the host-wide shared store (local_store.py), as
+every node on a host spends the same API keys. serve.py gives each clustered
+node <store>.<port>.sqlite3 unless --store says otherwise. Three nodes on
+one machine:
+
+    export KARMA_CLUSTER_NODES=http://127.0.0.1:5001,http://127.0.0.1:5002,http://127.0.0.1:5003
+    export KARMA_CLUSTER_SECRET=$(openssl rand -hex 16)
+    python serve.py --port 5001 &   # store model/.karma_store.5001.sqlite3
+    python serve.py --port 5002 &
+    python serve.py --port 5003 &
+"""
+import bisect
+import hashlib
+import hmac
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from flask import Response, jsonify, request
+
+from admission import DEADLINE_HEADER, request_budget_secs
+from model.deadline import bounded
+
+CLUSTER_VNODES = int(os.getenv("CLUSTER_VNODES", "128"))
+# An owner that refused a connection is skipped for this long
+CLUSTER_DOWN_SECS = float(os.getenv("CLUSTER_DOWN_SECS", "10"))
+CLUSTER_CONNECT_TIMEOUT_SECS = float(os.getenv("CLUSTER_CONNECT_TIMEOUT_SECS", "0.5"))
+# Budget for a query fanned out to the whole cluster (capped by the request's deadline)
+CLUSTER_GATHER_TIMEOUT_SECS = float(os.getenv("CLUSTER_GATHER_TIMEOUT_SECS", "2"))
+# Age after which gather_cached() refreshes its aggregate in the background
+CLUSTER_GATHER_CACHE_SECS = float(os.getenv("CLUSTER_GATHER_CACHE_SECS", "30"))
+# Shared by every member; without it, forwarded requests are trusted from member addresses only
+CLUSTER_SECRET = os.getenv("KARMA_CLUSTER_SECRET", "")
+FORWARDED_HEADER = "X-Karma-Forwarded"
+CLUSTER_TOKEN_HEADER = "X-Karma-Cluster-Token"
+OWNER_HEADER = "X-Karma-Owner"
+# Marks a gather() sub-query: answer from this node's shard only
+GATHER_HEADER = "X-Karma-Gather"
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def shard_key(chain: str, wallet: str) -> str:
+    return f"{chain.lower()}:{wallet.lower()}"
+
+
+class HashRing:
+    def __init__(self, nodes, vnodes: int = CLUSTER_VNODES):
+        self.nodes = tuple(sorted(set(nodes)))
+        self.vnodes = vnodes
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._points = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str, skip=()) -> Optional[str]:
+        """First node clockwise from the key's hash that is not in `skip`."""
+        if not self._points:
+            return None
+        start = bisect.bisect_right(self._points, _hash(key))
+        for i in range(len(self._points)):
+            node = self._owners[(start + i) % len(self._points)]
+            if node not in skip:
+                return node
+        return None
+
+
+def node_url() -> str:
+    return os.getenv("KARMA_NODE_URL", "").rstrip("/")
+
+
+_ring = None
+_members_file = (None, None, ())  # (path, mtime, nodes)
+_ring_lock = threading.Lock()
+_down: Dict[str, float] = {}
+_sessions = threading.local()
+_member_addrs: Tuple[Tuple[str, ...], FrozenSet[str], bool] = ((), frozenset(), True)  # (nodes, IPs, unique)
+_stats = {"served_local": 0, "forwarded": 0, "received_forwarded": 0, "untrusted_forwarded": 0, "owner_unreachable": 0}
+_stats_lock = threading.Lock()
+
+
+def _members() -> Tuple[str, ...]:
+    global _members_file
+    path = os.getenv("KARMA_CLUSTER_FILE")
+    if path:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return ()
+        cached_path, cached_mtime, nodes = _members_file
+        if cached_path != path or cached_mtime != mtime:
+            with open(path) as f:
+                nodes = tuple(line.strip().rstrip("/") for line in f if line.strip() and not line.startswith("#"))
+            _members_file = (path, mtime, nodes)
+        return nodes
+    return tuple(n.strip().rstrip("/") for n in os.getenv("KARMA_CLUSTER_NODES", "").split(",") if n.strip())
+
+
+def get_ring() -> Optional[HashRing]:
+    """Ring for the current membership (rebuilt only when it changes), or None when not clustered."""
+    global _ring
+    members = _members()
+    if not members:
+        return None
+    with _ring_lock:
+        if _ring is None or _ring.nodes != tuple(sorted(set(members))):
+            _ring = HashRing(members)
+            if _ring.nodes:
+                print(f"🔗 Cluster ring: {len(_ring.nodes)} nodes x {_ring.vnodes} vnodes")
+        return _ring
+
+
+def _down_nodes() -> Set[str]:
+    now = time.monotonic()
+    with _stats_lock:
+        return {node for node, until in _down.items() if until > now}
+
+
+def _count(stat: str):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def _member_addresses(ring: HashRing) -> Tuple[FrozenSet[str], bool]:
+    """Resolved member IPs, and whether no two members share one."""
+    global _member_addrs
+    nodes, addrs, unique = _member_addrs
+    if nodes != ring.nodes:
+        resolved, unique = set(), True
+        for node in ring.nodes:
+            try:
+                node_addrs = {info[4][0] for info in socket.getaddrinfo(urlsplit(node).hostname, None)}
+            except (OSError, UnicodeError):
+                print(f"⚠️  Cluster node {node} does not resolve; its forwarded requests are not trusted")
+                continue
+            unique = unique and resolved.isdisjoint(node_addrs)
+            resolved |= node_addrs
+        if not unique and not CLUSTER_SECRET:
+            print("⚠️  Cluster members share an address; forwarded requests are only trusted with KARMA_CLUSTER_SECRET")
+        addrs = frozenset(resolved)
+        _member_addrs = (ring.nodes, addrs, unique)
+    return addrs, unique
+
+
+def config_error() -> Optional[str]:
+    """Why this node must not join its cluster as configured, or None."""
+    ring = get_ring()
+    if ring is None or CLUSTER_SECRET:
+        return None
+    if not _member_addresses(ring)[1]:
+        return "cluster members share an address, so peers can't be told from local clients: set KARMA_CLUSTER_SECRET"
+    return None
+
+
+def from_peer() -> bool:
+    """Whether the request was sent by another member; a client setting the headers itself is not trusted."""
+    if not request.headers.get(FORWARDED_HEADER):
+        return False
+    if CLUSTER_SECRET:
+        return hmac.compare_digest(request.headers.get(CLUSTER_TOKEN_HEADER, ""), CLUSTER_SECRET)
+    ring = get_ring()
+    if ring is None:
+        return False
+    addrs, unique = _member_addresses(ring)
+    return unique and request.remote_addr in addrs
+
+
+def _peer_headers() -> dict:
+    headers = {FORWARDED_HEADER: node_url() or "unknown"}
+    if CLUSTER_SECRET:
+        headers[CLUSTER_TOKEN_HEADER] = CLUSTER_SECRET
+    return headers
+
+
+def _session():
+    import requests
+
+    # Keep-alive connections to the other nodes, one pool per thread
+    if not hasattr(_sessions, "session"):
+        _sessions.session = requests.Session()
+    return _sessions.session
+
+
+def _proxy(owner: str, budget_secs: float) -> Response:
+    resp = _session().request(
+        request.method,
+        owner + request.full_path,
+        data=request.get_data(),
+        headers={
+            "Content-Type": request.headers.get("Content-Type", "application/json"),
+            DEADLINE_HEADER: str(int(budget_secs * 1000)),
+            **_peer_headers(),
+        },
+        timeout=(CLUSTER_CONNECT_TIMEOUT_SECS, budget_secs),
+        stream=True,
+    )
+
+    def body():
+        import requests
+
+        # Relay chunks as the owner sends them (NDJSON pages stream end to end)
+        try:
+            yield from resp.iter_content(chunk_size=None)
+        except requests.RequestException as e:
+            # Headers are already sent: all that's left is to end the body early
+            print(f"⚠️  Proxied response from {owner} cut off: {type(e).__name__}")
+        finally:
+            resp.close()
+
+    proxied = Response(body(), status=resp.status_code, content_type=resp.headers.get("Content-Type"))
+    if "Retry-After" in resp.headers:
+        proxied.headers["Retry-After"] = resp.headers["Retry-After"]
+    proxied.headers[OWNER_HEADER] = owner
+    return proxied
+
+
+def sharded(handler):
+    """
+    Serves the request here if this node owns its (chain, wallet), otherwise
+    proxies it to the owner within the request's deadline. Requests already
+    forwarded by another node are always served locally, so differing
+    membership views cannot loop.
+    """
+    @wraps(handler)
+    def wrapper(*args, **kwargs):
+        ring = get_ring()
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = request.args
+        wallet, chain = data.get("wallet_address"), data.get("chain", "flow-evm")
+        # Malformed fields are left to the handler's own validation, served here
+        routable = ring is not None and wallet and isinstance(wallet, str) and isinstance(chain, str)
+        key = shard_key(chain, wallet) if routable else None
+        me = node_url()
+
+        def serve():
+            if key is None or ring.owner(key) == me:
+                return handler(*args, **kwargs)
+            from model.score_index import not_owner
+
+            with not_owner():
+                return handler(*args, **kwargs)
+
+        if from_peer():
+            _count("received_forwarded")
+            return serve()
+        if request.headers.get(FORWARDED_HEADER):
+            _count("untrusted_forwarded")  # routed like any client request
+        if key is None:
+            return handler(*args, **kwargs)
+
+        import requests
+
+        skip = _down_nodes()
+        budget = request_budget_secs()
+        # Try the owner, then (if it is unreachable) the next node on the ring
+        for _ in range(2):
+            owner = ring.owner(key, skip)
+            if owner is None or owner == me:
+                break
+            try:
+                response = _proxy(owner, budget)
+                _count("forwarded")
+                return response
+            except requests.exceptions.ConnectionError:
+                print(f"⚠️  Cluster node {owner} unreachable, skipping it for {CLUSTER_DOWN_SECS:.0f}s")
+                _count("owner_unreachable")
+                with _stats_lock:
+                    _down[owner] = time.monotonic() + CLUSTER_DOWN_SECS
+                skip.add(owner)
+            except requests.exceptions.Timeout:
+                return jsonify({"message": f"Owner node {owner} did not answer within the deadline"}), 504
+        _count("served_local")
+        return serve()
+    return wrapper
+
+
+_gather_pool = (None, None)  # (pid, executor)
+
+
+def _gather_executor() -> ThreadPoolExecutor:
+    global _gather_pool
+    pid, executor = _gather_pool
+    if pid != os.getpid():
+        executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cluster-gather")
+        _gather_pool = (os.getpid(), executor)
+    return executor
+
+
+def _gather(path: str, params: dict, timeout: float) -> List[dict]:
+    import requests
+
+    ring = get_ring()
+    me = node_url()
+    down = _down_nodes()
+    peers = [node for node in ring.nodes if node != me and node not in down] if ring else []
+    if not peers or timeout <= 0:
+        return []
+
+    def fetch(node):
+        try:
+            resp = _session().get(
+                node + path, params=params, headers={**_peer_headers(), GATHER_HEADER: "1"},
+                timeout=(min(CLUSTER_CONNECT_TIMEOUT_SECS, timeout), timeout),
+            )
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"⚠️  Cluster node {node} left out of {path}: {type(e).__name__}")
+            return None
+
+    futures = {_gather_executor().submit(fetch, node): node for node in peers}
+    done, late = wait(futures, timeout=timeout)
+    for future in late:
+        future.cancel()
+        print(f"⚠️  Cluster node {futures[future]} left out of {path}: no answer within {timeout:.2f}s")
+    return [body for body in (future.result() for future in done) if body is not None]
+
+
+def gather(path: str, params: dict) -> List[dict]:
+    """
+    GETs `path` from every other live member, marked so each answers from
+    its own shard only, and returns the JSON bodies that came back within
+    CLUSTER_GATHER_TIMEOUT_SECS and the request's deadline (failed or late
+    members are left out). Empty when not clustered or when this request is
+    itself one of those sub-queries.
+    """
+    if get_ring() is None or (request.headers.get(GATHER_HEADER) and from_peer()):
+        return []
+    return _gather(path, params, bounded(min(CLUSTER_GATHER_TIMEOUT_SECS, request_budget_secs())))
+
+
+_gathered: Dict[tuple, Tuple[float, object]] = {}  # key -> (monotonic time, combined value)
+_gathering = (None, set())  # (pid, keys being refreshed)
+_gathered_lock = threading.Lock()
+
+
+def _refresh_gathered(key: tuple, path: str, params: dict, combine: Callable[[List[dict]], object]):
+    try:
+        value = combine(_gather(path, params, CLUSTER_GATHER_TIMEOUT_SECS))
+        with _gathered_lock:
+            _gathered[key] = (time.monotonic(), value)
+    except Exception as e:
+        print(f"⚠️  Cluster aggregate of {path} not refreshed: {e}")
+    finally:
+        with _gathered_lock:
+            _gathering[1].discard(key)
+
+
+def gather_cached(path: str, params: dict, combine: Callable[[List[dict]], object],
+                  max_age: float = CLUSTER_GATHER_CACHE_SECS):
+    """
+    combine() of the last gather() of `path`, refreshed in a background
+    thread once older than `max_age`, so the request never waits on other
+    members. None until the first refresh lands, and when not clustered.
+    """
+    global _gathering
+    if get_ring() is None or (request.headers.get(GATHER_HEADER) and from_peer()):
+        return None
+    key = (path, tuple(sorted(params.items())))
+    with _gathered_lock:
+        fetched_at, value = _gathered.get(key, (None, None))
+        pid, refreshing = _gathering
+        if pid != os.getpid():
+            # Refresh threads don't survive a fork
+            refreshing = set()
+            _gathering = (os.getpid(), refreshing)
+        if (fetched_at is None or time.monotonic() - fetched_at > max_age) and key not in refreshing:
+            refreshing.add(key)
+            threading.Thread(
+                target=_refresh_gathered, args=(key, path, params, combine), name="cluster-gather-cache", daemon=True
+            ).start()
+    return value
+
+
+def owner_of(chain: str, wallet: str) -> Optional[str]:
+    ring = get_ring()
+    return ring.owner(shard_key(chain, wallet), _down_nodes()) if ring else None
+
+
+def cluster_status() -> dict:
+    ring = get_ring()
+    down = sorted(_down_nodes())
+    with _stats_lock:
+        stats = dict(_stats)
+    return {
+        "node": node_url() or None,
+        "members": list(ring.nodes) if ring else [],
+        "vnodes": ring.vnodes if ring else 0,
+        "down": down,
+        **stats,
+    }
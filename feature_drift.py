@@ -0,0 +1,360 @@
+"""
+Online statistics of live MODEL_FEATURES vectors and their drift from the
+scaler's training distribution.
+
+score_wallet_features hands every scored vector to record(). Threads are
+spread round-robin over FEATURE_STATS_SHARDS shards, each holding streaming
+moments (count, mean and sum of squared deviations, merged with Chan's
+formula) and a log-bucket quantile sketch (relative accuracy
+SKETCH_RELATIVE_ACCURACY) behind its own lock. Both are fixed-size and so is
+the pool, so memory stays constant however much traffic and however many
+request threads are seen. A background thread per process merges the shards
+into the local store (feature_stats) every FEATURE_STATS_FLUSH_SECS, so
+reports cover every preforked worker. A worker that has not flushed for
+FEATURE_STATS_RETIRE_SECS is taken for dead: its row is folded into one
+"retired" row, so the table stays one row per live worker (plus one) while
+reports keep the full history until --reset.
+
+drift_report() compares the live distribution with the production scaler's
+mean_ / scale_. refreshed_scaler() is a StandardScaler fitted to the live
+moments without another pass over history:
+
+    python feature_drift.py                          # drift report
+    python feature_drift.py --emit-candidate live-scaler   # production model + refreshed scaler
+    python feature_drift.py --emit-scaler /tmp/scaler.pkl
+
+An emitted candidate is picked up by the shadow scorer (shadow.py), which
+shows how scores would move before the scaler is promoted.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import pickle
+import shutil
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from model.features import MODEL_FEATURES
+from model.local_store import connect, register_schema, transaction
+
+SKETCH_RELATIVE_ACCURACY = 0.02
+# Magnitudes outside this range share the first/last bucket
+SKETCH_MIN_VALUE, SKETCH_MAX_VALUE = 1e-6, 1e15
+FEATURE_STATS_FLUSH_SECS = float(os.getenv("FEATURE_STATS_FLUSH_SECS", "30"))
+FEATURE_STATS_SHARDS = int(os.getenv("FEATURE_STATS_SHARDS", "16"))
+# Live workers rewrite their row every flush; one this quiet has exited
+FEATURE_STATS_RETIRE_SECS = float(os.getenv("FEATURE_STATS_RETIRE_SECS", "86400"))
+RETIRED_WORKER = "retired"
+FEATURE_DRIFT_MIN_OBSERVATIONS = int(os.getenv("FEATURE_DRIFT_MIN_OBSERVATIONS", "100"))
+# A feature drifts when its mean moves this many training sigmas, its spread
+# changes by this factor either way, or this share of it lies beyond 3 sigmas
+DRIFT_MEAN_SIGMAS = float(os.getenv("DRIFT_MEAN_SIGMAS", "0.5"))
+DRIFT_STD_RATIO = float(os.getenv("DRIFT_STD_RATIO", "2.0"))
+DRIFT_TAIL_FRACTION = float(os.getenv("DRIFT_TAIL_FRACTION", "0.01"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS feature_stats (
+    worker TEXT PRIMARY KEY,  -- <pid>:<start time>, or RETIRED_WORKER
+    n INTEGER NOT NULL,
+    mean BLOB NOT NULL,
+    m2 BLOB NOT NULL,
+    sketch BLOB NOT NULL,
+    updated_at REAL NOT NULL
+);
+""")
+
+# === Log-bucket sketch layout ===
+# [negative buckets, largest magnitude first | zero | positive buckets]
+_GAMMA = (1 + SKETCH_RELATIVE_ACCURACY) / (1 - SKETCH_RELATIVE_ACCURACY)
+_LOG_GAMMA = np.log(_GAMMA)
+_K_MIN = int(np.floor(np.log(SKETCH_MIN_VALUE) / _LOG_GAMMA))
+_K_MAX = int(np.ceil(np.log(SKETCH_MAX_VALUE) / _LOG_GAMMA))
+_SIDE = _K_MAX - _K_MIN + 1
+_ZERO = _SIDE
+N_SKETCH_BUCKETS = 2 * _SIDE + 1
+
+
+def sketch_index(X: np.ndarray) -> np.ndarray:
+    magnitude = np.abs(X)
+    k = np.ceil(np.log(np.maximum(magnitude, SKETCH_MIN_VALUE)) / _LOG_GAMMA)
+    k = np.clip(k, _K_MIN, _K_MAX).astype(np.int64) - _K_MIN
+    index = np.where(X > 0, _ZERO + 1 + k, _ZERO - 1 - k)
+    return np.where(magnitude == 0, _ZERO, index)
+
+
+def _bucket_values() -> np.ndarray:
+    k = np.arange(_SIDE) + _K_MIN
+    positive = 2 * _GAMMA ** k / (_GAMMA + 1)
+    return np.concatenate([-positive[::-1], [0.0], positive])
+
+
+BUCKET_VALUES = _bucket_values()
+
+
+def merge_moments(a: Tuple, b: Tuple) -> Tuple:
+    """Chan et al.: combines (n, mean, m2) of two disjoint samples."""
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    if n_a == 0:
+        return b
+    if n_b == 0:
+        return a
+    n = n_a + n_b
+    delta = mean_b - mean_a
+    return n, mean_a + delta * (n_b / n), m2_a + m2_b + delta * delta * (n_a * n_b / n)
+
+
+def _empty_moments(d: int = len(MODEL_FEATURES)) -> Tuple:
+    return 0, np.zeros(d), np.zeros(d)
+
+
+class _Shard:
+    """Statistics of the threads mapped to one slot of the pool."""
+
+    def __init__(self, d: int):
+        self.moments = _empty_moments(d)
+        self.sketch = np.zeros((d, N_SKETCH_BUCKETS), dtype=np.int64)
+        self._columns = np.arange(d)
+        self.lock = threading.Lock()
+
+    def add(self, X: np.ndarray):
+        mean = X.mean(axis=0)
+        index = sketch_index(X)
+        with self.lock:
+            self.moments = merge_moments(self.moments, (len(X), mean, ((X - mean) ** 2).sum(axis=0)))
+            if len(X) == 1:
+                # The common case (one scored wallet): one bucket per column, no repeats
+                self.sketch[self._columns, index[0]] += 1
+            else:
+                np.add.at(self.sketch, (np.broadcast_to(self._columns, X.shape), index), 1)
+
+
+class FeatureMonitor:
+    def __init__(self, d: int = len(MODEL_FEATURES), flush_secs: float = FEATURE_STATS_FLUSH_SECS,
+                 n_shards: int = FEATURE_STATS_SHARDS):
+        self.d = d
+        self.flush_secs = flush_secs
+        self.n_shards = max(n_shards, 1)
+        self._pid = None
+        self._worker = None
+        self._local = threading.local()
+        self._slots = itertools.count()
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()  # startup and flushing only
+
+    def _start(self):
+        # Threads and inherited counts don't survive fork: each worker starts afresh
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._local = threading.local()
+            self._shards = [_Shard(self.d) for _ in range(self.n_shards)]
+            self._worker = f"{os.getpid()}:{time.time():.0f}"
+            self._pid = os.getpid()
+        threading.Thread(target=self._run_flusher, name="feature-stats", daemon=True).start()
+
+    def _shard(self) -> _Shard:
+        if self._pid != os.getpid():
+            self._start()
+        slot = getattr(self._local, "slot", None)
+        if slot is None:
+            # Round-robin rather than get_ident() % n: thread ids are aligned addresses
+            slot = self._local.slot = next(self._slots) % self.n_shards
+        return self._shards[slot]
+
+    def record(self, features: np.ndarray):
+        """Adds (n, d) feature rows (non-finite rows are skipped)."""
+        X = np.atleast_2d(np.asarray(features, dtype=np.float64))
+        X = X[np.isfinite(X).all(axis=1)]
+        if len(X):
+            self._shard().add(X)
+
+    def merged(self) -> Tuple[Tuple, np.ndarray]:
+        """This process's ((n, mean, m2), sketch) over every thread."""
+        moments, sketch = _empty_moments(self.d), np.zeros((self.d, N_SKETCH_BUCKETS), dtype=np.int64)
+        for shard in self._shards:
+            with shard.lock:
+                moments = merge_moments(moments, shard.moments)
+                sketch += shard.sketch
+        return moments, sketch
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            (n, mean, m2), sketch = self.merged()
+            if n == 0:
+                return
+            with transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO feature_stats (worker, n, mean, m2, sketch, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (self._worker, int(n), mean.tobytes(), m2.tobytes(), sketch.tobytes(), time.time()),
+                )
+                _retire_dead_workers(conn, self.d)
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_secs)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Feature stats flush failed: {e}")
+
+
+def _retire_dead_workers(conn, d: int):
+    """Folds the rows of workers silent for FEATURE_STATS_RETIRE_SECS into the RETIRED_WORKER row."""
+    cutoff = time.time() - FEATURE_STATS_RETIRE_SECS
+    dead = conn.execute(
+        "SELECT worker, n, mean, m2, sketch FROM feature_stats WHERE worker != ? AND updated_at < ?",
+        (RETIRED_WORKER, cutoff),
+    ).fetchall()
+    if not dead:
+        return
+    row = conn.execute("SELECT n, mean, m2, sketch FROM feature_stats WHERE worker = ?", (RETIRED_WORKER,)).fetchone()
+    moments, sketch = _empty_moments(d), np.zeros((d, N_SKETCH_BUCKETS), dtype=np.int64)
+    for n, mean, m2, counts in ([row] if row else []) + [r[1:] for r in dead]:
+        moments = merge_moments(moments, (n, np.frombuffer(mean), np.frombuffer(m2)))
+        sketch += np.frombuffer(counts, dtype=np.int64).reshape(d, N_SKETCH_BUCKETS)
+    n, mean, m2 = moments
+    conn.execute(
+        "INSERT OR REPLACE INTO feature_stats (worker, n, mean, m2, sketch, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (RETIRED_WORKER, int(n), mean.tobytes(), m2.tobytes(), sketch.tobytes(), time.time()),
+    )
+    conn.executemany("DELETE FROM feature_stats WHERE worker = ?", [(r[0],) for r in dead])
+    print(f"🧹 Feature stats: folded {len(dead)} exited worker(s) into the retired row")
+
+
+_monitor: Optional[FeatureMonitor] = None
+
+
+def get_feature_monitor() -> FeatureMonitor:
+    global _monitor
+    if _monitor is None:
+        _monitor = FeatureMonitor()
+    return _monitor
+
+
+def population_stats(d: int = len(MODEL_FEATURES)) -> Tuple[Tuple, np.ndarray, int]:
+    """((n, mean, m2), sketch, live workers) over everything flushed to the store, retired workers included."""
+    get_feature_monitor().flush()
+    moments, sketch, workers = _empty_moments(d), np.zeros((d, N_SKETCH_BUCKETS), dtype=np.int64), 0
+    for worker, n, mean, m2, counts in connect().execute("SELECT worker, n, mean, m2, sketch FROM feature_stats"):
+        moments = merge_moments(moments, (n, np.frombuffer(mean), np.frombuffer(m2)))
+        sketch += np.frombuffer(counts, dtype=np.int64).reshape(d, N_SKETCH_BUCKETS)
+        workers += worker != RETIRED_WORKER
+    return moments, sketch, workers
+
+
+def sketch_quantiles(sketch: np.ndarray, qs) -> np.ndarray:
+    """(d, len(qs)) quantile estimates, within SKETCH_RELATIVE_ACCURACY inside the sketch's range."""
+    cumulative = np.cumsum(sketch, axis=1)
+    totals = cumulative[:, -1:]
+    ranks = np.ceil(np.asarray(qs)[None, :] * totals).clip(min=1)
+    index = np.array([np.searchsorted(row, r) for row, r in zip(cumulative, ranks)])
+    return BUCKET_VALUES[np.minimum(index, N_SKETCH_BUCKETS - 1)]
+
+
+def _production_scaler():
+    from run_fico_pipeline import load_model_artifacts
+
+    return load_model_artifacts()[1]
+
+
+def drift_report(scaler=None) -> dict:
+    scaler = scaler or _production_scaler()
+    (n, mean, m2), sketch, workers = population_stats()
+    report = {"observations": int(n), "workers": workers, "features": [], "drifted": []}
+    if n == 0:
+        return report
+    std = np.sqrt(m2 / n)
+    train_mean, train_std = np.asarray(scaler.mean_), np.asarray(scaler.scale_)
+    shift = (mean - train_mean) / train_std
+    ratio = std / train_std
+    p01, p50, p99 = sketch_quantiles(sketch, (0.01, 0.5, 0.99)).T
+    # Live mass beyond the training mean +- 3 sigmas, read off the sketch buckets
+    outside = (BUCKET_VALUES[None, :] < (train_mean - 3 * train_std)[:, None]) | \
+              (BUCKET_VALUES[None, :] > (train_mean + 3 * train_std)[:, None])
+    tail = (sketch * outside).sum(axis=1) / n
+
+    for i, name in enumerate(MODEL_FEATURES):
+        drifted = bool(n >= FEATURE_DRIFT_MIN_OBSERVATIONS and (
+            abs(shift[i]) > DRIFT_MEAN_SIGMAS
+            or not 1 / DRIFT_STD_RATIO <= ratio[i] <= DRIFT_STD_RATIO
+            or tail[i] > DRIFT_TAIL_FRACTION
+        ))
+        report["features"].append({
+            "feature": name,
+            "live_mean": float(mean[i]), "live_std": float(std[i]),
+            "train_mean": float(train_mean[i]), "train_std": float(train_std[i]),
+            "mean_shift_sigmas": round(float(shift[i]), 3),
+            "std_ratio": round(float(ratio[i]), 3),
+            "tail_fraction": round(float(tail[i]), 4),
+            "p01": float(p01[i]), "p50": float(p50[i]), "p99": float(p99[i]),
+            "drifted": drifted,
+        })
+        if drifted:
+            report["drifted"].append(name)
+    return report
+
+
+def refreshed_scaler(scaler=None):
+    """Copy of the production StandardScaler refitted to the live moments."""
+    (n, mean, m2), _, _ = population_stats()
+    if n < FEATURE_DRIFT_MIN_OBSERVATIONS:
+        raise RuntimeError(f"Only {n} live observations; need {FEATURE_DRIFT_MIN_OBSERVATIONS} to refit the scaler")
+    refreshed = copy.deepcopy(scaler or _production_scaler())
+    var = m2 / n
+    refreshed.mean_ = mean.copy()
+    refreshed.var_ = var
+    # Same as StandardScaler: constant features keep unit scale
+    refreshed.scale_ = np.where(var > 0, np.sqrt(var), 1.0)
+    refreshed.n_samples_seen_ = int(n)
+    return refreshed
+
+
+def emit_scaler(path: str) -> str:
+    scaler = refreshed_scaler()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(scaler, f)
+    return path
+
+
+def emit_candidate(name: str) -> str:
+    """Production model + refreshed scaler as a shadow candidate directory."""
+    from run_fico_pipeline import MODEL_PATH
+    from shadow import SHADOW_MODELS_DIR
+
+    directory = os.path.join(SHADOW_MODELS_DIR, name)
+    emit_scaler(os.path.join(directory, "scaler.pkl"))
+    shutil.copyfile(MODEL_PATH, os.path.join(directory, "model.pkl"))
+    return directory
+
+
+def reset():
+    with transaction() as conn:
+        conn.execute("DELETE FROM feature_stats")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live feature drift against the production scaler")
+    parser.add_argument("--emit-scaler", metavar="PATH", help="Write a scaler refitted to live traffic")
+    parser.add_argument("--emit-candidate", metavar="NAME", help="Write production model + refreshed scaler as a shadow candidate")
+    parser.add_argument("--reset", action="store_true", help="Forget every collected statistic")
+    args = parser.parse_args()
+
+    if args.reset:
+        reset()
+        print("🧹 Feature statistics cleared")
+    elif args.emit_scaler:
+        print(f"📦 Refreshed scaler written to {emit_scaler(args.emit_scaler)}")
+    elif args.emit_candidate:
+        print(f"📦 Shadow candidate written to {emit_candidate(args.emit_candidate)}")
+    else:
+        print(json.dumps(drift_report(), indent=2))
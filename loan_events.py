@@ -0,0 +1,358 @@
+"""
+Pre-scoring from MultitokenLoan contract events.
+
+Follows the loan contract's logs over JSON-RPC (eth_getLogs) and queues
+every borrower and lender it sees for a background fetch and score, so their
+snapshots and scores are already cached when the frontend asks for them.
+Progress is checkpointed per contract in the local store (event_checkpoints),
+so a restarted follower resumes where it stopped; only blocks at least
+FOLLOWER_CONFIRMATIONS deep are read, so short reorgs are never followed.
+Wallets whose pre-score failed are kept in prescore_retries and retried with
+backoff on later polls, up to FOLLOWER_MAX_ATTEMPTS.
+
+    python loan_events.py                          # FLOW_EVM_RPC_URL, address from backend/deployedContracts.json
+    python loan_events.py --once                   # catch up to the head and exit
+    python loan_events.py --api-url http://127.0.0.1:5000   # warm a cluster through its API instead
+
+Against a local Hardhat node (contract deployed with scripts/deploy.js):
+
+    npx hardhat node
+    npx hardhat run scripts/deploy.js --network localhost
+    python loan_events.py --rpc-url http://127.0.0.1:8545 --confirmations 0 --from-block 0 \\
+        --address <MultitokenLoan address>
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+from model.local_store import connect, register_schema, transaction
+
+DEPLOYMENTS_PATH = os.path.join(os.path.dirname(__file__), "backend", "deployedContracts.json")
+FOLLOWER_CONFIRMATIONS = int(os.getenv("FOLLOWER_CONFIRMATIONS", "3"))
+# Blocks per eth_getLogs call; halved on "range too large" style RPC errors
+FOLLOWER_MAX_BLOCK_RANGE = int(os.getenv("FOLLOWER_MAX_BLOCK_RANGE", "2000"))
+FOLLOWER_REGROW_CHUNKS = int(os.getenv("FOLLOWER_REGROW_CHUNKS", "10"))  # unsplit chunks before doubling it back
+FOLLOWER_POLL_SECS = float(os.getenv("FOLLOWER_POLL_SECS", "5"))
+FOLLOWER_WORKERS = int(os.getenv("FOLLOWER_WORKERS", "2"))
+# Upper bound on one wallet's fetch + score
+FOLLOWER_SCORE_TIMEOUT_SECS = float(os.getenv("FOLLOWER_SCORE_TIMEOUT_SECS", "120"))
+RPC_TIMEOUT_SECS = float(os.getenv("RPC_TIMEOUT_SECS", "15"))
+FOLLOWER_RETRY_SECS = float(os.getenv("FOLLOWER_RETRY_SECS", "60"))  # doubled per failed attempt
+FOLLOWER_MAX_ATTEMPTS = int(os.getenv("FOLLOWER_MAX_ATTEMPTS", "6"))
+# eth_getLogs refusals that a smaller block range fixes; providers word them differently
+RANGE_ERROR_HINTS = (
+    "block range", "range too", "range is too", "too many", "more than", "response size", "too large", "max results",
+)
+
+# topic0 (keccak256 of the event signature) -> (event, role of the address in topics[2]).
+# Every MultitokenLoan event indexes loanId first and the party second.
+LOAN_EVENTS = {
+    # LoanRequested(uint256,address,address,uint256,uint256,uint256,string,uint256,uint256)
+    "0x4c4fa9e65b471bb48f2a9d1a536baa403ab32c896cbcc70749cfa3313677d734": ("LoanRequested", "borrower"),
+    # LoanFunded(uint256,address)
+    "0x15feab5d3eb17171632762cf769709a315dd15f487a556c0dfb8a259c8f186cc": ("LoanFunded", "lender"),
+    # LoanRepaid(uint256,address)
+    "0xe69d7686a8bc68278b8c5419579f91716b3ef2ac2fac0d8cf80b8011f8f458a4": ("LoanRepaid", "borrower"),
+    # PaymentMade(uint256,address,uint256,uint256)
+    "0xc65404633dd8ca3eaa91445ad9c825c60c158e04c83dcf2fc9067e8d13035f24": ("PaymentMade", "borrower"),
+}
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS event_checkpoints (
+    contract TEXT PRIMARY KEY,  -- <chain id>:<address>
+    last_block INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prescore_retries (
+    contract TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    retry_at REAL NOT NULL,
+    PRIMARY KEY (contract, wallet)
+);
+""")
+
+
+class RpcError(RuntimeError):
+    def __init__(self, message: str, code: Optional[int] = None):
+        super().__init__(message)
+        self.code = code
+
+    @property
+    def range_too_large(self) -> bool:
+        message = str(self).lower()
+        return any(hint in message for hint in RANGE_ERROR_HINTS)
+
+
+class RpcClient:
+    def __init__(self, url: str, timeout: float = RPC_TIMEOUT_SECS):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._next_id = 0
+
+    def call(self, method: str, params: list):
+        self._next_id += 1
+        resp = self.session.post(
+            self.url,
+            json={"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params},
+            timeout=self.timeout,
+        )
+        resp.raise_for_status()
+        body = resp.json()
+        error = body.get("error")
+        if error:
+            if not isinstance(error, dict):
+                raise RpcError(f"{method}: {error}")
+            raise RpcError(f"{method}: {error.get('message', error)}", error.get("code"))
+        return body["result"]
+
+    def chain_id(self) -> int:
+        return int(self.call("eth_chainId", []), 16)
+
+    def block_number(self) -> int:
+        return int(self.call("eth_blockNumber", []), 16)
+
+    def get_logs(self, address: str, from_block: int, to_block: int) -> list:
+        return self.call("eth_getLogs", [{
+            "address": address,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "topics": [list(LOAN_EVENTS)],
+        }])
+
+
+def deployed_address() -> Optional[str]:
+    address = os.getenv("MULTITOKEN_LOAN_ADDRESS")
+    if address:
+        return address
+    try:
+        with open(DEPLOYMENTS_PATH) as f:
+            deployments = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return next((v for k, v in deployments.items() if k.endswith("_MULTITOKEN_LOAN_ADDRESS")), None)
+
+
+def parties(logs: list) -> List[Tuple[str, str, str]]:
+    """(event, role, address) for every loan event, in log order."""
+    found = []
+    for log in logs:
+        topics = log.get("topics") or []
+        event = LOAN_EVENTS.get(topics[0].lower()) if topics else None
+        if event is None or len(topics) < 3 or log.get("removed"):
+            continue
+        found.append((event[0], event[1], "0x" + topics[2][-40:].lower()))
+    return found
+
+
+# === Checkpoints ===
+def load_checkpoint(contract: str) -> Optional[int]:
+    row = connect().execute("SELECT last_block FROM event_checkpoints WHERE contract = ?", (contract,)).fetchone()
+    return row[0] if row else None
+
+
+def save_checkpoint(contract: str, block: int):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO event_checkpoints (contract, last_block, updated_at) VALUES (?, ?, ?)",
+            (contract, block, time.time()),
+        )
+
+
+def due_retries(contract: str) -> List[str]:
+    return [row[0] for row in connect().execute(
+        "SELECT wallet FROM prescore_retries WHERE contract = ? AND retry_at <= ? ORDER BY retry_at",
+        (contract, time.time()),
+    )]
+
+
+def record_outcomes(contract: str, outcomes: Dict[str, bool]):
+    """Clears wallets that scored; schedules the others for another attempt (or gives up on them)."""
+    now = time.time()
+    with transaction() as conn:
+        for wallet, scored in outcomes.items():
+            row = conn.execute(
+                "SELECT attempts FROM prescore_retries WHERE contract = ? AND wallet = ?", (contract, wallet)
+            ).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            if scored or attempts >= FOLLOWER_MAX_ATTEMPTS:
+                if not scored:
+                    print(f"⚠️  Giving up pre-scoring {wallet} after {attempts} attempts")
+                conn.execute("DELETE FROM prescore_retries WHERE contract = ? AND wallet = ?", (contract, wallet))
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO prescore_retries (contract, wallet, attempts, retry_at) VALUES (?, ?, ?, ?)",
+                (contract, wallet, attempts, now + FOLLOWER_RETRY_SECS * 2 ** (attempts - 1)),
+            )
+
+
+# === Pre-scoring ===
+def prescore_local(wallet: str, chain: str) -> float:
+    """Fetches the wallet (batch lane, always refreshed: the event just changed its history) and caches its score."""
+    from model.feature_cache import save_score, schedule_refresh
+    from run_fico_pipeline import score_wallet_features
+
+    snapshot = schedule_refresh(wallet, chain, lane="batch").result(timeout=FOLLOWER_SCORE_TIMEOUT_SECS)
+    score = float(score_wallet_features(snapshot.summary_df, snapshot.tx_df, wallet, chain))
+    save_score(wallet, chain, snapshot.fetched_at, score)
+    return score
+
+
+def prescore_api(api_url: str, wallet: str, chain: str) -> float:
+    """Scores through the API, so a sharded cluster warms the wallet's owner node."""
+    resp = requests.post(
+        f"{api_url.rstrip('/')}/api/fico-score",
+        json={"wallet_address": wallet, "chain": chain},
+        headers={"X-Request-Deadline-Ms": str(int(FOLLOWER_SCORE_TIMEOUT_SECS * 1000))},
+        timeout=FOLLOWER_SCORE_TIMEOUT_SECS + 5,
+    )
+    resp.raise_for_status()
+    return resp.json()["fico_score"]
+
+
+class LoanEventFollower:
+    def __init__(self, rpc: RpcClient, address: str, chain: str = "flow-evm",
+                 confirmations: int = FOLLOWER_CONFIRMATIONS, max_range: int = FOLLOWER_MAX_BLOCK_RANGE,
+                 workers: int = FOLLOWER_WORKERS, api_url: Optional[str] = None):
+        self.rpc = rpc
+        self.address = address.lower()
+        self.chain = chain
+        self.confirmations = confirmations
+        self.max_range = self.range_limit = max_range
+        self._split = False
+        self._clean_chunks = 0  # chunks read since the range was last split
+        self.api_url = api_url
+        self.contract = f"{rpc.chain_id()}:{self.address}"
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prescore")
+        self.stats = {"blocks": 0, "events": 0, "scored": 0, "failed": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, stat: str, n: int = 1):
+        with self._lock:
+            self.stats[stat] += n
+
+    def _prescore(self, wallet: str) -> bool:
+        try:
+            if self.api_url:
+                score = prescore_api(self.api_url, wallet, self.chain)
+            else:
+                score = prescore_local(wallet, self.chain)
+        except Exception as e:
+            print(f"⚠️  Pre-scoring {wallet} failed: {e}")
+            self._count("failed")
+            return False
+        self._count("scored")
+        print(f"🔥 Pre-scored {wallet} on {self.chain}: {score:.2f}")
+        return True
+
+    def _prescore_all(self, wallets):
+        futures = {wallet: self._executor.submit(self._prescore, wallet) for wallet in wallets}
+        wait(futures.values())
+        if futures:
+            record_outcomes(self.contract, {wallet: future.result() for wallet, future in futures.items()})
+
+    def _logs(self, from_block: int, to_block: int) -> list:
+        try:
+            return self.rpc.get_logs(self.address, from_block, to_block)
+        except RpcError as e:
+            # Providers cap the range (or result size) of eth_getLogs differently; anything else surfaces
+            if not e.range_too_large or to_block == from_block:
+                raise
+            middle = (from_block + to_block) // 2
+            self.max_range = max(1, (to_block - from_block + 1) // 2)
+            self._split, self._clean_chunks = True, 0
+            return self._logs(from_block, middle) + self._logs(middle + 1, to_block)
+
+    def _regrow_range(self):
+        # One dense stretch of blocks shouldn't shrink the range for good
+        self._clean_chunks += 1
+        if self._clean_chunks >= FOLLOWER_REGROW_CHUNKS and self.max_range < self.range_limit:
+            self.max_range = min(self.range_limit, self.max_range * 2)
+            self._clean_chunks = 0
+
+    def poll(self, start_block: Optional[int] = None) -> int:
+        """
+        Retries due failed wallets, then reads every confirmed block past the
+        checkpoint, queues the parties of each chunk and waits for them before
+        checkpointing it, so a crash re-reads (never skips) events; wallets
+        that failed are recorded for retry. Returns the number of events seen.
+        """
+        self._prescore_all(due_retries(self.contract))
+        safe_head = self.rpc.block_number() - self.confirmations
+        last = load_checkpoint(self.contract)
+        if last is None:
+            # First run: start at the head unless told to replay history
+            last = safe_head if start_block is None else start_block - 1
+            save_checkpoint(self.contract, last)
+        seen = 0
+        while last < safe_head:
+            to_block = min(last + self.max_range, safe_head)
+            self._split = False
+            events = parties(self._logs(last + 1, to_block))
+            if not self._split:
+                self._regrow_range()
+            wallets: Dict[str, str] = {}
+            for event, role, wallet in events:
+                print(f"📜 {event}: {role} {wallet}")
+                wallets.setdefault(wallet, role)
+            self._prescore_all(wallets)
+            save_checkpoint(self.contract, to_block)
+            self._count("blocks", to_block - last)
+            self._count("events", len(events))
+            seen += len(events)
+            last = to_block
+        return seen
+
+    def run(self, interval: float = FOLLOWER_POLL_SECS, start_block: Optional[int] = None):
+        print(f"👂 Following MultitokenLoan {self.address} ({self.contract}) for {self.chain} pre-scoring")
+        while True:
+            try:
+                self.poll(start_block)
+            except (requests.RequestException, RpcError, ValueError) as e:
+                print(f"⚠️  Event poll failed, retrying in {interval:.0f}s: {e}")
+            time.sleep(interval)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-score MultitokenLoan borrowers and lenders from contract events")
+    parser.add_argument("--rpc-url", default=os.getenv("FLOW_EVM_RPC_URL"))
+    parser.add_argument("--address", default=deployed_address(), help="MultitokenLoan address")
+    parser.add_argument("--chain", default="flow-evm", help="Chain the parties are scored on")
+    parser.add_argument("--from-block", type=int, help="Replay from this block on the first run (default: head)")
+    parser.add_argument("--confirmations", type=int, default=FOLLOWER_CONFIRMATIONS)
+    parser.add_argument("--interval", type=float, default=FOLLOWER_POLL_SECS)
+    parser.add_argument("--api-url", help="Score through this API instead of the local store")
+    parser.add_argument("--once", action="store_true", help="Catch up to the head and exit")
+    args = parser.parse_args()
+    if not args.rpc_url:
+        parser.error("--rpc-url or FLOW_EVM_RPC_URL is required")
+    if not args.address:
+        parser.error("--address, MULTITOKEN_LOAN_ADDRESS or backend/deployedContracts.json is required")
+    return args
+
+
+def main():
+    args = parse_args()
+    follower = LoanEventFollower(
+        RpcClient(args.rpc_url), args.address, chain=args.chain,
+        confirmations=args.confirmations, api_url=args.api_url,
+    )
+    if args.once:
+        events = follower.poll(args.from_block)
+        print(f"✅ Caught up: {events} events, {follower.stats}")
+        return
+    try:
+        follower.run(args.interval, args.from_block)
+    except KeyboardInterrupt:
+        print(f"👋 Stopped: {follower.stats}")
+
+
+if __name__ == "__main__":
+    main()
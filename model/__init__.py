@@ -0,0 +1,4 @@
+import dotenv
+
+# Load .env before any model.* module reads its settings from the environment
+dotenv.load_dotenv()
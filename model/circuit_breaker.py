@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECS = float(os.getenv("BREAKER_RESET_SECS", "30"))
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream for this chain is failing; calls are short-circuited until it recovers."""
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker. After `failure_threshold`
+    consecutive failures the circuit opens and calls fail fast. Once
+    `reset_secs` have passed a single probe call is let through: success
+    closes the circuit, failure re-opens it for another period.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_secs: float = BREAKER_RESET_SECS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_secs:
+                return "half-open"
+            return self._state
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may proceed."""
+        with self._lock:
+            if self._state == "closed":
+                return
+            if self._state == "open" and time.monotonic() - self._opened_at < self.reset_secs:
+                raise CircuitOpenError(f"Upstream for {self.name} is unavailable (circuit open)")
+            # Reset period elapsed: allow exactly one probe through
+            if self._probe_in_flight:
+                raise CircuitOpenError(f"Upstream for {self.name} is being probed (circuit half-open)")
+            self._state = "half-open"
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == "half-open" or self._failures >= self.failure_threshold:
+                self._state = "open"
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """The call never reached the upstream (local backpressure or deadline); frees a probe slot."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        state = self.state
+        with self._lock:
+            return {"state": state, "consecutive_failures": self._failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
@@ -1,6 +1,10 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import StandardScaler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.features import FeatureEngine, TxBatch
 
 # Load the CSVs
 features_df = pd.read_csv("sim_data/sim_wallet_features.csv")
@@ -10,38 +14,13 @@ transactions_df = pd.read_csv("sim_data/sim_transaction_history.csv")
 features_df = features_df.reset_index(drop=True)
 wallets = features_df["wallet"].values
 
-X_tx_matrix = []
-y = []
-
-for wallet in wallets:
-    wallet_lower = wallet.lower()
-
-    # Append corresponding FICO score
-    fico_score = features_df.loc[features_df["wallet"].str.lower() == wallet_lower, "fico_score"].values[0]
-    y.append(fico_score)
-
-    # Get txs involving this wallet (either sender or recipient)
-    txs = transactions_df[
-        (transactions_df["from"].str.lower() == wallet_lower) |
-        (transactions_df["to"].str.lower() == wallet_lower)
-    ].copy()
-
-    # Clean + convert to float
-    txs["value_eth"] = txs["value_eth"].astype(float)
-    txs["gas"] = txs["gas"].astype(float)
-    txs["gasPrice"] = txs["gasPrice"].astype(float)
-    txs["is_outgoing"] = (txs["from"].str.lower() == wallet_lower).astype(int)
+# FICO labels in wallet order
+y = features_df.set_index(features_df["wallet"].str.lower())["fico_score"].loc[[w.lower() for w in wallets]].values
 
-    tx_features = txs[["value_eth", "gas", "gasPrice", "is_outgoing"]].values
-
-    # Pad (or trim) to exactly 100 rows with NaNs
-    padded = np.full((100, 4), np.nan)
-    padded[:min(100, len(tx_features))] = tx_features[:100]
-    X_tx_matrix.append(padded)
-
-# Convert to NumPy arrays
-X_tx_matrix = np.array(X_tx_matrix)  # (100, 100, 4)
-y = np.array(y)                      # (100,)
+# Each wallet's txs (as sender or recipient), padded/trimmed to 100 rows with NaNs,
+# built for all wallets in one vectorized pass
+engine = FeatureEngine(TxBatch.from_transactions(transactions_df, wallets))
+X_tx_matrix = engine.tx_window_matrix(window=100, fill=np.nan)  # (N, 100, 4)
 
 # Save
 np.save("X_tx_matrix.npy", X_tx_matrix)
@@ -95,12 +74,9 @@ def process_wallet_features(csv_path: str, wallet_list, output_features_npy: str
     print(df.head()[["wallet_age_days", "fico_score"]])
     print(f"📏 X shape: {X.shape}, y shape: {y.shape}")
 
-    # Normalize features
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
-
-    # Save
-    np.save(output_features_npy, X_scaled)
+    # Saved unscaled: model.py fits the wallet scaler and saves it in the
+    # checkpoint, so the same scaling can be applied when scoring live wallets
+    np.save(output_features_npy, X)
     np.save(output_labels_npy, y)
     print("✅ Feature engineering complete.")
 
@@ -116,31 +92,10 @@ def process_transaction_history(tx_csv: str, wallet_list: list, output_npy: str)
     print(f"📄 Loading transaction CSV: {tx_csv}")
     transactions_df = pd.read_csv(tx_csv)
 
-    wallet_list = [w.lower() for w in wallet_list]
-    X_tx_matrix = []
-
-    for wallet in wallet_list:
-        # Get txs involving this wallet
-        txs = transactions_df[
-            (transactions_df["from"].str.lower() == wallet) |
-            (transactions_df["to"].str.lower() == wallet)
-        ].copy()
-
-        # Clean + convert to float
-        txs["value_eth"] = txs["value_eth"].astype(float)
-        txs["gas"] = txs["gas"].astype(float)
-        txs["gasPrice"] = txs["gasPrice"].astype(float)
-        txs["is_outgoing"] = (txs["from"].str.lower() == wallet).astype(int)
-
-        # Select features
-        tx_features = txs[["value_eth", "gas", "gasPrice", "is_outgoing"]].values
-
-        # Pad/truncate to 100 txs
-        padded = np.full((100, 4), np.nan)
-        padded[:min(100, len(tx_features))] = tx_features[:100]
-        X_tx_matrix.append(padded)
-
-    X_tx_matrix = np.array(X_tx_matrix)
+    # Get txs involving each wallet, padded/truncated to 100 txs, in one pass
+    engine = FeatureEngine(TxBatch.from_transactions(transactions_df, wallet_list))
+    X_tx_matrix = engine.tx_window_matrix(window=100, fill=np.nan)
+
     print(f"📦 Transaction matrix shape: {X_tx_matrix.shape}")
     np.save(output_npy, X_tx_matrix)
     print(f"✅ Saved to {output_npy}")
@@ -0,0 +1,47 @@
+import contextvars
+import time
+from typing import Optional
+
+# Absolute time.monotonic() by which the current request must be answered
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's latency budget ran out; remaining work is abandoned."""
+
+
+def set_deadline(budget_secs: float):
+    """Starts a budget for the current context; returns a token for reset_deadline()."""
+    return _deadline.set(time.monotonic() + budget_secs)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the budget, or None when no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def bounded(timeout: Optional[float]) -> Optional[float]:
+    """`timeout` capped at the remaining budget."""
+    left = remaining()
+    if left is None:
+        return timeout
+    left = max(left, 0.0)
+    return left if timeout is None else min(timeout, left)
+
+
+def check_deadline(stage: str):
+    """Raises DeadlineExceeded before starting `stage` if the budget is spent."""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
@@ -0,0 +1,302 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+
+from model.deadline import DeadlineExceeded
+from model.local_store import SHARED_STORE_PATH, STORE_BUSY_TIMEOUT_SECS, connect, register_schema, transaction
+
+# Etherscan/BscScan free tier allows 5 calls/sec per key
+EXPLORER_RATE_PER_SEC = float(os.getenv("EXPLORER_RATE_PER_SEC", "5"))
+EXPLORER_BURST = float(os.getenv("EXPLORER_BURST", str(EXPLORER_RATE_PER_SEC)))
+EXPLORER_MAX_RETRIES = int(os.getenv("EXPLORER_MAX_RETRIES", "3"))
+# Backpressure: callers are rejected once a lane has this many waiters
+EXPLORER_MAX_QUEUE = {
+    "interactive": int(os.getenv("EXPLORER_MAX_QUEUE_INTERACTIVE", "64")),
+    "batch": int(os.getenv("EXPLORER_MAX_QUEUE_BATCH", "1024")),
+}
+# Lanes in strict priority order
+LANES = ("interactive", "batch")
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS explorer_buckets (
+    key_id TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+""")
+
+
+class ExplorerError(RuntimeError):
+    """The explorer answered with an error payload instead of data."""
+
+
+class ExplorerRateLimited(ExplorerError):
+    """Every pooled key stayed rate limited through all retries."""
+
+
+class ExplorerUnavailable(ExplorerError):
+    """The explorer itself failed: a 5xx answer or a body that is not an explorer payload."""
+
+
+class SchedulerSaturated(RuntimeError):
+    """The lane queue is full; the caller should back off."""
+
+
+def _key_id(api_key: str) -> str:
+    # Never persist raw API keys in the shared store
+    return hashlib.sha1(api_key.encode()).hexdigest()[:16]
+
+
+def _is_rate_limit_payload(payload) -> bool:
+    if not isinstance(payload, dict) or str(payload.get("status")) != "0":
+        return False
+    result = str(payload.get("result", "")).lower()
+    return "rate limit" in result or "max calls per sec" in result
+
+
+def _is_error_payload(payload) -> bool:
+    """Etherscan reports empty histories as status 0 too, so only treat non-list results as errors."""
+    if not isinstance(payload, dict):
+        return True
+    return str(payload.get("status")) == "0" and not isinstance(payload.get("result"), list)
+
+
+class TokenBucketPool:
+    """
+    Token buckets for a pool of API keys, persisted in the host-wide shared
+    store so every thread, worker process and local cluster node draws from
+    the same budget.
+    """
+
+    def __init__(self, rate: float = EXPLORER_RATE_PER_SEC, burst: float = EXPLORER_BURST):
+        self.rate = rate
+        self.burst = burst
+
+    def try_acquire(self, api_keys, deadline: float = None):
+        """
+        Takes one token from the fullest bucket in the pool.
+        Returns (api_key, 0.0) on success or (None, seconds_until_next_token).
+        Waiting on another process's write lock stops at `deadline` (monotonic).
+        """
+        if deadline is None:
+            return self._try_acquire(api_keys)
+        conn = connect(SHARED_STORE_PATH)
+        left = max(deadline - time.monotonic(), 0.0)
+        conn.execute(f"PRAGMA busy_timeout = {int(min(left, STORE_BUSY_TIMEOUT_SECS) * 1000)}")
+        try:
+            return self._try_acquire(api_keys)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) and left < STORE_BUSY_TIMEOUT_SECS:
+                raise DeadlineExceeded("Deadline passed while waiting for the explorer rate-limit store") from e
+            raise
+        finally:
+            conn.execute(f"PRAGMA busy_timeout = {int(STORE_BUSY_TIMEOUT_SECS * 1000)}")
+
+    def _try_acquire(self, api_keys):
+        now = time.time()
+        ids = {_key_id(k): k for k in api_keys}
+        with transaction(SHARED_STORE_PATH) as conn:
+            rows = dict(
+                (row[0], (row[1], row[2]))
+                for row in conn.execute(
+                    f"SELECT key_id, tokens, updated FROM explorer_buckets WHERE key_id IN ({','.join('?' * len(ids))})",
+                    list(ids),
+                )
+            )
+            best_id, best_tokens = None, -1.0
+            for key_id in ids:
+                tokens, updated = rows.get(key_id, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                if tokens > best_tokens:
+                    best_id, best_tokens = key_id, tokens
+
+            if best_tokens < 1.0:
+                return None, (1.0 - best_tokens) / self.rate
+
+            conn.execute(
+                "INSERT OR REPLACE INTO explorer_buckets (key_id, tokens, updated) VALUES (?, ?, ?)",
+                (best_id, best_tokens - 1.0, now),
+            )
+            return ids[best_id], 0.0
+
+    def penalize(self, api_key: str, seconds: float = 1.0):
+        """Drains a key's bucket after the explorer told us it is over its limit."""
+        with transaction(SHARED_STORE_PATH) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO explorer_buckets (key_id, tokens, updated) VALUES (?, ?, ?)",
+                (_key_id(api_key), -seconds * self.rate, time.time()),
+            )
+
+
+class _Ticket:
+    __slots__ = ("lane", "flow", "enqueued")
+
+    def __init__(self, lane: str, flow: str):
+        self.lane = lane
+        self.flow = flow
+        self.enqueued = time.monotonic()
+
+
+class ExplorerScheduler:
+    """
+    Admits explorer calls in priority order: the interactive lane always goes
+    before batch, and within a lane flows (usually one per wallet) are served
+    round-robin so one large re-scoring job cannot starve the others.
+    """
+
+    def __init__(self, buckets: TokenBucketPool = None):
+        self.buckets = buckets or TokenBucketPool()
+        self._cond = threading.Condition()
+        # lane -> flow -> deque of tickets, in round-robin order
+        self._lanes = {lane: OrderedDict() for lane in LANES}
+        self._depth = {lane: 0 for lane in LANES}
+        self._metrics = {
+            lane: {"served": 0, "rejected": 0, "wait_total_secs": 0.0, "wait_max_secs": 0.0}
+            for lane in LANES
+        }
+        self._rate_limited = 0
+        self._errors = 0
+
+    # --- queueing ---
+    def _enqueue(self, ticket: _Ticket):
+        lane = self._lanes[ticket.lane]
+        lane.setdefault(ticket.flow, deque()).append(ticket)
+        self._depth[ticket.lane] += 1
+
+    def _head(self):
+        for lane_name in LANES:
+            lane = self._lanes[lane_name]
+            if lane:
+                flow_queue = next(iter(lane.values()))
+                return flow_queue[0]
+        return None
+
+    def _dequeue(self, ticket: _Ticket):
+        lane = self._lanes[ticket.lane]
+        flow_queue = lane[ticket.flow]
+        flow_queue.remove(ticket)
+        if flow_queue:
+            lane.move_to_end(ticket.flow)  # next flow gets the following turn
+        else:
+            del lane[ticket.flow]
+        self._depth[ticket.lane] -= 1
+
+    def acquire(self, api_keys, lane: str = "interactive", flow: str = "default", deadline: float = None) -> str:
+        """Blocks until this caller's turn comes up and a key has a token; returns that key."""
+        if lane not in self._lanes:
+            raise ValueError(f"Unknown scheduler lane: {lane}")
+        ticket = _Ticket(lane, flow)
+        with self._cond:
+            if self._depth[lane] >= EXPLORER_MAX_QUEUE[lane]:
+                self._metrics[lane]["rejected"] += 1
+                raise SchedulerSaturated(f"Explorer {lane} queue is full ({self._depth[lane]} waiting)")
+            self._enqueue(ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._head() is ticket:
+                        # The bucket transaction can wait on another process's write lock:
+                        # don't hold every other waiter (and their deadlines) behind it
+                        self._cond.release()
+                        try:
+                            api_key, wait = self.buckets.try_acquire(api_keys, deadline)
+                        finally:
+                            self._cond.acquire()
+                        if api_key:
+                            self._record_wait(ticket)
+                            return api_key
+                        timeout = wait
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise DeadlineExceeded("Deadline passed while waiting for explorer capacity")
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    self._cond.wait(timeout)
+            finally:
+                self._dequeue(ticket)
+                self._cond.notify_all()
+
+    def _record_wait(self, ticket: _Ticket):
+        waited = time.monotonic() - ticket.enqueued
+        m = self._metrics[ticket.lane]
+        m["served"] += 1
+        m["wait_total_secs"] += waited
+        m["wait_max_secs"] = max(m["wait_max_secs"], waited)
+
+    # --- calls ---
+    def get(self, base_url: str, params: dict, api_keys, lane: str = "interactive", flow: str = "default",
+            timeout: float = None, deadline: float = None) -> dict:
+        """
+        Performs a rate-limited explorer GET and returns the decoded payload.
+        Rate-limit payloads are retried on another key; other error payloads raise ExplorerError,
+        5xx and undecodable answers ExplorerUnavailable.
+        """
+        api_keys = [k for k in api_keys if k]
+        if not api_keys:
+            raise ValueError("No explorer API keys configured")
+
+        for attempt in range(EXPLORER_MAX_RETRIES + 1):
+            api_key = self.acquire(api_keys, lane=lane, flow=flow, deadline=deadline)
+            call_timeout = timeout
+            if deadline is not None:
+                # Whatever the queue wait left of the budget, not what was left before it
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise DeadlineExceeded("Deadline passed while waiting for explorer capacity")
+                call_timeout = left if timeout is None else min(timeout, left)
+            response = requests.get(base_url, params={**params, "apikey": api_key}, timeout=call_timeout)
+            if response.status_code >= 500:
+                raise ExplorerUnavailable(f"Explorer unavailable: HTTP {response.status_code}")
+            payload = None
+            if response.status_code != 429:
+                try:
+                    payload = response.json()
+                except ValueError:
+                    raise ExplorerUnavailable(f"Explorer returned a non-JSON body (HTTP {response.status_code})")
+            if payload is None or _is_rate_limit_payload(payload):
+                with self._cond:
+                    self._rate_limited += 1
+                self.buckets.penalize(api_key)
+                continue
+            if _is_error_payload(payload):
+                with self._cond:
+                    self._errors += 1
+                raise ExplorerError(f"Explorer error: {payload.get('message')} - {payload.get('result')}")
+            return payload
+
+        raise ExplorerRateLimited(f"Explorer rate limit persisted after {EXPLORER_MAX_RETRIES} retries")
+
+    def stats(self) -> dict:
+        """Backpressure metrics: queue depth, admissions and wait times per lane."""
+        with self._cond:
+            lanes = {}
+            for lane in LANES:
+                m = self._metrics[lane]
+                lanes[lane] = {
+                    "queue_depth": self._depth[lane],
+                    "active_flows": len(self._lanes[lane]),
+                    "served": m["served"],
+                    "rejected": m["rejected"],
+                    "avg_wait_secs": m["wait_total_secs"] / m["served"] if m["served"] else 0.0,
+                    "max_wait_secs": m["wait_max_secs"],
+                }
+            return {"lanes": lanes, "rate_limited_responses": self._rate_limited, "error_responses": self._errors}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ExplorerScheduler:
+    """Process-wide scheduler; the token buckets behind it are shared across processes."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ExplorerScheduler()
+    return _scheduler
@@ -0,0 +1,359 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import NamedTuple, Optional
+
+import pandas as pd
+
+from model.deadline import bounded, check_deadline, set_deadline
+from model.local_store import connect, register_schema, transaction
+from model.features import SUMMARY_FEATURES
+from model.score_index import record_score
+from model.tx_store import (
+    GRAPH_REFRESH_SECS, counterparty_graph_features, load_transactions, store_transactions, store_version,
+)
+from model.walletEtl import (
+    EXPLORER_CHAINS, HISTORY_PAGE_SIZE, TOKEN_FEATURES_PENDING, get_history_page, get_token_features,
+    get_wallet_features, summarize_wallet,
+)
+
+# Snapshots younger than this are served as-is
+FEATURES_FRESH_SECS = float(os.getenv("FEATURES_FRESH_SECS", "300"))
+# Older snapshots are still served (flagged stale) while a refresh runs
+FEATURES_MAX_STALE_SECS = float(os.getenv("FEATURES_MAX_STALE_SECS", str(7 * 24 * 3600)))
+# Upper bound on how long a request waits for a wallet we have never seen
+FEATURES_MISS_WAIT_SECS = float(os.getenv("FEATURES_MISS_WAIT_SECS", "8"))
+FEATURES_REFRESH_WORKERS = int(os.getenv("FEATURES_REFRESH_WORKERS", "4"))
+# History backfills running at once per process; they share the refresh workers
+BACKFILL_MAX_INFLIGHT = int(os.getenv("BACKFILL_MAX_INFLIGHT", "2"))
+# Budget of a shared interactive fetch: no waiter's deadline (capped at API_MAX_DEADLINE_MS) outlives it
+FEATURES_FETCH_MAX_SECS = float(os.getenv("FEATURES_FETCH_MAX_SECS", "30"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS wallet_snapshots (
+    chain TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    summary_json TEXT NOT NULL,
+    tx_json TEXT NOT NULL,  -- JSON list of tx ids in the tx store (older rows: full records)
+    score REAL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (chain, wallet)
+);
+CREATE TABLE IF NOT EXISTS history_backfill (
+    chain TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    end_block INTEGER NOT NULL,  -- explorer history at or below this block is not stored yet
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chain, wallet)
+);
+""")
+
+
+class WalletSnapshot(NamedTuple):
+    summary_df: pd.DataFrame
+    tx_df: pd.DataFrame
+    fetched_at: float
+    stale: bool
+    score: Optional[float]
+
+    @property
+    def age_seconds(self) -> float:
+        return max(time.time() - self.fetched_at, 0.0)
+
+
+def _tx_from_json(chain: str, tx_json: str) -> pd.DataFrame:
+    entries = json.loads(tx_json)
+    if entries and isinstance(entries[0], str):
+        return load_transactions(chain, entries)
+    tx_df = pd.DataFrame(entries)
+    if not tx_df.empty and "timeStamp" in tx_df.columns:
+        tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
+    return tx_df
+
+
+def load_snapshot(wallet: str, chain: str) -> Optional[WalletSnapshot]:
+    row = connect().execute(
+        "SELECT summary_json, tx_json, score, fetched_at FROM wallet_snapshots WHERE chain = ? AND wallet = ?",
+        (chain, wallet.lower()),
+    ).fetchone()
+    if row is None:
+        return None
+    summary_json, tx_json, score, fetched_at = row
+    if time.time() - fetched_at > FEATURES_MAX_STALE_SECS:
+        return None
+    summary_df = pd.DataFrame(json.loads(summary_json))
+    tx_df = _tx_from_json(chain, tx_json)
+    if any(name not in summary_df.columns for name in SUMMARY_FEATURES):
+        # Snapshot predates newly registered features; derive them, keeping stored values
+        stored = summary_df.iloc[0].drop(labels=["wallet"], errors="ignore").to_dict()
+        summary_df = summarize_wallet(tx_df, wallet, stored)
+    return WalletSnapshot(
+        summary_df=summary_df,
+        tx_df=tx_df,
+        fetched_at=fetched_at,
+        stale=time.time() - fetched_at > FEATURES_FRESH_SECS,
+        score=score,
+    )
+
+
+def save_snapshot(wallet: str, chain: str, summary_df: pd.DataFrame, tx_df: pd.DataFrame) -> WalletSnapshot:
+    fetched_at = time.time()
+    # Rows live once in the shared tx store; the snapshot only keeps their ids
+    ids = store_transactions(chain, tx_df)
+    connect().execute(
+        "INSERT OR REPLACE INTO wallet_snapshots (chain, wallet, summary_json, tx_json, score, fetched_at) "
+        "VALUES (?, ?, ?, ?, NULL, ?)",
+        (chain, wallet.lower(), summary_df.to_json(orient="records"), json.dumps(ids), fetched_at),
+    )
+    return WalletSnapshot(summary_df, tx_df, fetched_at, False, None)
+
+
+def save_score(wallet: str, chain: str, fetched_at: float, score: float):
+    """
+    Attaches a score to the snapshot it was computed from (ignored if a newer
+    fetch landed) and makes it the wallet's latest in the population index.
+    """
+    connect().execute(
+        "UPDATE wallet_snapshots SET score = ? WHERE chain = ? AND wallet = ? AND fetched_at = ?",
+        (float(score), chain, wallet.lower(), fetched_at),
+    )
+    record_score("fico", chain, wallet, score)
+
+
+def latest_scores(chain: str) -> dict:
+    """wallet -> most recent FICO score for every scored snapshot on `chain`."""
+    return dict(connect().execute(
+        "SELECT wallet, score FROM wallet_snapshots WHERE chain = ? AND score IS NOT NULL", (chain,)
+    ).fetchall())
+
+
+# === Counterparty-graph features, rebuilt off the request path ===
+_network = {}  # chain -> (version, checked_at, features by address)
+_network_building = set()
+_network_lock = threading.Lock()
+_network_pid = None
+
+
+def _network_version() -> tuple:
+    # Both reads are index lookups: the newest stored tx and the newest score change
+    seq = connect().execute("SELECT COALESCE(MAX(seq), 0) FROM population_score_log").fetchone()[0]
+    return store_version(), seq
+
+
+def _refresh_network(chain: str):
+    try:
+        version = _network_version()
+        with _network_lock:
+            entry = _network.get(chain)
+        if entry is None or entry[0] != version:
+            features = counterparty_graph_features(chain, latest_scores(chain))
+        else:
+            features = entry[2]
+        with _network_lock:
+            _network[chain] = (version, time.time(), features)
+    except Exception as e:
+        print(f"⚠️  Counterparty graph refresh for {chain} failed: {e}")
+    finally:
+        with _network_lock:
+            _network_building.discard(chain)
+
+
+def cached_network_features(wallet: str, chain: str) -> Optional[pd.Series]:
+    """
+    The wallet's row of counterparty_graph_features() for `chain`, read from a
+    table a background thread rebuilds when stored transactions or scores
+    change (checked every GRAPH_REFRESH_SECS). The caller never scans the
+    store: None until the chain's first build lands.
+    """
+    global _network_pid
+    with _network_lock:
+        if _network_pid != os.getpid():
+            _network_building.clear()  # builder threads don't survive fork
+            _network_pid = os.getpid()
+        entry = _network.get(chain)
+        start = (entry is None or time.time() - entry[1] >= GRAPH_REFRESH_SECS) and chain not in _network_building
+        if start:
+            _network_building.add(chain)
+    if start:
+        threading.Thread(target=_refresh_network, args=(chain,), name="network-features", daemon=True).start()
+    if entry is None:
+        return None
+    return entry[2].reindex([wallet.lower()]).fillna({"degree": 0, "tx_degree": 0, "scored_counterparties": 0}).iloc[0]
+
+
+_executor = None
+_inflight = {}
+_inflight_lock = threading.RLock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    # Created on first use so preforked workers each start their own threads
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=FEATURES_REFRESH_WORKERS, thread_name_prefix="feature-refresh")
+    return _executor
+
+
+def _refresh(wallet: str, chain: str, lane: str) -> WalletSnapshot:
+    if lane == "interactive":
+        set_deadline(FEATURES_FETCH_MAX_SECS)  # runs in its own context, see schedule_refresh
+    summary_df, tx_df = get_wallet_features(wallet, chain=chain, lane=lane)
+    snapshot = save_snapshot(wallet, chain, summary_df, tx_df)
+    if summary_df.iloc[0].get(TOKEN_FEATURES_PENDING):
+        key = ("tokens", chain, wallet.lower())
+        with _inflight_lock:
+            if key not in _inflight:
+                future = _get_executor().submit(
+                    contextvars.Context().run, _fill_token_features, wallet, chain, snapshot.fetched_at
+                )
+                _inflight[key] = future
+                future.add_done_callback(lambda _f: _forget(key))
+    return snapshot
+
+
+def _fill_token_features(wallet: str, chain: str, fetched_at: float):
+    """Adds TOKEN_FEATURES, fetched on the batch lane, to the snapshot an interactive fetch left them out of."""
+    try:
+        features = get_token_features(wallet, chain, lane="batch")
+    except Exception as e:
+        # Left pending: the next batch refresh fetches them with everything else
+        print(f"⚠️  Token features for {wallet} on {chain} not fetched: {type(e).__name__}")
+        return
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT summary_json FROM wallet_snapshots WHERE chain = ? AND wallet = ? AND fetched_at = ?",
+            (chain, wallet.lower(), fetched_at),
+        ).fetchone()
+        if row is None:
+            return  # a newer fetch replaced the snapshot
+        summary = json.loads(row[0])
+        summary[0].update(features, **{TOKEN_FEATURES_PENDING: 0.0})
+        conn.execute(
+            "UPDATE wallet_snapshots SET summary_json = ? WHERE chain = ? AND wallet = ? AND fetched_at = ?",
+            (json.dumps(summary), chain, wallet.lower(), fetched_at),
+        )
+
+
+def schedule_refresh(wallet: str, chain: str, lane: str = "batch"):
+    """
+    Starts a background refresh, or returns the one already running for this
+    wallet on the same lane. An interactive caller never joins a batch
+    refresh, which waits behind batch tokens and reads more pages.
+    """
+    key = (lane, chain, wallet.lower())
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            # Every later caller shares this fetch, so it must not inherit the first
+            # caller's deadline: interactive fetches get the server-side budget, batch
+            # refreshes run unbounded, and each waiter bounds only its own wait.
+            future = _get_executor().submit(contextvars.Context().run, _refresh, wallet, chain, lane)
+            _inflight[key] = future
+            future.add_done_callback(lambda _f: _forget(key))
+        return future
+
+
+def _forget(key):
+    with _inflight_lock:
+        _inflight.pop(key, None)
+
+
+def _oldest_block(tx_df: pd.DataFrame) -> Optional[int]:
+    blocks = pd.to_numeric(tx_df.get("blockNumber", pd.Series(dtype=float)), errors="coerce").dropna()
+    return int(blocks.min()) if len(blocks) else None
+
+
+def _backfill(wallet: str, chain: str) -> int:
+    row = connect().execute(
+        "SELECT end_block, complete FROM history_backfill WHERE chain = ? AND wallet = ?", (chain, wallet)
+    ).fetchone()
+    if row is not None and row[1]:
+        return 0
+    if row is not None:
+        end_block = row[0]
+    else:
+        # The wallet's own snapshot covers everything from its oldest block up. Rows
+        # stored via counterparties' fetches don't tell us where the gaps are.
+        snapshot = load_snapshot(wallet, chain)
+        end_block = (snapshot is not None and _oldest_block(snapshot.tx_df)) or 99999999
+
+    tx_df = get_history_page(wallet, chain, end_block)
+    oldest = _oldest_block(tx_df)
+    complete = len(tx_df) < HISTORY_PAGE_SIZE or oldest is None
+    if not complete:
+        # endblock is inclusive: re-reading the boundary block is harmless (rows dedupe),
+        # but a page entirely inside it must still make progress
+        end_block = oldest if oldest < end_block else end_block - 1
+    stored = store_transactions(chain, tx_df)
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO history_backfill (chain, wallet, end_block, complete) VALUES (?, ?, ?, ?)",
+            (chain, wallet, end_block, int(complete)),
+        )
+    return len(stored)
+
+
+def schedule_backfill(wallet: str, chain: str) -> bool:
+    """
+    Fetches the next page of explorer history below what is stored, in the
+    background on the batch lane. Only wallets that have been scored (have a
+    snapshot) are backfilled, at most BACKFILL_MAX_INFLIGHT at once. Returns
+    False when there is nothing more to fetch (not an explorer chain, never
+    scored, or its full history is already stored); True means older history
+    may still arrive, including when every backfill slot is busy.
+    """
+    wallet = wallet.lower()
+    if chain not in EXPLORER_CHAINS:
+        return False
+    conn = connect()
+    if conn.execute("SELECT 1 FROM wallet_snapshots WHERE chain = ? AND wallet = ?", (chain, wallet)).fetchone() is None:
+        return False
+    row = conn.execute(
+        "SELECT complete FROM history_backfill WHERE chain = ? AND wallet = ?", (chain, wallet)
+    ).fetchone()
+    if row is not None and row[0]:
+        return False
+    key = ("backfill", chain, wallet)
+    with _inflight_lock:
+        running = sum(1 for k in _inflight if k[0] == "backfill")
+        if key not in _inflight and running < BACKFILL_MAX_INFLIGHT:
+            future = _get_executor().submit(contextvars.Context().run, _backfill, wallet, chain)
+            _inflight[key] = future
+            future.add_done_callback(lambda _f: _forget(key))
+    return True
+
+
+def get_wallet_snapshot_future(wallet: str, chain: str) -> Future:
+    """
+    Non-blocking form of get_wallet_snapshot: an already-resolved future for
+    cached wallets, otherwise the (shared) in-flight fetch.
+    """
+    wallet = wallet.lower()
+    cached = load_snapshot(wallet, chain)
+    if cached is not None:
+        if cached.stale:
+            schedule_refresh(wallet, chain, lane="batch")
+        future = Future()
+        future.set_result(cached)
+        return future
+    return schedule_refresh(wallet, chain, lane="interactive")
+
+
+def get_wallet_snapshot(wallet: str, chain: str, max_wait: float = None) -> WalletSnapshot:
+    """
+    Stale-while-revalidate lookup. Fresh snapshots are returned directly; stale
+    ones are returned immediately (stale=True) while a background refresh runs.
+    Only a wallet with no snapshot at all waits on the upstream, and never for
+    longer than `max_wait` seconds (raises TimeoutError).
+    """
+    future = get_wallet_snapshot_future(wallet, chain)
+    try:
+        return future.result(timeout=bounded(FEATURES_MISS_WAIT_SECS if max_wait is None else max_wait))
+    except FutureTimeoutError:
+        # The fetch keeps running and will populate the cache for the next request
+        check_deadline(f"{chain} data for {wallet} arrived")
+        raise TimeoutError(f"Timed out fetching wallet {wallet} on {chain}")
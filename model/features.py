@@ -0,0 +1,469 @@
+"""
+Declarative feature registry.
+
+Every feature is registered once with the inputs it needs (raw transaction
+columns or other features). A FeatureEngine computes any requested subset
+lazily: inputs are resolved on demand and memoised, so asking for twenty
+features still touches each transaction column once. All aggregations are
+vectorised over a batch of wallets with np.bincount, so the same definitions
+serve online scoring (one wallet), analytics, karma and training (many wallets).
+"""
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# The model sees each wallet's most recent TX_WINDOW transactions, zero-padded
+TX_WINDOW = 100
+SECONDS_PER_DAY = 86400
+
+# Column order of the vector the XGBoost model and scaler were fitted on
+MODEL_FEATURES = [
+    "tx_mean_value_eth", "tx_mean_gas", "tx_mean_gas_price", "tx_mean_is_outgoing",
+    "tx_std_value_eth", "tx_std_gas", "tx_std_gas_price", "tx_std_is_outgoing",
+    "wallet_age_days", "tx_count", "avg_tx_value_eth", "active_days",
+]
+
+# ERC-20 activity, from the wallet's tokentx stream (zero for plain txlist histories)
+TOKEN_FEATURES = [
+    "token_transfer_count", "token_count", "token_volume_usd", "token_in_volume_usd", "token_out_volume_usd",
+    "stablecoin_volume_usd", "top_token_volume_share", "unpriced_transfer_count",
+]
+
+# Wallet-level columns returned by get_wallet_features
+SUMMARY_FEATURES = [
+    "wallet_age_days", "tx_count", "avg_tx_value_eth", "active_days",
+    "total_volume_eth", "incoming_tx_count", "outgoing_tx_count", "counterparty_count",
+    "first_tx_timestamp", "last_tx_timestamp", "tx_count_30d", "mean_tx_gap_secs", "max_tx_gap_secs",
+    "gas_mean", "gas_std", "gas_price_mean",
+    *TOKEN_FEATURES,
+]
+
+KARMA_FEATURES = ["karma_age_score", "karma_frequency_score", "karma_consistency_score"]
+
+
+class Feature(NamedTuple):
+    name: str
+    inputs: Tuple[str, ...]
+    compute: Callable
+    description: str
+
+
+FEATURES: Dict[str, Feature] = {}
+
+
+def feature(name: str, inputs: Sequence[str] = (), description: str = ""):
+    """Registers `fn(batch, *inputs)` as the definition of `name`."""
+    def decorator(fn):
+        if name in FEATURES:
+            raise ValueError(f"Feature already registered: {name}")
+        FEATURES[name] = Feature(name, tuple(inputs), fn, description or (fn.__doc__ or "").strip())
+        return fn
+    return decorator
+
+
+# === Batch of transactions, grouped by wallet ===
+class TxBatch:
+    """
+    Transactions attributed to wallets. `wallet_idx[i]` is the wallet that row i
+    belongs to; rows are grouped by wallet and keep the source frame's order
+    within a wallet (most recent first for explorer data).
+    """
+
+    def __init__(self, tx_df: pd.DataFrame, wallets: Sequence[str], rows: np.ndarray,
+                 wallet_idx: np.ndarray, is_outgoing: np.ndarray, is_incoming: np.ndarray):
+        self.tx_df = tx_df
+        self.wallets = list(wallets)
+        self.n_wallets = len(self.wallets)
+        self.rows = rows
+        self.wallet_idx = wallet_idx
+        self.is_outgoing = is_outgoing
+        self.is_incoming = is_incoming
+
+    @classmethod
+    def for_wallet(cls, tx_df: pd.DataFrame, wallet: str) -> "TxBatch":
+        """Every row of `tx_df` is one wallet's history (explorer txlist/tokentx output)."""
+        wallet = wallet.lower()
+        n = len(tx_df)
+        if n and "from" in tx_df.columns:
+            is_out = (tx_df["from"].astype(str).str.lower() == wallet).to_numpy()
+            is_in = (tx_df["to"].astype(str).str.lower() == wallet).to_numpy() if "to" in tx_df.columns else np.zeros(n, bool)
+        else:
+            is_out = is_in = np.zeros(n, dtype=bool)
+        return cls(tx_df, [wallet], np.arange(n), np.zeros(n, dtype=np.int64), is_out, is_in)
+
+    @classmethod
+    def from_transactions(cls, tx_df: pd.DataFrame, wallets: Sequence[str]) -> "TxBatch":
+        """
+        Attributes a shared transaction table to `wallets`: a row belongs to its
+        sender and to its recipient, so transfers between two tracked wallets
+        appear once in each history. Self-transfers count once, as outgoing.
+        """
+        wallets = [w.lower() for w in wallets]
+        index = pd.Index(wallets)
+        from_idx = index.get_indexer(tx_df["from"].astype(str).str.lower())
+        to_idx = index.get_indexer(tx_df["to"].astype(str).str.lower())
+        out_rows = np.flatnonzero(from_idx >= 0)
+        in_rows = np.flatnonzero((to_idx >= 0) & (to_idx != from_idx))
+
+        rows = np.concatenate([out_rows, in_rows])
+        wallet_idx = np.concatenate([from_idx[out_rows], to_idx[in_rows]]).astype(np.int64)
+        is_out = np.concatenate([np.ones(len(out_rows), bool), np.zeros(len(in_rows), bool)])
+
+        # Group by wallet, keeping frame order inside each group
+        order = np.lexsort((rows, wallet_idx))
+        rows, wallet_idx, is_out = rows[order], wallet_idx[order], is_out[order]
+        return cls(tx_df, wallets, rows, wallet_idx, is_out, ~is_out)
+
+    def column(self, name: str, default: float = 0.0) -> np.ndarray:
+        if name not in self.tx_df.columns or not len(self.rows):
+            return np.full(len(self.rows), default, dtype=np.float64)
+        values = pd.to_numeric(self.tx_df[name], errors="coerce").to_numpy(dtype=np.float64)[self.rows]
+        return np.nan_to_num(values, nan=default)
+
+    def labels(self, name: str) -> np.ndarray:
+        """String column (lower-cased, "" when missing) for each row."""
+        if name not in self.tx_df.columns or not len(self.rows):
+            return np.full(len(self.rows), "", dtype=object)
+        return self.tx_df[name].fillna("").astype(str).str.lower().to_numpy()[self.rows]
+
+    def counterparty(self) -> np.ndarray:
+        if not len(self.rows):
+            return np.empty(0, dtype=object)
+        sender = self.tx_df["from"].astype(str).str.lower().to_numpy()[self.rows]
+        recipient = self.tx_df["to"].astype(str).str.lower().to_numpy()[self.rows]
+        return np.where(self.is_outgoing, recipient, sender)
+
+    def sum(self, values: np.ndarray, mask: np.ndarray = None) -> np.ndarray:
+        idx = self.wallet_idx if mask is None else self.wallet_idx[mask]
+        weights = values if mask is None else values[mask]
+        return np.bincount(idx, weights=weights, minlength=self.n_wallets).astype(np.float64)
+
+    def count_distinct(self, keys: np.ndarray) -> np.ndarray:
+        """Number of distinct `keys` per wallet."""
+        if not len(keys):
+            return np.zeros(self.n_wallets)
+        pairs = pd.DataFrame({"w": self.wallet_idx, "k": keys}).drop_duplicates()
+        return np.bincount(pairs["w"].to_numpy(), minlength=self.n_wallets).astype(np.float64)
+
+    def window_matrix(self, values: Sequence[np.ndarray], window: int = TX_WINDOW, fill: float = np.nan) -> np.ndarray:
+        """(n_wallets, window, len(values)) matrix of each wallet's first `window` rows, padded with `fill`."""
+        matrix = np.full((self.n_wallets, window, len(values)), fill, dtype=np.float64)
+        rank = _rank_in_group(self.wallet_idx, self.n_wallets)
+        sel = rank < window
+        if sel.any():
+            matrix[self.wallet_idx[sel], rank[sel]] = np.column_stack([v[sel] for v in values])
+        return matrix
+
+
+def _rank_in_group(wallet_idx: np.ndarray, n_wallets: int) -> np.ndarray:
+    counts = np.bincount(wallet_idx, minlength=n_wallets)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    return np.arange(len(wallet_idx)) - starts[wallet_idx]
+
+
+def _safe_divide(num: np.ndarray, den: np.ndarray) -> np.ndarray:
+    return np.divide(num, den, out=np.zeros_like(num, dtype=np.float64), where=den > 0)
+
+
+# === Raw per-row inputs ===
+@feature("value_eth")
+def _value_eth(batch):
+    """Transaction value in native units (already decimal-normalised at ingestion)."""
+    return batch.column("value_eth")
+
+
+@feature("gas")
+def _gas(batch):
+    return batch.column("gas")
+
+
+@feature("gas_price")
+def _gas_price(batch):
+    return batch.column("gasPrice")
+
+
+@feature("timestamp")
+def _timestamp(batch):
+    return batch.column("timeStamp")
+
+
+@feature("is_outgoing")
+def _is_outgoing(batch):
+    return batch.is_outgoing.astype(np.float64)
+
+
+@feature("is_incoming")
+def _is_incoming(batch):
+    return batch.is_incoming.astype(np.float64)
+
+
+@feature("in_window")
+def _in_window(batch):
+    """True for the rows the model sees (each wallet's first TX_WINDOW rows)."""
+    return _rank_in_group(batch.wallet_idx, batch.n_wallets) < TX_WINDOW
+
+
+# === Wallet-level aggregates ===
+@feature("tx_count")
+def _tx_count(batch):
+    return np.bincount(batch.wallet_idx, minlength=batch.n_wallets).astype(np.float64)
+
+
+@feature("total_volume_eth", inputs=("value_eth",))
+def _total_volume(batch, value_eth):
+    return batch.sum(value_eth)
+
+
+@feature("avg_tx_value_eth", inputs=("total_volume_eth", "tx_count"))
+def _avg_tx_value(batch, total_volume_eth, tx_count):
+    return _safe_divide(total_volume_eth, tx_count)
+
+
+@feature("outgoing_tx_count", inputs=("is_outgoing",))
+def _outgoing_count(batch, is_outgoing):
+    return batch.sum(is_outgoing)
+
+
+@feature("incoming_tx_count", inputs=("is_incoming",))
+def _incoming_count(batch, is_incoming):
+    return batch.sum(is_incoming)
+
+
+@feature("active_days", inputs=("timestamp",))
+def _active_days(batch, timestamp):
+    """Distinct UTC calendar days with at least one transaction."""
+    return batch.count_distinct((timestamp // SECONDS_PER_DAY).astype(np.int64))
+
+
+@feature("counterparty_count")
+def _counterparty_count(batch):
+    return batch.count_distinct(batch.counterparty())
+
+
+@feature("first_tx_timestamp", inputs=("timestamp",))
+def _first_tx(batch, timestamp):
+    out = np.full(batch.n_wallets, np.inf)
+    np.minimum.at(out, batch.wallet_idx, timestamp)
+    return np.where(np.isinf(out), 0.0, out)
+
+
+@feature("last_tx_timestamp", inputs=("timestamp",))
+def _last_tx(batch, timestamp):
+    out = np.zeros(batch.n_wallets)
+    np.maximum.at(out, batch.wallet_idx, timestamp)
+    return out
+
+
+@feature("wallet_age_days", inputs=("first_tx_timestamp",))
+def _wallet_age(batch, first_tx_timestamp):
+    """
+    Days since the first transaction seen in the batch. Online scoring overrides
+    this with the explorer's first-ever transaction, which may predate the window.
+    """
+    now = time.time()
+    age = np.floor((now - first_tx_timestamp) / SECONDS_PER_DAY)
+    return np.where(first_tx_timestamp > 0, age, 0.0)
+
+
+@feature("tx_count_30d", inputs=("timestamp",))
+def _tx_count_30d(batch, timestamp):
+    return batch.sum(np.ones(len(timestamp)), timestamp >= time.time() - 30 * SECONDS_PER_DAY)
+
+
+@feature("tx_gap_secs", inputs=("timestamp",))
+def _tx_gaps(batch, timestamp):
+    """Per-row gap to the wallet's previous transaction in time (NaN for its first)."""
+    order = np.lexsort((timestamp, batch.wallet_idx))
+    gaps = np.full(len(timestamp), np.nan)
+    if len(order) > 1:
+        same_wallet = batch.wallet_idx[order][1:] == batch.wallet_idx[order][:-1]
+        diffs = np.diff(timestamp[order])
+        gaps[order[1:][same_wallet]] = diffs[same_wallet]
+    return gaps
+
+
+@feature("mean_tx_gap_secs", inputs=("tx_gap_secs",))
+def _mean_gap(batch, tx_gap_secs):
+    valid = ~np.isnan(tx_gap_secs)
+    return _safe_divide(batch.sum(tx_gap_secs, valid), batch.sum(np.ones(len(valid)), valid))
+
+
+@feature("max_tx_gap_secs", inputs=("tx_gap_secs",))
+def _max_gap(batch, tx_gap_secs):
+    out = np.zeros(batch.n_wallets)
+    valid = ~np.isnan(tx_gap_secs)
+    np.maximum.at(out, batch.wallet_idx[valid], tx_gap_secs[valid])
+    return out
+
+
+@feature("gas_mean", inputs=("gas", "tx_count"))
+def _gas_mean(batch, gas, tx_count):
+    return _safe_divide(batch.sum(gas), tx_count)
+
+
+@feature("gas_std", inputs=("gas", "gas_mean", "tx_count"))
+def _gas_std(batch, gas, gas_mean, tx_count):
+    dev = gas - gas_mean[batch.wallet_idx]
+    return np.sqrt(_safe_divide(batch.sum(dev * dev), tx_count))
+
+
+@feature("gas_price_mean", inputs=("gas_price", "tx_count"))
+def _gas_price_mean(batch, gas_price, tx_count):
+    return _safe_divide(batch.sum(gas_price), tx_count)
+
+
+# === Token transfers (rows normalised by model.token_registry) ===
+@feature("token_contract")
+def _token_contract(batch):
+    return batch.labels("token_contract")
+
+
+@feature("is_token_transfer", inputs=("token_contract",))
+def _is_token_transfer(batch, token_contract):
+    return token_contract != ""
+
+
+@feature("value_usd")
+def _value_usd(batch):
+    """USD value of a token transfer; NaN when the token is unpriced."""
+    return batch.column("value_usd", default=np.nan)
+
+
+@feature("token_transfer_count", inputs=("is_token_transfer",))
+def _token_transfer_count(batch, is_token_transfer):
+    return batch.sum(is_token_transfer.astype(np.float64))
+
+
+@feature("token_count", inputs=("token_contract", "is_token_transfer"))
+def _token_count(batch, token_contract, is_token_transfer):
+    """Distinct token contracts transferred."""
+    if not is_token_transfer.any():
+        return np.zeros(batch.n_wallets)
+    pairs = pd.DataFrame({"w": batch.wallet_idx[is_token_transfer], "k": token_contract[is_token_transfer]})
+    return np.bincount(pairs.drop_duplicates()["w"].to_numpy(), minlength=batch.n_wallets).astype(np.float64)
+
+
+@feature("token_volume_usd", inputs=("value_usd",))
+def _token_volume_usd(batch, value_usd):
+    return batch.sum(np.nan_to_num(value_usd))
+
+
+@feature("token_in_volume_usd", inputs=("value_usd", "is_incoming"))
+def _token_in_volume_usd(batch, value_usd, is_incoming):
+    return batch.sum(np.nan_to_num(value_usd), is_incoming > 0)
+
+
+@feature("token_out_volume_usd", inputs=("value_usd", "is_outgoing"))
+def _token_out_volume_usd(batch, value_usd, is_outgoing):
+    return batch.sum(np.nan_to_num(value_usd), is_outgoing > 0)
+
+
+@feature("stablecoin_volume_usd", inputs=("value_usd",))
+def _stablecoin_volume_usd(batch, value_usd):
+    return batch.sum(np.nan_to_num(value_usd), batch.column("is_stablecoin") > 0)
+
+
+@feature("top_token_volume_share", inputs=("token_contract", "value_usd", "token_volume_usd"))
+def _top_token_share(batch, token_contract, value_usd, token_volume_usd):
+    """Share of the wallet's USD volume in its largest token (1.0 = a single-token wallet)."""
+    codes, uniques = pd.factorize(token_contract)
+    if not len(uniques):
+        return np.zeros(batch.n_wallets)
+    # Sum per (wallet, token) pair actually present, then max per wallet
+    pairs, pair_idx = np.unique(batch.wallet_idx * len(uniques) + codes, return_inverse=True)
+    per_token = np.bincount(pair_idx, weights=np.nan_to_num(value_usd), minlength=len(pairs))
+    top = np.zeros(batch.n_wallets)
+    np.maximum.at(top, pairs // len(uniques), per_token)
+    return _safe_divide(top, token_volume_usd)
+
+
+@feature("unpriced_transfer_count", inputs=("is_token_transfer", "value_usd"))
+def _unpriced_count(batch, is_token_transfer, value_usd):
+    return batch.sum(np.ones(len(value_usd)), is_token_transfer & np.isnan(value_usd))
+
+
+# === Model window statistics ===
+# mean/std over the padded TX_WINDOW x 4 matrix the model was trained on:
+# missing rows count as zeros, exactly like np.nan_to_num on the padded matrix.
+def _register_window_stats(column: str, suffix: str):
+    @feature(f"tx_mean_{suffix}", inputs=(column, "in_window"))
+    def _mean(batch, values, in_window):
+        return batch.sum(values, in_window) / TX_WINDOW
+
+    @feature(f"tx_std_{suffix}", inputs=(column, "in_window", f"tx_mean_{suffix}"))
+    def _std(batch, values, in_window, mean):
+        dev = values[in_window] - mean[batch.wallet_idx[in_window]]
+        ss = np.bincount(batch.wallet_idx[in_window], weights=dev * dev, minlength=batch.n_wallets)
+        n_rows = np.bincount(batch.wallet_idx[in_window], minlength=batch.n_wallets)
+        ss = ss + (TX_WINDOW - n_rows) * mean * mean  # padded zero rows
+        return np.sqrt(ss / TX_WINDOW)
+
+
+for _column, _suffix in [("value_eth", "value_eth"), ("gas", "gas"), ("gas_price", "gas_price"), ("is_outgoing", "is_outgoing")]:
+    _register_window_stats(_column, _suffix)
+
+
+# === Karma components (0-100) ===
+@feature("karma_age_score", inputs=("wallet_age_days",))
+def _karma_age(batch, wallet_age_days):
+    return np.minimum(wallet_age_days / 365 * 100, 100)
+
+
+@feature("karma_frequency_score", inputs=("tx_count",))
+def _karma_frequency(batch, tx_count):
+    return np.minimum(tx_count / 100 * 100, 100)
+
+
+@feature("karma_consistency_score", inputs=("active_days",))
+def _karma_consistency(batch, active_days):
+    return np.where(active_days > 0, np.minimum(active_days / 30 * 100, 100), 0.0)
+
+
+# === Engine ===
+class FeatureEngine:
+    """
+    Lazily evaluates registered features over a TxBatch. `overrides` supplies
+    wallet-level values that come from elsewhere (e.g. the explorer's wallet
+    age, or CSV columns); they replace the registered definition.
+    """
+
+    def __init__(self, batch: TxBatch, overrides: Optional[Dict[str, Iterable[float]]] = None):
+        self.batch = batch
+        self._values = {}
+        for name, values in (overrides or {}).items():
+            self._values[name] = np.asarray(values, dtype=np.float64).reshape(batch.n_wallets)
+
+    def get(self, name: str) -> np.ndarray:
+        if name not in self._values:
+            if name not in FEATURES:
+                raise KeyError(f"Unknown feature: {name}")
+            spec = FEATURES[name]
+            inputs = [self.get(dep) for dep in spec.inputs]
+            self._values[name] = spec.compute(self.batch, *inputs)
+        return self._values[name]
+
+    def matrix(self, names: Sequence[str]) -> np.ndarray:
+        """(n_wallets, len(names)) float64 matrix."""
+        return np.column_stack([self.get(n) for n in names]) if names else np.empty((self.batch.n_wallets, 0))
+
+    def frame(self, names: Sequence[str]) -> pd.DataFrame:
+        return pd.DataFrame({n: self.get(n) for n in names}, index=pd.Index(self.batch.wallets, name="wallet"))
+
+    def tx_window_matrix(self, window: int = TX_WINDOW, fill: float = np.nan) -> np.ndarray:
+        """(n_wallets, window, 4) [value_eth, gas, gasPrice, is_outgoing] sequences for sequence models."""
+        cols = [self.get(c) for c in ("value_eth", "gas", "gas_price", "is_outgoing")]
+        return self.batch.window_matrix(cols, window=window, fill=fill)
+
+
+def wallet_engine(tx_df: pd.DataFrame, wallet: str, overrides: Optional[Dict[str, float]] = None) -> FeatureEngine:
+    """Engine over a single wallet's history; scalar overrides are allowed."""
+    batch = TxBatch.for_wallet(tx_df, wallet)
+    return FeatureEngine(batch, {k: [v] for k, v in (overrides or {}).items()})
+
+
+def compute_wallet_features(tx_df: pd.DataFrame, wallet: str, names: Sequence[str],
+                            overrides: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    engine = wallet_engine(tx_df, wallet, overrides)
+    return {name: float(engine.get(name)[0]) for name in names}
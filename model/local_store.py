@@ -0,0 +1,71 @@
+import os
+import sqlite3
+import threading
+
+# Local stand-in for a shared store (Redis/Postgres in a real deployment).
+# A single SQLite file in WAL mode is safe to share between threads and
+# between forked worker processes on the same machine.
+BASE_DIR = os.path.dirname(__file__)
+DEFAULT_STORE_PATH = os.path.join(BASE_DIR, ".karma_store.sqlite3")
+STORE_PATH = os.getenv("KARMA_STORE_PATH", DEFAULT_STORE_PATH)
+# State every node on the host must share even when each keeps its own store:
+# the explorer rate-limit buckets (one budget per API key). serve.py points it
+# at the host store when it gives a clustered node a store of its own.
+SHARED_STORE_PATH = os.getenv("KARMA_SHARED_STORE_PATH", STORE_PATH)
+# How long a statement waits on another connection's write lock
+STORE_BUSY_TIMEOUT_SECS = 30
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schemas = []
+
+
+def register_schema(ddl: str):
+    """Register DDL that must exist before any connection is handed out."""
+    with _schema_lock:
+        _schemas.append(ddl)
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the store. Connections are opened in
+    autocommit mode; callers use `transaction()` for multi-statement updates.
+    """
+    path = path or STORE_PATH
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    # Connections must never cross a fork, so key them by pid as well
+    key = (os.getpid(), path)
+    entry = conns.get(key)
+    if entry is None:
+        conn = sqlite3.connect(path, timeout=STORE_BUSY_TIMEOUT_SECS, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        entry = conns[key] = [conn, 0]
+    # Modules register their tables at import; apply any the connection hasn't seen
+    if entry[1] < len(_schemas):
+        with _schema_lock:
+            pending = _schemas[entry[1]:]
+        for ddl in pending:
+            entry[0].executescript(ddl)
+        entry[1] += len(pending)
+    return entry[0]
+
+
+class transaction:
+    """`with transaction() as conn:` runs the block under BEGIN IMMEDIATE."""
+
+    def __init__(self, path: str = None):
+        self.conn = connect(path)
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.conn.execute("COMMIT")
+        else:
+            self.conn.execute("ROLLBACK")
+        return False
@@ -1,3 +1,5 @@
+import os
+import sys
 import torch
 import torch.nn as nn
 import numpy as np
@@ -6,6 +8,9 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_absolute_error, r2_score
 import pickle
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.tx_transformer import TxTransformerFICO, save_checkpoint
+
 # Device setup
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"🖥️ Using device: {device}")
@@ -17,7 +22,7 @@ batch_size = 16
 # Load data
 print("📥 Loading data...")
 X_tx = np.load("X_tx_matrix.npy")              # (N, 100, 4)
-X_wallet = np.load("X_wallet_features.npy")    # (N, 5)
+X_wallet = np.load("X_wallet_features.npy")    # (N, 4), see tx_transformer.WALLET_INPUTS
 y = np.load("y_fico_scores.npy")               # (N,)
 print(f"✅ X_tx: {X_tx.shape}, X_wallet: {X_wallet.shape}, y: {y.shape}")
 
@@ -54,37 +59,7 @@ dataset = TensorDataset(X_tensor, y_tensor)
 dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
 
 # Model
-class TxTransformerFICO(nn.Module):
-    def __init__(self, input_dim=9, d_model=64, nhead=4, num_layers=3):
-        super().__init__()
-        self.input_projection = nn.Linear(input_dim, d_model)
-        encoder_layer = nn.TransformerEncoderLayer(
-            d_model=d_model,
-            nhead=nhead,
-            dim_feedforward=128,
-            dropout=0.1,
-            batch_first=True
-        )
-        self.transformer_encoder = nn.TransformerEncoder(encoder_layer, num_layers=num_layers)
-        self.attn_pool = nn.Sequential(
-            nn.Linear(d_model, 64),
-            nn.Tanh(),
-            nn.Linear(64, 1)
-        )
-        self.regressor = nn.Sequential(
-            nn.Linear(d_model, 64),
-            nn.ReLU(),
-            nn.Linear(64, 1)
-        )
-
-    def forward(self, x):
-        x = self.input_projection(x)
-        x = self.transformer_encoder(x)
-        attn_weights = torch.softmax(self.attn_pool(x), dim=1)
-        x_pooled = torch.sum(attn_weights * x, dim=1)
-        return self.regressor(x_pooled).squeeze(-1)
-
-model = TxTransformerFICO().to(device)
+model = TxTransformerFICO(input_dim=X_combined.shape[-1]).to(device)
 optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4, weight_decay=1e-2)
 criterion = nn.MSELoss()
 
@@ -149,4 +124,8 @@ with open("scaler_tx.pkl", "wb") as f_tx:
 with open("scaler_wallet.pkl", "wb") as f_wallet:
     pickle.dump(scaler_wallet, f_wallet)
 
-print("💾 Saved scalers: scaler_tx.pkl and scaler_wallet.pkl")
\ No newline at end of file
+print("💾 Saved scalers: scaler_tx.pkl and scaler_wallet.pkl")
+
+# Weights + both scalers in one file, loadable with tx_transformer.load_checkpoint
+save_checkpoint("tx_transformer.pt", model, scaler_tx, scaler_wallet)
+print("💾 Saved checkpoint: tx_transformer.pt")
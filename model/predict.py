@@ -3,6 +3,10 @@ import pandas as pd
 import pickle
 
 import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model.features import MODEL_FEATURES, FeatureEngine, TxBatch
+
 base_dir = os.path.dirname(__file__)
 model_path = os.path.join(base_dir, "model_pkls", "fico_xgb_model.pkl")
 scaler_path = os.path.join(base_dir, "model_pkls", "fico_xgb_scaler.pkl")
@@ -25,36 +29,15 @@ if wallet_row.empty:
     raise ValueError(f"❌ Wallet {target_wallet} not found in wallet features CSV")
 
 wallet_features = wallet_row.iloc[0]
-wallet_vector = np.array([
-    wallet_features["wallet_age_days"],
-    wallet_features["tx_count"],
-    wallet_features["avg_tx_value_eth"],
-    wallet_features["active_days"],
-    0.0
-], dtype=np.float32)
-
-# === Extract transaction history ===
-txs = transactions_df[
-    (transactions_df["from"].str.lower() == target_wallet) |
-    (transactions_df["to"].str.lower() == target_wallet)
-].copy()
-
-# If no transactions found, pad with zeros
-if txs.empty:
-    tx_mean = np.zeros(4)
-    tx_std = np.zeros(4)
-else:
-    txs["value_eth"] = txs["value_eth"].astype(float)
-    txs["gas"] = txs["gas"].astype(float)
-    txs["gasPrice"] = txs["gasPrice"].astype(float)
-    txs["is_outgoing"] = (txs["from"].str.lower() == target_wallet).astype(int)
-
-    tx_features = txs[["value_eth", "gas", "gasPrice", "is_outgoing"]].to_numpy(dtype=np.float32)
-    tx_mean = np.mean(tx_features, axis=0)
-    tx_std = np.std(tx_features, axis=0)
 
-# === Combine features ===
-combined = np.concatenate([tx_mean, tx_std, wallet_vector]).reshape(1, -1)
+# === Build the model vector from the shared feature registry ===
+# Wallet-level values come from the CSV; tx window stats from the wallet's transactions
+batch = TxBatch.from_transactions(transactions_df, [target_wallet])
+engine = FeatureEngine(batch, {
+    name: [wallet_features[name]]
+    for name in ("wallet_age_days", "tx_count", "avg_tx_value_eth", "active_days")
+})
+combined = engine.matrix(MODEL_FEATURES).astype(np.float32)
 
 # === Step 6: Apply pre-fitted scaler ===
 X_scaled = scaler.transform(combined)
@@ -0,0 +1,283 @@
+"""
+Population index of the latest FICO and karma score per wallet.
+
+The latest score of every (kind, chain, wallet) lives in the local store
+(population_scores), and every change is appended to population_score_log.
+Each process keeps one Fenwick tree per (kind, chain) over 0.01-wide score
+buckets and catches up by replaying the log, so preforked workers share one
+population without re-reading it. Percentile, rank and range counts are
+O(log buckets); top/bottom-N and range listings walk the store's score index.
+
+    record_score("fico", "ethereum", wallet, 74.2)
+    percentile_of("fico", "ethereum", 74.2)  # {"score", "rank", "percentile", "population"}
+
+In a sharded cluster each node indexes the wallets it owns; counts(),
+histogram() and leaderboard() results add up and merge across nodes. A node
+serving a wallet for an unreachable owner runs under not_owner(), so the
+wallet is never indexed twice.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model.local_store import connect, register_schema, transaction
+
+SCORE_KINDS = ("fico", "karma")
+SCORE_MIN, SCORE_MAX = 0.0, 100.0
+SCORE_RESOLUTION = 0.01
+N_BUCKETS = int(round((SCORE_MAX - SCORE_MIN) / SCORE_RESOLUTION)) + 1
+# Log rows kept for catching up; a process further behind rebuilds from population_scores
+SCORE_INDEX_LOG_KEEP = int(os.getenv("SCORE_INDEX_LOG_KEEP", "100000"))
+
+# False while this node serves a wallet it doesn't own (sharded failover)
+_owner = contextvars.ContextVar("population_owner", default=True)
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS population_scores (
+    kind TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    score REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (kind, chain, wallet)
+);
+CREATE INDEX IF NOT EXISTS population_scores_by_score ON population_scores (kind, chain, score, wallet);
+CREATE TABLE IF NOT EXISTS population_score_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    old_score REAL,  -- NULL when the wallet entered the population
+    new_score REAL NOT NULL
+);
+""")
+
+
+def bucket(score: float) -> int:
+    return int(round((min(max(score, SCORE_MIN), SCORE_MAX) - SCORE_MIN) / SCORE_RESOLUTION))
+
+
+class Fenwick:
+    """Counts per bucket with O(log n) point updates and prefix sums."""
+
+    def __init__(self, counts: np.ndarray):
+        n = len(counts)
+        idx = np.arange(1, n + 1)
+        cumulative = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)])
+        # tree[i] covers buckets (i - lowbit(i), i]
+        self.tree = [0] + (cumulative[idx] - cumulative[idx - (idx & -idx)]).tolist()
+        self.counts = np.array(counts, dtype=np.int64)
+        self.n = n
+        self.total = int(cumulative[-1])
+
+    def add(self, i: int, delta: int):
+        self.total += delta
+        self.counts[i] += delta
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """Count in buckets [0, i]."""
+        count = 0
+        i = min(i, self.n - 1) + 1
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+
+class PopulationIndex:
+    def __init__(self):
+        self._trees: Dict[Tuple[str, str], Fenwick] = {}
+        self._seq = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _rebuild(self):
+        conn = connect()
+        conn.execute("BEGIN")
+        try:
+            # One read snapshot: the table and the log position agree
+            seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM population_score_log").fetchone()[0]
+            rows = conn.execute("SELECT kind, chain, score FROM population_scores").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        grouped: Dict[Tuple[str, str], List[float]] = {}
+        for kind, chain, score in rows:
+            grouped.setdefault((kind, chain), []).append(score)
+        self._trees = {
+            key: Fenwick(np.bincount([bucket(s) for s in scores], minlength=N_BUCKETS))
+            for key, scores in grouped.items()
+        }
+        self._seq = seq
+        self._pid = os.getpid()
+
+    def _tree(self, kind: str, chain: str) -> Fenwick:
+        key = (kind, chain)
+        if key not in self._trees:
+            self._trees[key] = Fenwick(np.zeros(N_BUCKETS, dtype=np.int64))
+        return self._trees[key]
+
+    def sync(self):
+        """Applies log entries written (by any process) since the last sync."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._rebuild()
+                return
+            conn = connect()
+            first = conn.execute("SELECT MIN(seq) FROM population_score_log").fetchone()[0]
+            if first is not None and first > self._seq + 1:
+                # Entries we never saw were pruned
+                self._rebuild()
+                return
+            for seq, kind, chain, old_score, new_score in conn.execute(
+                "SELECT seq, kind, chain, old_score, new_score FROM population_score_log WHERE seq > ? ORDER BY seq",
+                (self._seq,),
+            ):
+                tree = self._tree(kind, chain)
+                if old_score is not None:
+                    tree.add(bucket(old_score), -1)
+                tree.add(bucket(new_score), 1)
+                self._seq = seq
+
+    def counts(self, kind: str, chain: str, score: float) -> Tuple[int, int, int]:
+        """(below, equal, population) for `score`'s bucket."""
+        self.sync()
+        with self._lock:
+            tree = self._trees.get((kind, chain))
+            if tree is None:
+                return 0, 0, 0
+            b = bucket(score)
+            below = tree.prefix(b - 1) if b > 0 else 0
+            return below, tree.prefix(b) - below, tree.total
+
+    def histogram(self, kind: str, chain: str) -> np.ndarray:
+        self.sync()
+        with self._lock:
+            tree = self._trees.get((kind, chain))
+            return np.zeros(N_BUCKETS, dtype=np.int64) if tree is None else tree.counts.copy()
+
+    def count_between(self, kind: str, chain: str, low: float, high: float) -> int:
+        self.sync()
+        with self._lock:
+            tree = self._trees.get((kind, chain))
+            if tree is None or high < low:
+                return 0
+            lo = bucket(low)
+            return tree.prefix(bucket(high)) - (tree.prefix(lo - 1) if lo > 0 else 0)
+
+
+_index = PopulationIndex()
+
+
+def _check_kind(kind: str):
+    if kind not in SCORE_KINDS:
+        raise ValueError(f"kind must be one of {SCORE_KINDS}, not {kind!r}")
+
+
+@contextmanager
+def not_owner():
+    """Inside `with not_owner():` record_score() is a no-op: the wallet's owner node indexes it."""
+    token = _owner.set(False)
+    try:
+        yield
+    finally:
+        _owner.reset(token)
+
+
+def record_score(kind: str, chain: str, wallet: str, score: float):
+    """Sets the wallet's latest score; unchanged scores write nothing."""
+    _check_kind(kind)
+    if not _owner.get():
+        return
+    wallet, score = wallet.lower(), float(score)
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT score FROM population_scores WHERE kind = ? AND chain = ? AND wallet = ?", (kind, chain, wallet)
+        ).fetchone()
+        old_score = row[0] if row else None
+        if old_score == score:
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO population_scores (kind, chain, wallet, score, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, chain, wallet, score, time.time()),
+        )
+        seq = conn.execute(
+            "INSERT INTO population_score_log (kind, chain, old_score, new_score) VALUES (?, ?, ?, ?)",
+            (kind, chain, old_score, score),
+        ).lastrowid
+        if seq % 1000 == 0:
+            conn.execute("DELETE FROM population_score_log WHERE seq <= ?", (seq - SCORE_INDEX_LOG_KEEP,))
+
+
+def counts(kind: str, chain: str, score: float) -> Tuple[int, int, int]:
+    """(wallets below, wallets in the same bucket, population) for `score`. Additive across shards."""
+    _check_kind(kind)
+    return _index.counts(kind, chain, score)
+
+
+def histogram(kind: str, chain: str) -> np.ndarray:
+    """Wallets per SCORE_RESOLUTION bucket. Additive across shards."""
+    _check_kind(kind)
+    return _index.histogram(kind, chain)
+
+
+def counts_from_histogram(hist: np.ndarray, score: float) -> Tuple[int, int, int]:
+    """counts() against a histogram, e.g. other shards' summed."""
+    b = bucket(score)
+    return int(hist[:b].sum()), int(hist[b]), int(hist.sum())
+
+
+def percentile_from_counts(score: float, below: int, equal: int, population: int) -> dict:
+    """Percentile (ties count half) and rank (1 = best) of `score`."""
+    return {
+        "score": round(score, 2),
+        "rank": population - below - equal + 1 if population else None,
+        "percentile": round((below + 0.5 * equal) / population * 100, 2) if population else None,
+        "population": population,
+    }
+
+
+def percentile_of(kind: str, chain: str, score: float) -> dict:
+    """Where `score` would sit in this store's population."""
+    return percentile_from_counts(score, *counts(kind, chain, score))
+
+
+def latest_score(kind: str, chain: str, wallet: str) -> Optional[float]:
+    _check_kind(kind)
+    row = connect().execute(
+        "SELECT score FROM population_scores WHERE kind = ? AND chain = ? AND wallet = ?", (kind, chain, wallet.lower())
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def count_between(kind: str, chain: str, low: float, high: float) -> int:
+    """Wallets scoring in [low, high] (at SCORE_RESOLUTION)."""
+    _check_kind(kind)
+    return _index.count_between(kind, chain, low, high)
+
+
+def leaderboard(kind: str, chain: str, limit: int = 10, top: bool = True,
+                low: Optional[float] = None, high: Optional[float] = None) -> List[dict]:
+    """Highest (or lowest) scoring wallets, optionally within [low, high]."""
+    _check_kind(kind)
+    clauses, params = ["kind = ?", "chain = ?"], [kind, chain]
+    if low is not None:
+        clauses.append("score >= ?")
+        params.append(low)
+    if high is not None:
+        clauses.append("score <= ?")
+        params.append(high)
+    order = "DESC" if top else "ASC"
+    rows = connect().execute(
+        f"SELECT wallet, score, updated_at FROM population_scores WHERE {' AND '.join(clauses)} "
+        f"ORDER BY score {order}, wallet {order} LIMIT ?",
+        [*params, int(limit)],
+    ).fetchall()
+    return [{"wallet": wallet, "score": round(score, 2), "updated_at": updated_at} for wallet, score, updated_at in rows]
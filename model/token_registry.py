@@ -0,0 +1,202 @@
+"""
+Token registry: decimals, symbol and USD price of every ERC-20 contract a
+scored wallet has touched.
+
+Explorer tokentx rows carry each token's symbol and decimals, so a contract
+is registered the first time it is seen and reused from the local store (and
+an in-process cache) after that. Prices are keyed by contract address only:
+anyone can deploy a token called "USDC", so symbols never price anything.
+Known USD stablecoin contracts (STABLECOIN_CONTRACTS) are pegged at 1.0 and
+TOKEN_PRICES_PATH (a JSON object keyed by contract address) prices the rest;
+any other token is unpriced (NaN) and left out of USD totals. Resolved
+prices are re-read every TOKEN_REGISTRY_TTL_SECS.
+
+normalize_token_values() turns a wallet's mixed-token transfers into token and
+USD amounts with one factorize + gather, however many tokens it holds.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, NamedTuple, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from model.local_store import connect, register_schema, transaction
+
+# PayPal USD (PYUSD) on Ethereum
+PAYPAL_USD_CONTRACT = os.getenv("PAYPAL_USD_CONTRACT", "0x6c3ea9036406852006290770bedfcaba0e23a0e8").lower()
+TOKEN_PRICES_PATH = os.getenv("TOKEN_PRICES_PATH")
+TOKEN_REGISTRY_TTL_SECS = float(os.getenv("TOKEN_REGISTRY_TTL_SECS", str(24 * 3600)))
+
+# chain -> contract -> symbol of the USD stablecoins pegged at 1.0
+STABLECOIN_CONTRACTS = {
+    "ethereum": {
+        "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48": "USDC",
+        "0xdac17f958d2ee523a2206206994597c13d831ec7": "USDT",
+        "0x6b175474e89094c44da98b954eedeac495271d0f": "DAI",
+        "0x6c3ea9036406852006290770bedfcaba0e23a0e8": "PYUSD",
+        "0x4fabb145d64652a948d72533023f6e7a623c7c53": "BUSD",
+        "0x0000000000085d4780b73119b644ae5ecd22b376": "TUSD",
+        "0x8e870d67f660d95d5be530380d0ec0bd388289e1": "USDP",
+        "0xc5f0f7b66764f6ec8c8dff7ba683102295e16409": "FDUSD",
+    },
+    "bnb": {
+        "0x55d398326f99059ff775485246999027b3197955": "USDT",
+        "0x8ac76a51cc950d9822d68b83fe1ad97b32cd580d": "USDC",
+        "0xe9e7cea3dedca5984780bafc599bd69add087d56": "BUSD",
+        "0x1af3f329e8be154074d8769d1ffa4ee058b1dbc3": "DAI",
+        "0xc5f0f7b66764f6ec8c8dff7ba683102295e16409": "FDUSD",
+    },
+    "sepolia": {
+        "0x1c7d4b196cb0c7b01d743fbc6116a902379c7238": "USDC",
+    },
+}
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS token_registry (
+    chain TEXT NOT NULL,
+    contract TEXT NOT NULL,
+    symbol TEXT,
+    decimals INTEGER NOT NULL,
+    price_usd REAL,  -- NULL when unpriced
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (chain, contract)
+);
+""")
+
+
+class TokenInfo(NamedTuple):
+    symbol: str
+    decimals: int
+    price_usd: float   # NaN when unpriced
+    stablecoin: bool
+    updated_at: float
+
+
+_cache: Dict[Tuple[str, str], TokenInfo] = {}
+_cache_lock = threading.Lock()
+_prices = (None, None, {})  # (path, mtime, prices)
+
+
+def _price_overrides() -> dict:
+    global _prices
+    if not TOKEN_PRICES_PATH:
+        return {}
+    try:
+        mtime = os.stat(TOKEN_PRICES_PATH).st_mtime
+    except OSError:
+        return {}
+    path, cached_mtime, prices = _prices
+    if path != TOKEN_PRICES_PATH or cached_mtime != mtime:
+        with open(TOKEN_PRICES_PATH) as f:
+            prices = {str(k).lower(): float(v) for k, v in json.load(f).items()}
+        _prices = (TOKEN_PRICES_PATH, mtime, prices)
+    return prices
+
+
+def _is_stablecoin(chain: str, contract: str) -> bool:
+    return contract in STABLECOIN_CONTRACTS.get(chain, {}) or (chain == "ethereum" and contract == PAYPAL_USD_CONTRACT)
+
+
+def resolve_price(chain: str, contract: str) -> float:
+    """USD price of one token of `contract`: the peg, a TOKEN_PRICES_PATH entry, or NaN."""
+    if _is_stablecoin(chain, contract):
+        return 1.0
+    return _price_overrides().get(contract, float("nan"))
+
+
+def _register(chain: str, found: pd.DataFrame):
+    """Upserts (contract, symbol, decimals) rows with freshly resolved prices."""
+    now = time.time()
+    rows = []
+    for contract, symbol, decimals in found.itertuples(index=False):
+        price = resolve_price(chain, contract)
+        rows.append((chain, contract, symbol, int(decimals), None if np.isnan(price) else price, now))
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO token_registry (chain, contract, symbol, decimals, price_usd, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+def lookup(chain: str, contracts: Sequence[str], seen: pd.DataFrame = None) -> Dict[str, TokenInfo]:
+    """
+    TokenInfo for each contract: in-process cache, then the store, then
+    `seen` (contract, symbol, decimals rows from the transfers themselves),
+    which registers contracts that are new or whose price has expired.
+    """
+    now = time.time()
+    found, missing = {}, []
+    with _cache_lock:
+        for contract in contracts:
+            info = _cache.get((chain, contract))
+            if info is not None and now - info.updated_at < TOKEN_REGISTRY_TTL_SECS:
+                found[contract] = info
+            else:
+                missing.append(contract)
+    if not missing:
+        return found
+
+    loaded = {}
+    for start in range(0, len(missing), 500):
+        chunk = missing[start:start + 500]
+        for contract, symbol, decimals, updated_at in connect().execute(
+            "SELECT contract, symbol, decimals, updated_at FROM token_registry "
+            f"WHERE chain = ? AND contract IN ({','.join('?' * len(chunk))})",
+            [chain, *chunk],
+        ):
+            if now - updated_at < TOKEN_REGISTRY_TTL_SECS:
+                # Stored prices are informational; pricing rules may have changed since
+                loaded[contract] = TokenInfo(symbol, decimals, resolve_price(chain, contract),
+                                             _is_stablecoin(chain, contract), updated_at)
+
+    unknown = [c for c in missing if c not in loaded]
+    if unknown and seen is not None:
+        new = seen[seen["contract"].isin(unknown)]
+        if not new.empty:
+            _register(chain, new)
+            for contract, symbol, decimals in new.itertuples(index=False):
+                loaded[contract] = TokenInfo(symbol, int(decimals), resolve_price(chain, contract),
+                                             _is_stablecoin(chain, contract), now)
+    with _cache_lock:
+        for contract, info in loaded.items():
+            _cache[(chain, contract)] = info
+    found.update(loaded)
+    return found
+
+
+def normalize_token_values(chain: str, token_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds token_contract, token_symbol, value_token (decimal-adjusted),
+    value_usd (NaN when unpriced) and is_stablecoin to explorer tokentx rows.
+    """
+    if token_df.empty:
+        return token_df
+    contract = token_df["contractAddress"].astype(str).str.lower()
+    codes, uniques = pd.factorize(contract)
+    seen = pd.DataFrame({
+        "contract": contract,
+        "symbol": token_df.get("tokenSymbol", pd.Series("", index=token_df.index)).astype(str),
+        "decimals": pd.to_numeric(token_df.get("tokenDecimal", pd.Series(18, index=token_df.index)),
+                                  errors="coerce").fillna(18).astype(int),
+    }).drop_duplicates("contract")
+    infos = lookup(chain, list(uniques), seen)
+
+    # Per-token tables, gathered onto the rows by factorized code
+    default = TokenInfo("", 18, float("nan"), False, 0.0)
+    table = [infos.get(c, default) for c in uniques]
+    symbols = np.array([t.symbol for t in table], dtype=object)
+    scale = np.array([10.0 ** -t.decimals for t in table])
+    prices = np.array([t.price_usd for t in table], dtype=np.float64)
+    stable = np.array([t.stablecoin for t in table], dtype=bool)
+
+    raw = pd.to_numeric(token_df["value"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+    token_df["token_contract"] = contract.to_numpy()
+    token_df["token_symbol"] = symbols[codes]
+    token_df["value_token"] = raw * scale[codes]
+    token_df["value_usd"] = token_df["value_token"].to_numpy() * prices[codes]
+    token_df["is_stablecoin"] = stable[codes]
+    return token_df
@@ -0,0 +1,282 @@
+"""
+Transaction store shared by every wallet we score.
+
+Transactions are stored once per (chain, tx_id) no matter how many tracked
+wallets fetched them, and `wallet_txs` indexes each one under both its sender
+and its recipient. The counterparty graph over all stored transactions is
+materialised as a sparse address x address matrix, so population-wide graph
+features are a couple of sparse mat-vec products.
+
+A wallet's stored history is paged newest first with a keyset cursor on
+(timestamp, tx_id), which walks the wallet_txs_by_time index: each page costs
+the same however long the history is.
+"""
+import base64
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from model.local_store import connect, register_schema, transaction
+
+# How long a built counterparty graph is reused before checking the store again
+GRAPH_REFRESH_SECS = float(os.getenv("GRAPH_REFRESH_SECS", "60"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS transactions (
+    chain TEXT NOT NULL,
+    tx_id TEXT NOT NULL,
+    from_addr TEXT,
+    to_addr TEXT,
+    value_eth REAL,
+    timestamp INTEGER,
+    raw_json TEXT NOT NULL,
+    PRIMARY KEY (chain, tx_id)
+);
+CREATE TABLE IF NOT EXISTS wallet_txs (
+    chain TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    tx_id TEXT NOT NULL,
+    timestamp INTEGER,
+    PRIMARY KEY (chain, wallet, tx_id)
+);
+CREATE INDEX IF NOT EXISTS wallet_txs_by_time ON wallet_txs (chain, wallet, timestamp DESC, tx_id DESC);
+""")
+
+
+def tx_ids(tx_df: pd.DataFrame) -> List[str]:
+    """
+    Store keys for explorer rows. Token transfers share their parent tx hash,
+    so they are keyed by hash + log index when the explorer provides one, and
+    by hash + token, endpoints and amount otherwise.
+    """
+    if tx_df.empty:
+        return []
+    hashes = tx_df["hash"].astype(str).str.lower() if "hash" in tx_df.columns else pd.Series(
+        [f"row{i}" for i in range(len(tx_df))], index=tx_df.index)
+    if "logIndex" in tx_df.columns:
+        return (hashes + ":" + tx_df["logIndex"].astype(str)).tolist()
+    if "tokenDecimal" in tx_df.columns:
+        # tokentx rows carry no log index; a swap moves several tokens in one tx
+        moved = [tx_df[c].astype(str).str.lower() for c in ("contractAddress", "from", "to", "value") if c in tx_df.columns]
+        return (hashes + ":" + pd.concat(moved, axis=1).agg(":".join, axis=1)).tolist()
+    return hashes.tolist()
+
+
+def store_transactions(chain: str, tx_df: pd.DataFrame) -> List[str]:
+    """
+    Upserts explorer rows (deduplicated by tx id) and indexes them under both
+    endpoints. Returns the ids in the frame's order.
+    """
+    ids = tx_ids(tx_df)
+    if not ids:
+        return ids
+    # datetime is derived from timeStamp on load, so it is not stored
+    records = json.loads(tx_df.drop(columns=["datetime"], errors="ignore").to_json(orient="records"))
+    senders = tx_df["from"].astype(str).str.lower().tolist() if "from" in tx_df.columns else [None] * len(ids)
+    recipients = tx_df["to"].astype(str).str.lower().tolist() if "to" in tx_df.columns else [None] * len(ids)
+    values = pd.to_numeric(tx_df.get("value_eth", pd.Series(0.0, index=tx_df.index)), errors="coerce").fillna(0.0).tolist()
+    stamps = pd.to_numeric(tx_df.get("timeStamp", pd.Series(0, index=tx_df.index)), errors="coerce").fillna(0).astype(int).tolist()
+
+    tx_rows = [
+        (chain, tx_id, sender, recipient, value, stamp, json.dumps(record))
+        for tx_id, sender, recipient, value, stamp, record in zip(ids, senders, recipients, values, stamps, records)
+    ]
+    index_rows = []
+    for tx_id, sender, recipient, stamp in zip(ids, senders, recipients, stamps):
+        for address in {sender, recipient}:
+            if address:
+                index_rows.append((chain, address, tx_id, stamp))
+
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO transactions (chain, tx_id, from_addr, to_addr, value_eth, timestamp, raw_json) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            tx_rows,
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO wallet_txs (chain, wallet, tx_id, timestamp) VALUES (?, ?, ?, ?)",
+            index_rows,
+        )
+    return ids
+
+
+def load_transactions(chain: str, ids: Sequence[str]) -> pd.DataFrame:
+    """Rebuilds an explorer-style frame for `ids`, preserving their order."""
+    if not ids:
+        return pd.DataFrame()
+    conn = connect()
+    raw = {}
+    # Stay under SQLite's bound-parameter limit
+    for start in range(0, len(ids), 500):
+        chunk = list(ids[start:start + 500])
+        for tx_id, raw_json in conn.execute(
+            f"SELECT tx_id, raw_json FROM transactions WHERE chain = ? AND tx_id IN ({','.join('?' * len(chunk))})",
+            [chain, *chunk],
+        ):
+            raw[tx_id] = raw_json
+    tx_df = pd.DataFrame([json.loads(raw[i]) for i in ids if i in raw])
+    if not tx_df.empty and "timeStamp" in tx_df.columns:
+        tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
+    return tx_df
+
+
+# === History paging ===
+class StoredTx(NamedTuple):
+    tx_id: str
+    timestamp: int
+    direction: str   # "in", "out" or "self", relative to the paged wallet
+    record: dict     # the explorer row as stored
+
+
+def encode_cursor(timestamp: int, tx_id: str) -> str:
+    """Opaque cursor pointing just past (timestamp, tx_id) in newest-first order."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, tx_id]).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Raises ValueError for a cursor this module did not produce."""
+    try:
+        timestamp, tx_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(timestamp), str(tx_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def iter_wallet_transactions(chain: str, wallet: str, cursor: Optional[str] = None, limit: int = 50,
+                             direction: Optional[str] = None, since: Optional[int] = None,
+                             until: Optional[int] = None) -> Iterator[StoredTx]:
+    """
+    Streams up to `limit` of the wallet's stored transactions, newest first,
+    starting after `cursor`. `direction` ("in"/"out") and the
+    [since, until) unix-time range are applied in the query. Rows are read
+    from SQLite as they are consumed, never materialised as a list.
+    """
+    wallet = wallet.lower()
+    clauses = ["w.chain = ?", "w.wallet = ?"]
+    params = [chain, wallet]
+    if cursor:
+        clauses.append("(w.timestamp, w.tx_id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    if since is not None:
+        clauses.append("w.timestamp >= ?")
+        params.append(int(since))
+    if until is not None:
+        clauses.append("w.timestamp < ?")
+        params.append(int(until))
+    if direction == "in":
+        clauses.append("t.to_addr = ?")
+        params.append(wallet)
+    elif direction == "out":
+        clauses.append("t.from_addr = ?")
+        params.append(wallet)
+    elif direction is not None:
+        raise ValueError(f"direction must be 'in' or 'out', not {direction!r}")
+    params.append(int(limit))
+
+    rows = connect().execute(
+        "SELECT w.tx_id, w.timestamp, t.from_addr, t.to_addr, t.raw_json "
+        "FROM wallet_txs w JOIN transactions t ON t.chain = w.chain AND t.tx_id = w.tx_id "
+        f"WHERE {' AND '.join(clauses)} ORDER BY w.timestamp DESC, w.tx_id DESC LIMIT ?",
+        params,
+    )
+    for tx_id, timestamp, sender, recipient, raw_json in rows:
+        if sender == recipient:
+            side = "self"
+        else:
+            side = "out" if sender == wallet else "in"
+        yield StoredTx(tx_id, timestamp, side, json.loads(raw_json))
+
+
+# === Counterparty graph ===
+class CounterpartyGraph(NamedTuple):
+    addresses: pd.Index
+    tx_counts: "object"   # scipy.sparse.csr_matrix, symmetric, tx counts between addresses
+    adjacency: "object"   # same pattern with unit weights
+    built_at: float
+    version: int
+
+
+_graphs: Dict[str, CounterpartyGraph] = {}
+_graphs_lock = threading.Lock()
+
+
+def store_version() -> int:
+    """Changes whenever a transaction is stored: rows are never deleted, so the newest rowid marks it."""
+    row = connect().execute("SELECT MAX(rowid) FROM transactions").fetchone()
+    return int(row[0] or 0)
+
+
+def build_counterparty_graph(chain: str) -> CounterpartyGraph:
+    from scipy import sparse
+
+    version = store_version()  # read first: rows stored during the build trigger another one
+    rows = connect().execute(
+        "SELECT from_addr, to_addr FROM transactions WHERE chain = ? AND from_addr IS NOT NULL AND to_addr IS NOT NULL",
+        (chain,),
+    ).fetchall()
+    senders = np.array([r[0] for r in rows], dtype=object)
+    recipients = np.array([r[1] for r in rows], dtype=object)
+    codes, addresses = pd.factorize(np.concatenate([senders, recipients]))
+    n, m = len(addresses), len(rows)
+    i, j = codes[:m], codes[m:]
+    keep = i != j  # self-transfers are not edges
+
+    counts = sparse.coo_matrix((np.ones(keep.sum()), (i[keep], j[keep])), shape=(n, n)).tocsr()
+    counts = (counts + counts.T).tocsr()
+    adjacency = counts.copy()
+    adjacency.data[:] = 1.0
+    return CounterpartyGraph(pd.Index(addresses), counts, adjacency, time.time(), version)
+
+
+def get_counterparty_graph(chain: str) -> CounterpartyGraph:
+    """Cached graph, rebuilt when it is older than GRAPH_REFRESH_SECS and the store has changed."""
+    with _graphs_lock:
+        graph = _graphs.get(chain)
+    if graph is not None and time.time() - graph.built_at < GRAPH_REFRESH_SECS:
+        return graph
+    if graph is not None and graph.version == store_version():
+        graph = graph._replace(built_at=time.time())
+    else:
+        graph = build_counterparty_graph(chain)
+    with _graphs_lock:
+        _graphs[chain] = graph
+    return graph
+
+
+def counterparty_graph_features(chain: str, scores: Dict[str, float],
+                                wallets: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Population-wide graph features, one row per address (or just `wallets`):
+    degree (distinct counterparties), tx_degree (txs with them), and the mean
+    score of the counterparties that have one.
+    """
+    graph = get_counterparty_graph(chain)
+    n = len(graph.addresses)
+    score_vec = np.zeros(n)
+    known = np.zeros(n)
+    if scores:
+        positions = graph.addresses.get_indexer(list(scores))
+        found = positions >= 0
+        score_vec[positions[found]] = np.fromiter(scores.values(), dtype=np.float64, count=len(scores))[found]
+        known[positions[found]] = 1.0
+
+    degree = np.asarray(graph.adjacency.sum(axis=1)).ravel()
+    tx_degree = np.asarray(graph.tx_counts.sum(axis=1)).ravel()
+    score_sum = graph.adjacency @ score_vec
+    scored = graph.adjacency @ known
+    avg_score = np.divide(score_sum, scored, out=np.full(n, np.nan), where=scored > 0)
+
+    features = pd.DataFrame({
+        "degree": degree,
+        "tx_degree": tx_degree,
+        "scored_counterparties": scored,
+        "counterparty_avg_score": avg_score,
+    }, index=graph.addresses)
+    if wallets is not None:
+        features = features.reindex([w.lower() for w in wallets]).fillna({"degree": 0, "tx_degree": 0, "scored_counterparties": 0})
+    return features
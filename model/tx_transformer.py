@@ -0,0 +1,77 @@
+"""
+TxTransformerFICO: the transaction-sequence model trained by model/model.py,
+importable without running the training script. Requires torch (the `train`
+extra).
+
+A checkpoint bundles the weights with the two scalers fitted in training, so
+a saved model can score fresh wallets (e.g. as a shadow candidate).
+"""
+import numpy as np
+import torch
+import torch.nn as nn
+
+# Wallet-level inputs repeated along each transaction row, in training order
+WALLET_INPUTS = ["wallet_age_days", "tx_count", "avg_tx_value_eth", "active_days"]
+
+
+class TxTransformerFICO(nn.Module):
+    def __init__(self, input_dim=8, d_model=64, nhead=4, num_layers=3):
+        super().__init__()
+        self.input_projection = nn.Linear(input_dim, d_model)
+        encoder_layer = nn.TransformerEncoderLayer(
+            d_model=d_model,
+            nhead=nhead,
+            dim_feedforward=128,
+            dropout=0.1,
+            batch_first=True
+        )
+        self.transformer_encoder = nn.TransformerEncoder(encoder_layer, num_layers=num_layers)
+        self.attn_pool = nn.Sequential(
+            nn.Linear(d_model, 64),
+            nn.Tanh(),
+            nn.Linear(64, 1)
+        )
+        self.regressor = nn.Sequential(
+            nn.Linear(d_model, 64),
+            nn.ReLU(),
+            nn.Linear(64, 1)
+        )
+
+    def forward(self, x):
+        x = self.input_projection(x)
+        x = self.transformer_encoder(x)
+        attn_weights = torch.softmax(self.attn_pool(x), dim=1)
+        x_pooled = torch.sum(attn_weights * x, dim=1)
+        return self.regressor(x_pooled).squeeze(-1)
+
+
+def combine_inputs(X_tx: np.ndarray, X_wallet: np.ndarray, scaler_tx, scaler_wallet) -> np.ndarray:
+    """
+    (N, T, 4) transaction windows + (N, len(WALLET_INPUTS)) wallet features ->
+    (N, T, 4 + len(WALLET_INPUTS)) model input, cleaned and scaled.
+    """
+    X_tx = np.nan_to_num(X_tx, nan=0.0, posinf=1e6, neginf=-1e6)
+    X_wallet = np.nan_to_num(X_wallet, nan=0.0, posinf=1e6, neginf=-1e6)
+    tx_scaled = scaler_tx.transform(X_tx.reshape(-1, X_tx.shape[-1])).reshape(X_tx.shape)
+    wallet_scaled = scaler_wallet.transform(X_wallet)
+    wallet_expanded = np.repeat(wallet_scaled[:, None, :], X_tx.shape[1], axis=1)
+    return np.concatenate([tx_scaled, wallet_expanded], axis=-1).astype(np.float32)
+
+
+def save_checkpoint(path: str, model: TxTransformerFICO, scaler_tx, scaler_wallet):
+    torch.save({
+        "input_dim": model.input_projection.in_features,
+        "state_dict": model.state_dict(),
+        "scaler_tx": scaler_tx,
+        "scaler_wallet": scaler_wallet,
+    }, path)
+
+
+def load_checkpoint(path: str):
+    """Returns (model in eval mode, scaler_tx, scaler_wallet)."""
+    # Not weights-only: the checkpoint carries the sklearn scalers
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    model = TxTransformerFICO(input_dim=checkpoint["input_dim"])
+    model.load_state_dict(checkpoint["state_dict"])
+    model.eval()
+    return model, checkpoint["scaler_tx"], checkpoint["scaler_wallet"]
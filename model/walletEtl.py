@@ -1,46 +1,105 @@
-import requests
 import pandas as pd
 from datetime import datetime
 import numpy as np
-import dotenv
 import os
+import requests
 
-dotenv.load_dotenv()
+from model.circuit_breaker import get_breaker
+from model.deadline import DeadlineExceeded, check_deadline, current_deadline
+from model.explorer_scheduler import (
+    ExplorerError, ExplorerRateLimited, ExplorerUnavailable, SchedulerSaturated, get_scheduler,
+)
+from model.features import SUMMARY_FEATURES, TOKEN_FEATURES, compute_wallet_features, wallet_engine
+from model.token_registry import PAYPAL_USD_CONTRACT, normalize_token_values
 
 ETHERSCAN_API_KEY = os.getenv("ETHERSCAN_API_KEY")
 BSCSCAN_API_KEY = os.getenv("BSCSCAN_API_KEY")
+# Optional comma-separated pools; the scheduler spreads calls across every key
+ETHERSCAN_API_KEYS = [k.strip() for k in os.getenv("ETHERSCAN_API_KEYS", ETHERSCAN_API_KEY or "").split(",") if k.strip()]
+BSCSCAN_API_KEYS = [k.strip() for k in os.getenv("BSCSCAN_API_KEYS", BSCSCAN_API_KEY or "").split(",") if k.strip()]
 BASE_ETH_URL = os.getenv("BASE_ETH_URL", "https://api.etherscan.io/api")
 BASE_BNB_URL = os.getenv("BASE_BNB_URL", "https://api.bscscan.com/api")
-PAYPAL_USD_CONTRACT = os.getenv("PAYPAL_USD_CONTRACT", "").lower()  # ERC-20 address
+BASE_SEPOLIA_URL = os.getenv("BASE_SEPOLIA_URL", "https://api-sepolia.etherscan.io/api")
+BASE_BSC_TESTNET_URL = os.getenv("BASE_BSC_TESTNET_URL", "https://api-testnet.bscscan.com/api")
+EXPLORER_TIMEOUT_SECS = float(os.getenv("EXPLORER_TIMEOUT_SECS", "5"))
+HISTORY_PAGE_SIZE = 100  # txlist rows per explorer call
+TOKEN_PAGE_SIZE = 1000  # tokentx rows per explorer call
+# Explorers refuse page * offset beyond 10k rows
+TOKEN_MAX_PAGES = int(os.getenv("TOKEN_MAX_PAGES", "10"))
+# A request waiting on a first fetch reads only the newest page of a scored token stream (paypalusd)
+TOKEN_INTERACTIVE_MAX_PAGES = int(os.getenv("TOKEN_INTERACTIVE_MAX_PAGES", "1"))
+
+# Chains served from a block explorer (the Flow chains use mock data)
+EXPLORER_CHAINS = ["ethereum", "bnb", "sepolia", "bsc-testnet"]
+# Chains whose wallets also get TOKEN_FEATURES (one extra tokentx stream, fetched on the batch lane)
+TOKEN_FEATURE_CHAINS = [c.strip() for c in os.getenv("TOKEN_FEATURE_CHAINS", ",".join(EXPLORER_CHAINS)).split(",") if c.strip()]
+# Summary flag: 1.0 while TOKEN_FEATURES are zeros awaiting the batch-lane token fetch
+TOKEN_FEATURES_PENDING = "token_features_pending"
 
 def get_scan_url(chain: str) -> str:
-    if chain == "ethereum":
+    if chain in ("ethereum", "paypalusd"):
         return BASE_ETH_URL
     elif chain == "bnb":
         return BASE_BNB_URL
+    elif chain == "sepolia":
+        return BASE_SEPOLIA_URL
+    elif chain == "bsc-testnet":
+        return BASE_BSC_TESTNET_URL
     else:
         raise ValueError(f"Unsupported chain: {chain}")
 
-def get_api_key(chain: str) -> str:
-    if chain == "ethereum":
-        if not ETHERSCAN_API_KEY:
+def get_api_keys(chain: str) -> list:
+    # Testnet explorers accept the mainnet keys
+    if chain in ("ethereum", "paypalusd", "sepolia"):
+        if not ETHERSCAN_API_KEYS:
             raise ValueError("ETHERSCAN_API_KEY environment variable not set")
-        return ETHERSCAN_API_KEY
-    elif chain == "bnb":
-        if not BSCSCAN_API_KEY:
+        return ETHERSCAN_API_KEYS
+    elif chain in ("bnb", "bsc-testnet"):
+        if not BSCSCAN_API_KEYS:
             raise ValueError("BSCSCAN_API_KEY environment variable not set")
-        return BSCSCAN_API_KEY
+        return BSCSCAN_API_KEYS
     else:
         raise ValueError(f"No API key available for chain: {chain}")
 
+def explorer_get(chain: str, params: dict, lane: str = "interactive", flow: str = "default") -> dict:
+    """Routes an explorer call through the chain's circuit breaker and the shared rate-limit scheduler."""
+    base_url, api_keys = get_scan_url(chain), get_api_keys(chain)
+    check_deadline(f"{chain} explorer call")
+    breaker = get_breaker(chain)
+    breaker.before_call()
+    try:
+        payload = get_scheduler().get(
+            base_url, params, api_keys,
+            lane=lane, flow=flow, timeout=EXPLORER_TIMEOUT_SECS, deadline=current_deadline(),
+        )
+    except (SchedulerSaturated, DeadlineExceeded, ExplorerRateLimited):
+        breaker.record_cancelled()  # local backpressure or our own key quota, says nothing about upstream health
+        raise
+    except (ExplorerUnavailable, requests.ConnectionError, requests.Timeout):
+        try:
+            # A timeout cut short by our own deadline isn't the upstream's fault
+            check_deadline(f"{chain} explorer call")
+        except DeadlineExceeded:
+            breaker.record_cancelled()
+            raise
+        breaker.record_failure()
+        raise
+    except ExplorerError:
+        # The explorer is up and rejected this request (e.g. "Invalid address format")
+        breaker.record_success()
+        raise
+    except Exception:
+        breaker.record_cancelled()  # never reached the explorer (e.g. no API keys configured)
+        raise
+    breaker.record_success()
+    return payload
+
 # Wallet age
-def get_wallet_age(wallet: str, base_url: str, api_key: str) -> int:
-    url = (
-        f"{base_url}?module=account&action=txlist"
-        f"&address={wallet}&startblock=0&endblock=99999999&page=1&offset=1"
-        f"&sort=asc&apikey={api_key}"
-    )
-    response = requests.get(url).json()
+def get_wallet_age(wallet: str, chain: str, lane: str = "interactive") -> int:
+    response = explorer_get(chain, {
+        "module": "account", "action": "txlist", "address": wallet,
+        "startblock": 0, "endblock": 99999999, "page": 1, "offset": 1, "sort": "asc",
+    }, lane=lane, flow=wallet)
     txs = response.get("result", [])
     if not txs:
         return 0
@@ -49,39 +108,62 @@ def get_wallet_age(wallet: str, base_url: str, api_key: str) -> int:
     return age_days
 
 # Generic transaction history (ETH or BNB)
-def get_transaction_history(wallet: str, base_url: str, api_key: str) -> pd.DataFrame:
-    url = (
-        f"{base_url}?module=account&action=txlist"
-        f"&address={wallet}&startblock=0&endblock=99999999"
-        f"&page=1&offset=100&sort=desc&apikey={api_key}"
-    )
-    response = requests.get(url).json()
+def get_transaction_history(wallet: str, chain: str, lane: str = "interactive", end_block: int = 99999999) -> pd.DataFrame:
+    response = explorer_get(chain, {
+        "module": "account", "action": "txlist", "address": wallet,
+        "startblock": 0, "endblock": end_block, "page": 1, "offset": HISTORY_PAGE_SIZE, "sort": "desc",
+    }, lane=lane, flow=wallet)
     txs = response.get("result", [])
-    if not isinstance(txs, list):
-        return pd.DataFrame()  # Fallback on malformed response
     df = pd.DataFrame(txs)
     if not df.empty and "timeStamp" in df.columns:
         df["timeStamp"] = df["timeStamp"].astype(int)
         df = df.sort_values("timeStamp", ascending=False)
     return df
 
-# ERC-20 Token Transfer History
-def get_erc20_transfers(wallet: str, base_url: str, api_key: str, token_contract: str) -> pd.DataFrame:
-    url = (
-        f"{base_url}?module=account&action=tokentx"
-        f"&address={wallet}&contractaddress={token_contract}"
-        f"&page=1&offset=100&sort=desc&apikey={api_key}"
-    )
-    response = requests.get(url).json()
-    txs = response.get("result", [])
+# ERC-20 transfers of every token, newest first
+def get_token_transfers(wallet: str, chain: str, lane: str = "interactive", contract: str = None) -> pd.DataFrame:
+    """
+    All of the wallet's token transfers as one paginated tokentx stream (no
+    contract filter), so a wallet holding N tokens still costs one call per
+    TOKEN_PAGE_SIZE rows rather than one call per token. The interactive lane
+    stops after TOKEN_INTERACTIVE_MAX_PAGES pages. `contract` narrows the
+    stream to one token.
+    """
+    txs = []
+    max_pages = TOKEN_INTERACTIVE_MAX_PAGES if lane == "interactive" else TOKEN_MAX_PAGES
+    for page in range(1, max_pages + 1):
+        params = {
+            "module": "account", "action": "tokentx", "address": wallet,
+            "page": page, "offset": TOKEN_PAGE_SIZE, "sort": "desc",
+        }
+        if contract:
+            params["contractaddress"] = contract
+        response = explorer_get(chain, params, lane=lane, flow=wallet)
+        rows = response.get("result", [])
+        if not isinstance(rows, list):
+            break
+        txs.extend(rows)
+        if len(rows) < TOKEN_PAGE_SIZE:
+            break
     df = pd.DataFrame(txs)
     if not df.empty and "timeStamp" in df.columns:
         df["timeStamp"] = df["timeStamp"].astype(int)
-        df = df.sort_values("timeStamp", ascending=False)
+        df = df.sort_values("timeStamp", ascending=False, kind="stable")
     return df
 
+def get_token_features(wallet: str, chain: str, lane: str = "batch") -> dict:
+    """TOKEN_FEATURES from the wallet's whole tokentx stream."""
+    token_df = with_token_values(get_token_transfers(wallet.lower(), chain, lane=lane), chain)
+    return compute_wallet_features(token_df, wallet.lower(), TOKEN_FEATURES)
+
 # Main entry: returns features and transactions
-def get_wallet_features(wallet: str, chain: str = "ethereum"):
+def get_wallet_features(wallet: str, chain: str = "ethereum", lane: str = "interactive"):
+    """
+    Summary and scored history of a wallet. TOKEN_FEATURES (not scored by the
+    model) cost their own tokentx stream, so the interactive lane leaves them
+    at zero with TOKEN_FEATURES_PENDING set and get_token_features() fills
+    them in on the batch lane; batch fetches include them.
+    """
     print(f"📡 Fetching data for wallet on {chain}: {wallet}")
 
     wallet = wallet.lower()
@@ -89,9 +171,8 @@ def get_wallet_features(wallet: str, chain: str = "ethereum"):
     # Handle Flow EVM testnet and other unsupported chains with mock data
     if chain in ["flow-evm-testnet", "flow", "flow-evm"]:
         print(f"⚠️  Chain {chain} not supported by API, using mock data")
-        # Return mock data for Flow EVM testnet
-        feature_vector = {
-            "wallet": wallet,
+        # Mock summary values for Flow EVM testnet; the rest are derived from the mock txs
+        mock_summary = {
             "wallet_age_days": 30,  # Mock 30 days
             "tx_count": 5,          # Mock 5 transactions
             "avg_tx_value_eth": 0.1, # Mock average value
@@ -99,7 +180,7 @@ def get_wallet_features(wallet: str, chain: str = "ethereum"):
         }
         # Create mock transaction DataFrame
         mock_tx_data = {
-            "hash": [f"0x{i:064x}" for i in range(5)],
+            "hash": [f"0x{wallet[2:42]}{i:024x}" for i in range(5)],  # unique per wallet in the tx store
             "from": [wallet if i % 2 == 0 else f"0x{'1' * 40}" for i in range(5)],
             "to": [f"0x{'2' * 40}" if i % 2 == 0 else wallet for i in range(5)],
             "value_eth": [0.1, 0.2, 0.05, 0.3, 0.15],
@@ -109,55 +190,61 @@ def get_wallet_features(wallet: str, chain: str = "ethereum"):
         }
         tx_df = pd.DataFrame(mock_tx_data)
         tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
-        return pd.DataFrame([feature_vector]), tx_df
+        return summarize_wallet(tx_df, wallet, mock_summary), tx_df
 
-    try:
-        base_url = get_scan_url(chain)
-        api_key = get_api_key(chain)
+    # Fetch errors propagate: reporting zero features would score the wallet as brand new.
+    # Serving falls back to the last known snapshot instead (see model/feature_cache.py).
+    with_tokens = chain == "paypalusd" or chain in TOKEN_FEATURE_CHAINS
+    if chain == "paypalusd":
+        # PYUSD transfers are the scored history, valued in USD; every token still feeds TOKEN_FEATURES
+        tx_df = with_token_values(get_token_transfers(wallet, chain, lane=lane, contract=PAYPAL_USD_CONTRACT), chain)
+    else:
+        tx_df = with_eth_values(get_transaction_history(wallet, chain, lane=lane))
+    age = get_wallet_age(wallet, chain, lane=lane)
+    pending = with_tokens and lane == "interactive"
+    if with_tokens and not pending:
+        token_features = get_token_features(wallet, chain, lane=lane)
+    else:
+        token_features = dict.fromkeys(TOKEN_FEATURES, 0.0)
 
-        if chain == "paypalusd":
-            tx_df = get_erc20_transfers(wallet, base_url, api_key, PAYPAL_USD_CONTRACT)
-        else:
-            tx_df = get_transaction_history(wallet, base_url, api_key)
-
-        age = get_wallet_age(wallet, base_url, api_key)
-        print(f"📆 Wallet age: {age} days | 📈 Transactions: {len(tx_df)}")
-
-        if not tx_df.empty:
-            tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
-            if "value" in tx_df.columns:
-                tx_df["value_eth"] = tx_df["value"].astype(float) / 1e18
-            else:
-                tx_df["value_eth"] = 0.0
-            active_days = tx_df["datetime"].dt.date.nunique()
-            avg_tx_value = tx_df["value_eth"].mean()
-            tx_count = len(tx_df)
+    transfers = "pending" if pending else int(token_features["token_transfer_count"])
+    print(f"📆 Wallet age: {age} days | 📈 Transactions: {len(tx_df)} | 🪙 Token transfers: {transfers}")
+
+    summary_df = summarize_wallet(tx_df, wallet, {"wallet_age_days": age, **token_features})
+    summary_df[TOKEN_FEATURES_PENDING] = float(pending)
+    return summary_df, tx_df
+
+def with_eth_values(tx_df: pd.DataFrame) -> pd.DataFrame:
+    if not tx_df.empty:
+        tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
+        if "value" in tx_df.columns:
+            tx_df["value_eth"] = tx_df["value"].astype(float) / 1e18
         else:
-            active_days = 0
-            avg_tx_value = 0.0
-            tx_count = 0
-
-        feature_vector = {
-            "wallet": wallet,
-            "wallet_age_days": age,
-            "tx_count": tx_count,
-            "avg_tx_value_eth": avg_tx_value,
-            "active_days": active_days
-        }
+            tx_df["value_eth"] = 0.0
+    return tx_df
 
-        return pd.DataFrame([feature_vector]), tx_df
-    
-    except Exception as e:
-        print(f"❌ Error fetching wallet data: {e}")
-        # Return empty data on error
-        feature_vector = {
-            "wallet": wallet,
-            "wallet_age_days": 0,
-            "tx_count": 0,
-            "avg_tx_value_eth": 0.0,
-            "active_days": 0
-        }
-        return pd.DataFrame([feature_vector]), pd.DataFrame()
+def with_token_values(token_df: pd.DataFrame, chain: str) -> pd.DataFrame:
+    """
+    Decimal-adjusted token and USD amounts from the token registry. value_eth
+    holds the USD amount: USD is the paypalusd chain's native unit.
+    """
+    if not token_df.empty:
+        # paypalusd transfers live on Ethereum, so they share its registry entries
+        token_df = normalize_token_values("ethereum" if chain == "paypalusd" else chain, token_df)
+        token_df["datetime"] = pd.to_datetime(token_df["timeStamp"], unit="s")
+        token_df["value_eth"] = token_df["value_usd"].fillna(0.0)
+    return token_df
+
+# Older history, fetched when a client pages past what is stored
+def get_history_page(wallet: str, chain: str, end_block: int, lane: str = "batch") -> pd.DataFrame:
+    """The newest HISTORY_PAGE_SIZE transactions at or below `end_block`."""
+    return with_eth_values(get_transaction_history(wallet.lower(), chain, lane=lane, end_block=end_block))
+
+def summarize_wallet(tx_df: pd.DataFrame, wallet: str, overrides: dict = None) -> pd.DataFrame:
+    """One-row summary of SUMMARY_FEATURES, computed in a single pass by the feature registry."""
+    feature_vector = {"wallet": wallet}
+    feature_vector.update(compute_wallet_features(tx_df, wallet, SUMMARY_FEATURES, overrides))
+    return pd.DataFrame([feature_vector])
 
 # Format for model
 def format_wallet_data_to_numpy(summary_df, tx_df, wallet):
@@ -169,20 +256,7 @@ def format_wallet_data_to_numpy(summary_df, tx_df, wallet):
         wallet_row["active_days"]
     ], dtype=np.float32)
 
-    if not tx_df.empty:
-        tx_df["value_eth"] = tx_df.get("value_eth", 0).astype(float)
-        tx_df["gas"] = tx_df.get("gas", 0).astype(float)
-        tx_df["gasPrice"] = tx_df.get("gasPrice", 0).astype(float)
-        tx_df["from"] = tx_df["from"].str.lower()
-        tx_df["to"] = tx_df["to"].str.lower()
-        tx_df["is_outgoing"] = (tx_df["from"] == wallet.lower()).astype(int)
-
-        tx_features = tx_df[["value_eth", "gas", "gasPrice", "is_outgoing"]].fillna(0).to_numpy(dtype=np.float32)
-    else:
-        tx_features = np.empty((0, 4), dtype=np.float32)
-
-    padded_tx = np.full((100, 4), np.nan, dtype=np.float32)
-    length = min(len(tx_features), 100)
-    padded_tx[:length] = tx_features[:length]
+    # (100, 4) [value_eth, gas, gasPrice, is_outgoing], NaN-padded
+    padded_tx = wallet_engine(tx_df, wallet).tx_window_matrix()[0].astype(np.float32)
 
-    return X_wallet, padded_tx
\ No newline at end of file
+    return X_wallet, padded_tx
@@ -1,37 +1,90 @@
 import os
 import pickle
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import numpy as np
 import pandas as pd
-from typing import Optional, Tuple
-from model.walletEtl import get_wallet_features, format_wallet_data_to_numpy
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from model.walletEtl import (
+    EXPLORER_CHAINS, HISTORY_PAGE_SIZE, TOKEN_FEATURES_PENDING, get_wallet_features, summarize_wallet,
+)
+from model.feature_cache import get_wallet_snapshot_future
+from model.deadline import bounded, check_deadline
+from model.features import MODEL_FEATURES, TOKEN_FEATURES, wallet_engine
+from model.score_index import record_score
+from underwriting import price
+from shadow import get_shadow_scorer
+from feature_drift import get_feature_monitor
 
 # === Config ===
 BASE_DIR = os.path.dirname(__file__)
 MODEL_PATH = os.path.join(BASE_DIR, "model/model_pkls", "fico_xgb_model.pkl")
 SCALER_PATH = os.path.join(BASE_DIR, "model/model_pkls", "fico_xgb_scaler.pkl")
 
-# === Load Model + Scaler ===
-with open(MODEL_PATH, "rb") as f:
-    model = pickle.load(f)
-with open(SCALER_PATH, "rb") as f:
-    scaler = pickle.load(f)
+# === Load Model + Scaler (on first use) ===
+_artifacts = None
+_artifacts_lock = threading.Lock()
+
+def load_model_artifacts():
+    """
+    Unpickles the model and scaler once per process and returns (model, scaler).
+    Deferred so importing this module doesn't pay for xgboost + unpickling.
+    """
+    global _artifacts
+    if _artifacts is None:
+        with _artifacts_lock:
+            if _artifacts is None:
+                with open(MODEL_PATH, "rb") as f:
+                    model = pickle.load(f)
+                with open(SCALER_PATH, "rb") as f:
+                    scaler = pickle.load(f)
+                _artifacts = (model, scaler)
+    return _artifacts
+
+def __getattr__(name):
+    # Keeps `run_fico_pipeline.model` / `.scaler` working for existing callers
+    if name == "model":
+        return load_model_artifacts()[0]
+    if name == "scaler":
+        return load_model_artifacts()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def set_inference_threads(n_threads: int):
+    """
+    Caps XGBoost's per-predict thread count. Preforked workers each get a share
+    of the cores instead of every process spawning one thread per core.
+    """
+    model, _ = load_model_artifacts()
+    model.set_params(n_jobs=n_threads)
+
+# Native-unit -> ETH conversion per chain
+CHAIN_TO_ETH_RATES = {
+    "ethereum": 1.0,                          # baseline
+    "sepolia": 1.0,                           # Sepolia testnet (ETH)
+    "bnb": 614 / 2189.47,                     # 1 BNB in ETH
+    "bsc-testnet": 614 / 2189.47,             # BSC testnet (BNB)
+    "flow-evm": 0.34 / 2189.47,               # 1 FLOW in ETH
+    "flow-evm-testnet": 0.34 / 2189.47,       # Flow EVM testnet (FLOW)
+    "paypalusd": 1 / 2189.47,                 # 1 USD in ETH (legacy)
+    "flow": 0.34 / 2189.47                    # Legacy alias for flow-evm
+}
+
+# Model features denominated in the chain's native currency
+VALUE_FEATURES = {
+    "tx_mean_value_eth", "tx_mean_gas_price", "tx_std_value_eth", "tx_std_gas_price", "avg_tx_value_eth",
+}
+VALUE_FEATURE_MASK = np.array([name in VALUE_FEATURES for name in MODEL_FEATURES])
+
+# Wallet-level model inputs taken from the fetched summary rather than recomputed
+SUMMARY_MODEL_INPUTS = ["wallet_age_days", "tx_count", "avg_tx_value_eth", "active_days"]
 
 def convert_wallet_features_to_eth_units(X_wallet: np.ndarray, chain: str) -> np.ndarray:
     """
     Converts avg_tx_value_eth in the wallet-level features to ETH-equivalent,
     depending on the chain the wallet is on.
     """
-    conversion_factors = {
-        "ethereum": 1.0,                          # baseline
-        "sepolia": 1.0,                           # Sepolia testnet (ETH)
-        "bnb": 614 / 2189.47,                     # 1 BNB in ETH
-        "bsc-testnet": 614 / 2189.47,             # BSC testnet (BNB)
-        "flow-evm": 0.34 / 2189.47,               # 1 FLOW in ETH
-        "flow-evm-testnet": 0.34 / 2189.47,       # Flow EVM testnet (FLOW)
-        "paypalusd": 1 / 2189.47,                 # 1 USD in ETH (legacy)
-        "flow": 0.34 / 2189.47                    # Legacy alias for flow-evm
-    }
-    factor = conversion_factors.get(chain.lower(), 1.0)
+    factor = CHAIN_TO_ETH_RATES.get(chain.lower(), 1.0)
     X_wallet = X_wallet.copy()
     X_wallet[2] *= factor  # avg_tx_value_eth (index 2)
     return X_wallet
@@ -41,26 +94,48 @@ def convert_tx_features_to_eth_units(tx_matrix: np.ndarray, chain: str) -> np.nd
     Converts tx-level features [value, gas, gasPrice, is_outgoing] into ETH-scale.
     Only value and gasPrice are affected by conversion.
     """
-    conversion_rates = {
-        "ethereum": 1.0,
-        "sepolia": 1.0,
-        "bnb": 614 / 2189.47,
-        "bsc-testnet": 614 / 2189.47,
-        "flow-evm": 0.34 / 2189.47,
-        "flow-evm-testnet": 0.34 / 2189.47,
-        "paypalusd": 1 / 2189.47,
-        "flow": 0.34 / 2189.47
-    }
-
-    if chain.lower() not in conversion_rates:
+    if chain.lower() not in CHAIN_TO_ETH_RATES:
         raise ValueError(f"Unsupported chain for conversion: {chain}")
 
-    rate = conversion_rates[chain.lower()]
+    rate = CHAIN_TO_ETH_RATES[chain.lower()]
     tx_matrix = tx_matrix.copy()
     tx_matrix[:, 0] *= rate  # value
     tx_matrix[:, 2] *= rate  # gasPrice
     return tx_matrix
 
+def convert_model_features_to_eth_units(features: np.ndarray, chain: str) -> np.ndarray:
+    """
+    Converts MODEL_FEATURES rows (1-D or (n, 12)) into ETH-scale.
+    """
+    if chain.lower() not in CHAIN_TO_ETH_RATES:
+        raise ValueError(f"Unsupported chain for conversion: {chain}")
+
+    features = np.array(features, dtype=np.float64)
+    features[..., VALUE_FEATURE_MASK] *= CHAIN_TO_ETH_RATES[chain.lower()]
+    return features
+
+def model_feature_vector(summary_df: pd.DataFrame, tx_df: pd.DataFrame, wallet_address: str, chain: str) -> np.ndarray:
+    """
+    MODEL_FEATURES for one wallet, in ETH units, shaped (1, 12).
+    """
+    wallet_row = summary_df.iloc[0]
+    engine = wallet_engine(tx_df, wallet_address, {name: wallet_row[name] for name in SUMMARY_MODEL_INPUTS})
+    return convert_model_features_to_eth_units(engine.matrix(MODEL_FEATURES), chain)
+
+def scores_from_features(features: np.ndarray, artifacts=None) -> np.ndarray:
+    """
+    Scales + predicts a batch of MODEL_FEATURES rows; returns normalized 0–100 scores.
+    `artifacts` is a (model, scaler) pair, the production one by default.
+    """
+    model, scaler = artifacts or load_model_artifacts()
+    # The scaler and model were fitted on float32 inputs
+    X_scaled = scaler.transform(np.asarray(features, dtype=np.float32))
+    return normalize_predictions(model.predict(X_scaled))
+
+def normalize_predictions(predicted_fico: np.ndarray) -> np.ndarray:
+    # Normalize to 0–100 (original model trained to ~800 scale)
+    return np.clip((predicted_fico / 800) * 100, 30, 100)
+
 def predict_fico(wallet_address: str, chain: str = "ethereum") -> float:
     """
     Compute a normalized FICO score (0–100) for a given wallet address and chain.
@@ -72,44 +147,128 @@ def predict_fico(wallet_address: str, chain: str = "ethereum") -> float:
     if summary_df.empty:
         raise RuntimeError(f"❌ No data retrieved for wallet: {wallet_address} on chain: {chain}")
 
+    score = score_wallet_features(summary_df, tx_df, wallet_address, chain)
+    record_score("fico", chain, wallet_address, score)
+    return score
+
+def score_wallet_features(summary_df: pd.DataFrame, tx_df: pd.DataFrame, wallet_address: str, chain: str) -> float:
+    """
+    Scores already-fetched wallet data, e.g. a cached snapshot.
+    """
     # --- Step 2: Format into model-compatible features ---
-    X_wallet, tx_matrix = format_wallet_data_to_numpy(summary_df, tx_df, wallet_address)
+    check_deadline("inference")
+    combined_features = model_feature_vector(summary_df, tx_df, wallet_address, chain)
 
-    X_wallet = convert_wallet_features_to_eth_units(X_wallet, chain)
+    # --- Step 3: Scale + Predict ---
+    score = scores_from_features(combined_features)[0]
 
-    tx_matrix = np.nan_to_num(tx_matrix, nan=0.0)
-    tx_matrix = convert_tx_features_to_eth_units(tx_matrix, chain)
+    # Candidate models score the same vector in the background (see shadow.py)
+    get_shadow_scorer().submit(wallet_address, chain, combined_features[0], float(score), tx_df)
+    # Live feature distribution, for drift against the scaler's training data (see feature_drift.py)
+    get_feature_monitor().record(combined_features)
+    return score
 
-    tx_mean = np.mean(tx_matrix, axis=0)
-    tx_std = np.std(tx_matrix, axis=0)
+# === Cross-chain scoring ===
+# Each chain gets this long before it is left out of the aggregate score
+CROSS_CHAIN_TIMEOUT_SECS = float(os.getenv("CROSS_CHAIN_TIMEOUT_SECS", "6"))
 
-    combined_features = np.concatenate([tx_mean, tx_std, X_wallet], axis=0).reshape(1, -1)
+class CrossChainScore(NamedTuple):
+    score: float
+    summary_df: pd.DataFrame
+    tx_df: pd.DataFrame
+    chains: Dict[str, dict]  # per-chain status: ok / timeout / error
+    stale: bool
 
-    # --- Step 3: Scale + Predict ---
-    X_scaled = scaler.transform(combined_features)
-    predicted_fico = model.predict(X_scaled)[0]
+def convert_tx_frame_to_eth_units(tx_df: pd.DataFrame, chain: str) -> pd.DataFrame:
+    """
+    Copy of an explorer frame with value_eth and gasPrice in ETH-scale.
+    """
+    rate = CHAIN_TO_ETH_RATES[chain.lower()]
+    tx_df = tx_df.copy()
+    tx_df["value_eth"] = pd.to_numeric(tx_df.get("value_eth", 0.0), errors="coerce").fillna(0.0) * rate
+    tx_df["gasPrice"] = pd.to_numeric(tx_df.get("gasPrice", 0.0), errors="coerce").fillna(0.0) * rate
+    tx_df["chain"] = chain
+    return tx_df
 
-    # Normalize to 0–100 (original model trained to ~800 scale)
-    normalized_score = np.clip((predicted_fico / 800) * 100, 30, 100)
-    return normalized_score
+def merge_chain_histories(wallet_address: str, snapshots: dict) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Merges per-chain snapshots into one ETH-denominated history + summary.
+    The history is the newest HISTORY_PAGE_SIZE transactions across chains,
+    the same window a single-chain score sees (the model and scaler were
+    never trained on longer ones). The wallet's age is its oldest activity on
+    any chain; token activity (fetched per chain, not part of the histories)
+    is added up across chains.
+    """
+    frames = [
+        convert_tx_frame_to_eth_units(snapshot.tx_df, chain)
+        for chain, snapshot in snapshots.items() if not snapshot.tx_df.empty
+    ]
+    tx_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if not tx_df.empty:
+        tx_df = tx_df.sort_values("timeStamp", ascending=False, kind="stable").head(HISTORY_PAGE_SIZE)
+        tx_df = tx_df.reset_index(drop=True)
+    age = max(float(snapshot.summary_df.iloc[0]["wallet_age_days"]) for snapshot in snapshots.values())
+    tokens = pd.concat([snapshot.summary_df[TOKEN_FEATURES] for snapshot in snapshots.values()], ignore_index=True)
+    overrides = {"wallet_age_days": age, **tokens.sum().to_dict()}
+    # Chains hold different contracts, so the top token is the largest per-chain top
+    top_usd = (tokens["top_token_volume_share"] * tokens["token_volume_usd"]).max()
+    overrides["top_token_volume_share"] = top_usd / overrides["token_volume_usd"] if overrides["token_volume_usd"] > 0 else 0.0
+    summary_df = summarize_wallet(tx_df, wallet_address.lower(), overrides)
+    summary_df[TOKEN_FEATURES_PENDING] = max(
+        float(snapshot.summary_df.iloc[0].get(TOKEN_FEATURES_PENDING, 0.0)) for snapshot in snapshots.values()
+    )
+    return summary_df, tx_df
+
+def predict_fico_cross_chain(wallet_address: str, chains: Optional[List[str]] = None,
+                             timeout_per_chain: Optional[float] = None) -> CrossChainScore:
+    """
+    Scores one address across every explorer-backed chain at once. Chains are
+    fetched concurrently (through the snapshot cache) and each one only gets
+    `timeout_per_chain` seconds, so total latency is bounded by the slowest
+    chain that answers in time and a stuck chain is simply left out.
+    """
+    chains = [c.lower() for c in (chains or EXPLORER_CHAINS)]
+    unknown = [c for c in chains if c not in CHAIN_TO_ETH_RATES]
+    if unknown:
+        raise ValueError(f"Unsupported chains for cross-chain scoring: {unknown}")
+    timeout = bounded(CROSS_CHAIN_TIMEOUT_SECS if timeout_per_chain is None else timeout_per_chain)
+
+    started = time.monotonic()
+    futures = {chain: get_wallet_snapshot_future(wallet_address, chain) for chain in chains}
+
+    snapshots, statuses = {}, {}
+    for chain, future in futures.items():
+        remaining = max(started + timeout - time.monotonic(), 0.0)
+        try:
+            snapshots[chain] = future.result(timeout=remaining)
+            statuses[chain] = {"status": "ok", "stale": snapshots[chain].stale}
+        except FutureTimeoutError:
+            statuses[chain] = {"status": "timeout"}
+        except Exception as e:
+            # Exception text can include explorer URLs (and API keys); report the type only
+            statuses[chain] = {"status": "error", "error": type(e).__name__}
+
+    if not snapshots:
+        raise RuntimeError(f"❌ No chain returned data for wallet: {wallet_address} ({statuses})")
+
+    check_deadline("cross-chain scoring")
+    summary_df, tx_df = merge_chain_histories(wallet_address, snapshots)
+    # Values are already ETH-denominated, so score with the ETH baseline
+    score = float(score_wallet_features(summary_df, tx_df, wallet_address, "ethereum"))
+    record_score("fico", "all", wallet_address, score)
+    stale = any(snapshot.stale for snapshot in snapshots.values())
+    return CrossChainScore(score, summary_df, tx_df, statuses, stale)
 
 def credit_to_interest_and_loan(fico_score_normalized: float) -> Tuple[Optional[float], float]:
     """
     Bank-style underwriting:
     Returns (interest rate, max loan amount) for given credit score.
     Scores < 60 get rejected (loan = 0, rate = None)
+    The band table lives in underwriting.py, shared with portfolio re-pricing.
     """
-
-    if fico_score_normalized >= 90:
-        return 4.0, 1500.0
-    elif fico_score_normalized >= 80:
-        return 6.5, 800.0
-    elif fico_score_normalized >= 70:
-        return 10.0, 200.0
-    elif fico_score_normalized >= 60:
-        return 15.0, 10.0
-    else:
-        return None, 0.0  # Rejected
+    _, rates, limits = price([fico_score_normalized])
+    rate = float(rates[0])
+    return (None if np.isnan(rate) else rate), float(limits[0])
 
 if __name__ == "__main__":
     import sys
@@ -0,0 +1,202 @@
+"""
+Production launcher: preforks several API workers that share one listening
+socket, one copy of the model artifacts and one local store. Several launchers on
+different ports form a sharded cluster via KARMA_CLUSTER_NODES (cluster.py).
+
+    python serve.py --workers 4 --port 5000 --inference-threads 2
+    python serve.py --check-startup    # fail if `import app` exceeds the budget
+
+The model and scaler are unpickled once in the parent before forking, so the
+workers share those pages copy-on-write. Wallet snapshots and scores live in
+the local SQLite store (model/local_store.py), so a fetch made by one worker
+is served from cache by all of them. Clustered nodes each get a store of their
+own (<store>.<port>.sqlite3, or --store) and share only the host store's
+explorer rate limits.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+# Autoscaled instances must be able to import the API this fast
+STARTUP_BUDGET_SECS = float(os.environ.get("STARTUP_BUDGET_SECS", "0.5"))
+# Same default as model/local_store.py, which can't be imported before the paths are set
+HOST_STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", ".karma_store.sqlite3")
+
+
+def parse_args():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run the OnChain FICO API with preforked workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", cpus)))
+    parser.add_argument(
+        "--inference-threads", type=int, default=int(os.environ.get("INFERENCE_THREADS", 0)),
+        help="XGBoost/OpenMP threads per worker (default: cores / workers)",
+    )
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument(
+        "--node-url", default=os.environ.get("KARMA_NODE_URL"),
+        help="This node's URL in KARMA_CLUSTER_NODES (default: http://127.0.0.1:<port>)",
+    )
+    parser.add_argument(
+        "--store",
+        help="This node's local store (default: KARMA_STORE_PATH, made <path>.<port>.sqlite3 when clustered)",
+    )
+    parser.add_argument(
+        "--check-startup", action="store_true",
+        help=f"Measure `import app` in fresh interpreters and fail if over {STARTUP_BUDGET_SECS}s",
+    )
+    args = parser.parse_args()
+    if not args.node_url:
+        args.node_url = f"http://127.0.0.1:{args.port}"
+    if args.inference_threads <= 0:
+        args.inference_threads = max(1, cpus // max(args.workers, 1))
+    return args
+
+
+def clustered() -> bool:
+    return bool(os.environ.get("KARMA_CLUSTER_NODES") or os.environ.get("KARMA_CLUSTER_FILE"))
+
+
+def configure_stores(args) -> str:
+    """
+    Points KARMA_STORE_PATH at this node's store. Nodes of a cluster on one
+    host must not share one: each indexes only the wallets it owns and the
+    cluster sums their counts. The host store stays the shared store.
+    """
+    host_store = os.environ.get("KARMA_STORE_PATH") or HOST_STORE_PATH
+    store = args.store
+    if store is None and clustered():
+        root, ext = os.path.splitext(host_store)
+        store = f"{root}.{args.port}{ext}"
+    os.environ.setdefault("KARMA_SHARED_STORE_PATH", host_store)
+    os.environ["KARMA_STORE_PATH"] = store or host_store
+    return os.environ["KARMA_STORE_PATH"]
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def check_startup(runs: int = 5) -> int:
+    """Times `import app` in fresh interpreters; non-zero exit when the median is over budget."""
+    probe = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", probe], cwd=here, capture_output=True, text=True, check=True)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    median = statistics.median(timings)
+    verdict = "✅ within" if median <= STARTUP_BUDGET_SECS else "❌ over"
+    print(f"⏱️  import app: median {median:.3f}s, max {max(timings):.3f}s ({verdict} {STARTUP_BUDGET_SECS}s budget)")
+    return 0 if median <= STARTUP_BUDGET_SECS else 1
+
+
+def run_worker(app, sock: socket.socket, worker_id: int):
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    print(f"👷 Worker {worker_id} (pid {os.getpid()}) serving on {host}:{port}")
+    server.serve_forever()
+
+
+def main():
+    args = parse_args()
+    if args.check_startup:
+        return check_startup()
+
+    # Thread pools read these when first initialised, so they must be set before
+    # numpy/xgboost are imported; each worker then stays within its share of cores.
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(args.inference_threads)
+    # Identifies this node on the cluster hash ring (see cluster.py)
+    os.environ["KARMA_NODE_URL"] = args.node_url.rstrip("/")
+    # Before anything imports model.local_store, which reads the paths once
+    store = configure_stores(args)
+
+    from cluster import config_error
+
+    error = config_error()
+    if error:
+        print(f"❌ Not starting: {error}")
+        return 1
+
+    import run_fico_pipeline
+    from app import app, warm_up
+
+    # Load model artifacts once, before fork, so workers share them copy-on-write
+    # and start out ready
+    warm_up()
+    run_fico_pipeline.set_inference_threads(args.inference_threads)
+
+    # Move everything allocated so far out of the collector's reach; otherwise the
+    # first gc pass in each worker touches every object header and un-shares the pages.
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(args.host, args.port, args.backlog)
+    print(
+        f"🚀 Starting {args.workers} workers on {args.host}:{args.port} "
+        f"({args.inference_threads} inference threads each, store {store})"
+    )
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(app, sock, worker_id)
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for worker_id in range(args.workers):
+        spawn(worker_id)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            print(f"⚠️  Worker {worker_id} (pid {pid}) exited with status {status}, restarting")
+            time.sleep(1)  # avoid a hot respawn loop if workers crash on start
+            spawn(worker_id)
+
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
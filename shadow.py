@@ -0,0 +1,294 @@
+"""
+Shadow scoring of candidate models.
+
+score_wallet_features hands every production feature vector to submit(),
+which only enqueues it (or drops it when the queue is full), so candidates
+never add latency to a request. Background workers pull batches off the
+queue, score them with every candidate and record each candidate's score,
+its delta from production and its latency in the local store
+(shadow_scores, newest SHADOW_SCORES_KEEP rows).
+
+A candidate is a directory under SHADOW_MODELS_DIR
+(model/model_pkls/candidates by default):
+
+    <name>/model.pkl + scaler.pkl   retrained XGBoost on the 12 MODEL_FEATURES
+    <name>/tx_transformer.pt        TxTransformerFICO checkpoint (needs torch)
+
+With no candidates, submit() is a no-op.
+"""
+import os
+import pickle
+import queue
+import random
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from model.local_store import connect, register_schema, transaction
+
+SHADOW_MODELS_DIR = os.getenv(
+    "SHADOW_MODELS_DIR", os.path.join(os.path.dirname(__file__), "model/model_pkls", "candidates")
+)
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "256"))
+SHADOW_BATCH_SIZE = int(os.getenv("SHADOW_BATCH_SIZE", "32"))
+# How long a worker waits to fill a batch once it has one item
+SHADOW_BATCH_WAIT_SECS = float(os.getenv("SHADOW_BATCH_WAIT_SECS", "0.05"))
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "1"))
+# Fraction of production scores that are shadowed
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "1.0"))
+# Newest shadow_scores rows kept; older ones are pruned as batches are written
+SHADOW_SCORES_KEEP = int(os.getenv("SHADOW_SCORES_KEEP", "200000"))
+
+register_schema("""
+CREATE TABLE IF NOT EXISTS shadow_scores (
+    model TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    wallet TEXT NOT NULL,
+    production_score REAL NOT NULL,
+    shadow_score REAL NOT NULL,
+    delta REAL NOT NULL,  -- shadow - production
+    batch_size INTEGER NOT NULL,
+    batch_latency_ms REAL NOT NULL,
+    scored_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shadow_scores_by_model ON shadow_scores (model, scored_at);
+""")
+
+
+class ShadowItem(NamedTuple):
+    wallet: str
+    chain: str
+    features: np.ndarray      # MODEL_FEATURES row in ETH units, exactly as scored in production
+    production_score: float
+    tx_df: "object"           # the wallet's history, for sequence models
+
+
+# === Candidates ===
+class XGBoostCandidate:
+    """Same features and normalisation as production, different model + scaler."""
+
+    def __init__(self, name: str, directory: str):
+        self.name = name
+        with open(os.path.join(directory, "model.pkl"), "rb") as f:
+            self.model = pickle.load(f)
+        # One core, whatever n_jobs was pickled: production inference runs in this process too
+        self.model.set_params(n_jobs=1)
+        with open(os.path.join(directory, "scaler.pkl"), "rb") as f:
+            self.scaler = pickle.load(f)
+
+    def score(self, items: List[ShadowItem]) -> np.ndarray:
+        from run_fico_pipeline import scores_from_features
+
+        return scores_from_features(np.stack([item.features for item in items]), (self.model, self.scaler))
+
+
+class TransformerCandidate:
+    """TxTransformerFICO over each wallet's transaction window + wallet features."""
+
+    def __init__(self, name: str, directory: str):
+        import torch
+        from model.tx_transformer import load_checkpoint
+
+        # Stay on one core so the candidate doesn't compete with production inference
+        torch.set_num_threads(1)
+        self.name = name
+        self.model, self.scaler_tx, self.scaler_wallet = load_checkpoint(os.path.join(directory, "tx_transformer.pt"))
+
+    def score(self, items: List[ShadowItem]) -> np.ndarray:
+        import torch
+        from model.features import MODEL_FEATURES, wallet_engine
+        from model.tx_transformer import WALLET_INPUTS, combine_inputs
+        from run_fico_pipeline import convert_tx_features_to_eth_units, normalize_predictions
+
+        X_tx = np.stack([
+            convert_tx_features_to_eth_units(wallet_engine(item.tx_df, item.wallet).tx_window_matrix()[0], item.chain)
+            for item in items
+        ])
+        wallet_columns = [MODEL_FEATURES.index(name) for name in WALLET_INPUTS]
+        X_wallet = np.stack([item.features[wallet_columns] for item in items])
+        inputs = combine_inputs(X_tx, X_wallet, self.scaler_tx, self.scaler_wallet)
+        with torch.no_grad():
+            predicted = self.model(torch.from_numpy(inputs)).numpy()
+        return normalize_predictions(predicted)
+
+
+def load_candidates(directory: str = SHADOW_MODELS_DIR) -> list:
+    candidates = []
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.exists(os.path.join(path, "model.pkl")):
+                candidates.append(XGBoostCandidate(name, path))
+            elif os.path.exists(os.path.join(path, "tx_transformer.pt")):
+                candidates.append(TransformerCandidate(name, path))
+        except Exception as e:
+            print(f"⚠️  Skipping shadow candidate {name}: {e}")
+    return candidates
+
+
+# === Scorer ===
+class ShadowScorer:
+    def __init__(self, directory: str = SHADOW_MODELS_DIR, queue_size: int = SHADOW_QUEUE_SIZE,
+                 batch_size: int = SHADOW_BATCH_SIZE, workers: int = SHADOW_WORKERS,
+                 sample_rate: float = SHADOW_SAMPLE_RATE):
+        self.directory = directory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.workers = workers
+        self.sample_rate = sample_rate
+        self._enabled = None
+        self._queue = None
+        self._pid = None
+        self._candidates = None
+        self._lock = threading.Lock()
+        # Separate from _lock: loading can take a while and submit() must never wait on it
+        self._load_lock = threading.Lock()
+        self._stats = {"submitted": 0, "dropped": 0, "batches": 0, "failed": 0, "batch_errors": 0}
+
+    def enabled(self) -> bool:
+        if self._enabled is None:
+            self._enabled = (
+                self.sample_rate > 0 and self.workers > 0
+                and os.path.isdir(self.directory) and bool(os.listdir(self.directory))
+            )
+        return self._enabled
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _ensure_workers(self):
+        # Threads don't survive fork, so each (preforked) process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f"shadow-{i}", daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, wallet: str, chain: str, features: np.ndarray, production_score: float, tx_df) -> bool:
+        """
+        Queues a production-scored vector for the candidates. Never blocks:
+        returns False when it was sampled out or the queue is full (dropped).
+        """
+        if not self.enabled() or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return False
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait(ShadowItem(wallet.lower(), chain, np.asarray(features), production_score, tx_df))
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("submitted")
+        return True
+
+    def _load_candidates(self) -> list:
+        with self._load_lock:
+            if self._candidates is None:
+                self._candidates = load_candidates(self.directory)
+                names = ", ".join(c.name for c in self._candidates) or "none"
+                print(f"👥 Shadow candidates: {names}")
+            return self._candidates
+
+    def _next_batch(self) -> List[ShadowItem]:
+        batch = [self._queue.get()]
+        fill_until = time.monotonic() + SHADOW_BATCH_WAIT_SECS
+        while len(batch) < self.batch_size:
+            left = fill_until - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=left))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            try:
+                batch = self._next_batch()
+                self._score_batch(self._load_candidates(), batch)
+            except Exception as e:
+                # e.g. "database is locked" past the store timeout: drop this batch, keep draining the queue
+                print(f"⚠️  Shadow batch failed: {e}")
+                self._count("batch_errors")
+                time.sleep(SHADOW_BATCH_WAIT_SECS)
+
+    def _score_batch(self, candidates: list, batch: List[ShadowItem]):
+        rows = []
+        for candidate in candidates:
+            started = time.perf_counter()
+            try:
+                scores = candidate.score(batch)
+            except Exception as e:
+                print(f"⚠️  Shadow candidate {candidate.name} failed: {e}")
+                self._count("failed")
+                continue
+            latency_ms = (time.perf_counter() - started) * 1000
+            now = time.time()
+            rows.extend(
+                (candidate.name, item.chain, item.wallet, item.production_score, float(score),
+                 float(score) - item.production_score, len(batch), latency_ms, now)
+                for item, score in zip(batch, scores)
+            )
+        if rows:
+            with transaction() as conn:
+                before = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM shadow_scores").fetchone()[0]
+                conn.executemany("INSERT INTO shadow_scores VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                last = before + len(rows)
+                if last // 1000 != before // 1000:
+                    conn.execute("DELETE FROM shadow_scores WHERE rowid <= ?", (last - SHADOW_SCORES_KEEP,))
+        self._count("batches")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        candidates = None if self._candidates is None else [c.name for c in self._candidates]
+        return {
+            "enabled": self.enabled(),
+            "candidates": candidates,
+            "queue_depth": self._queue.qsize() if self._pid == os.getpid() else 0,
+            "queue_size": self.queue_size,
+            **stats,
+        }
+
+
+_scorer: Optional[ShadowScorer] = None
+
+
+def get_shadow_scorer() -> ShadowScorer:
+    global _scorer
+    if _scorer is None:
+        _scorer = ShadowScorer()
+    return _scorer
+
+
+def shadow_summary(since: Optional[float] = None) -> dict:
+    """Per candidate: rows scored, mean / mean-absolute / max-absolute delta, per-wallet and p95 batch latency."""
+    since = 0.0 if since is None else since
+    conn = connect()
+    summary = {}
+    for model, n, mean_delta, mean_abs, max_abs, per_wallet_ms in conn.execute(
+        "SELECT model, COUNT(*), AVG(delta), AVG(ABS(delta)), MAX(ABS(delta)), AVG(batch_latency_ms / batch_size) "
+        "FROM shadow_scores WHERE scored_at >= ? GROUP BY model",
+        (since,),
+    ):
+        p95 = conn.execute(
+            "SELECT batch_latency_ms FROM shadow_scores WHERE model = ? AND scored_at >= ? "
+            "ORDER BY batch_latency_ms LIMIT 1 OFFSET ?",
+            (model, since, int(n * 0.95)),
+        ).fetchone()
+        summary[model] = {
+            "scored": n,
+            "mean_delta": round(mean_delta, 3),
+            "mean_abs_delta": round(mean_abs, 3),
+            "max_abs_delta": round(max_abs, 3),
+            "latency_ms_per_wallet": round(per_wallet_ms, 3),
+            "batch_latency_ms_p95": round(p95[0], 3) if p95 else None,
+        }
+    return summary
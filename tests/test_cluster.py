@@ -0,0 +1,153 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.request import Request, urlopen
+
+LOCAL_NODES = "http://127.0.0.1:5101,http://127.0.0.1:5102"
+_tmp = tempfile.mkdtemp(prefix="karma-test-")
+os.environ.setdefault("KARMA_STORE_PATH", os.path.join(_tmp, "store.sqlite3"))
+# A two-node local cluster this process is the first node of (nothing listens on either port)
+os.environ.update({"KARMA_CLUSTER_NODES": LOCAL_NODES, "KARMA_NODE_URL": "http://127.0.0.1:5101"})
+
+import cluster  # noqa: E402
+from app import app  # noqa: E402
+
+WALLET = "0xabc0000000000000000000000000000000000001"
+
+
+class _StallingOwner(BaseHTTPRequestHandler):
+    """Sends headers and one chunk, then stops answering."""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.write(b"3\r\n{}\n\r\n")
+        self.wfile.flush()
+        time.sleep(2)
+
+    def log_message(self, *args):
+        pass
+
+
+class ShardedRoutingTest(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_non_string_chain_is_a_400(self):
+        for body in ({"wallet_address": WALLET, "chain": 1}, {"wallet_address": WALLET, "chain": ["eth"]}):
+            resp = self.client.post("/api/fico-score", json=body)
+            self.assertEqual(resp.status_code, 400, resp.get_json())
+
+    def test_shared_address_members_need_the_secret(self):
+        with app.test_request_context(
+            "/", headers={cluster.FORWARDED_HEADER: "http://127.0.0.1:5102"}, environ_base={"REMOTE_ADDR": "127.0.0.1"}
+        ):
+            with mock.patch.object(cluster, "CLUSTER_SECRET", ""):
+                self.assertIsNotNone(cluster.config_error())
+                self.assertFalse(cluster.from_peer())
+            with mock.patch.object(cluster, "CLUSTER_SECRET", "s3cret"):
+                self.assertIsNone(cluster.config_error())
+                self.assertFalse(cluster.from_peer())
+        with mock.patch.object(cluster, "CLUSTER_SECRET", "s3cret"), app.test_request_context(
+            "/", headers={cluster.FORWARDED_HEADER: "x", cluster.CLUSTER_TOKEN_HEADER: "s3cret"}
+        ):
+            self.assertTrue(cluster.from_peer())
+
+    def test_owner_stalling_mid_body_ends_the_proxied_stream(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StallingOwner)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        owner = f"http://127.0.0.1:{server.server_address[1]}"
+        try:
+            with app.test_request_context("/api/transactions", method="POST", json={}):
+                resp = cluster._proxy(owner, 0.3)
+                started = time.monotonic()
+                body = b"".join(resp.response)
+            self.assertEqual(body, b"{}\n")
+            self.assertLess(time.monotonic() - started, 1.5)
+        finally:
+            server.shutdown()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _call(url: str, body: dict = None) -> dict:
+    data = None if body is None else json.dumps(body).encode()
+    req = Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urlopen(req, timeout=30) as resp:
+        return json.loads(resp.read())
+
+
+class TwoNodeClusterTest(unittest.TestCase):
+    """Two serve.py nodes on one host, launched with nothing but the cluster recipe."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp(prefix="karma-cluster-")
+        cls.nodes = [f"http://127.0.0.1:{_free_port()}" for _ in range(2)]
+        env = {
+            **os.environ,
+            "KARMA_CLUSTER_NODES": ",".join(cls.nodes),
+            "KARMA_CLUSTER_SECRET": "test-secret",
+            "KARMA_STORE_PATH": os.path.join(cls.dir, "host.sqlite3"),
+        }
+        env.pop("KARMA_NODE_URL", None)
+        here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        cls.procs = [
+            subprocess.Popen(
+                [sys.executable, "serve.py", "--port", node.rsplit(":", 1)[1], "--workers", "1"],
+                cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            for node in cls.nodes
+        ]
+        deadline = time.monotonic() + 60
+        for node in cls.nodes:
+            while True:
+                try:
+                    _call(node + "/api/cluster")
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.2)
+
+    @classmethod
+    def tearDownClass(cls):
+        for proc in cls.procs:
+            proc.terminate()
+        for proc in cls.procs:
+            proc.wait(timeout=10)
+
+    def test_each_wallet_counted_once(self):
+        wallets = [f"0xabc{i:037x}" for i in range(6)]
+        for wallet in wallets:
+            _call(self.nodes[0] + "/api/fico-score", {"wallet_address": wallet, "chain": "flow-evm"})
+        owners = {_call(self.nodes[0] + f"/api/cluster?wallet_address={wallet}").get("owner") for wallet in wallets}
+        self.assertEqual(len(owners), 2, "both nodes should own some of the wallets")
+        for port in (node.rsplit(":", 1)[1] for node in self.nodes):
+            self.assertTrue(os.path.exists(os.path.join(self.dir, f"host.{port}.sqlite3")))
+
+        for node in self.nodes:
+            index = _call(node + "/api/score-index?kind=fico&chain=flow-evm&score=50")
+            self.assertEqual(index["population"], 6)
+            board = _call(node + "/api/leaderboard?kind=fico&chain=flow-evm&limit=100")
+            listed = [entry["wallet"] for entry in board["wallets"]]
+            self.assertEqual(sorted(listed), sorted(wallets))
+
+
+if __name__ == "__main__":
+    unittest.main()
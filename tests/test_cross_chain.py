@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("KARMA_STORE_PATH", os.path.join(tempfile.mkdtemp(prefix="karma-test-"), "store.sqlite3"))
+
+import pandas as pd  # noqa: E402
+
+from model.feature_cache import WalletSnapshot  # noqa: E402
+from model.features import TOKEN_FEATURES  # noqa: E402
+from model.walletEtl import HISTORY_PAGE_SIZE  # noqa: E402
+from run_fico_pipeline import merge_chain_histories  # noqa: E402
+
+WALLET = "0xabc0000000000000000000000000000000000001"
+
+
+def _snapshot(first_ts: int, step: int) -> WalletSnapshot:
+    n = HISTORY_PAGE_SIZE
+    tx_df = pd.DataFrame({
+        "hash": [f"0x{first_ts:x}{i:04x}" for i in range(n)],
+        "from": [WALLET if i % 2 else "0x" + "1" * 40 for i in range(n)],
+        "to": ["0x" + "2" * 40 if i % 2 else WALLET for i in range(n)],
+        "value_eth": [0.1] * n,
+        "timeStamp": [first_ts + i * step for i in range(n)][::-1],
+        "gas": [21000] * n,
+        "gasPrice": [20_000_000_000] * n,
+    })
+    tx_df["datetime"] = pd.to_datetime(tx_df["timeStamp"], unit="s")
+    summary_df = pd.DataFrame([{"wallet_age_days": 400.0, **{name: 0.0 for name in TOKEN_FEATURES}}])
+    return WalletSnapshot(summary_df, tx_df, 0.0, False, None)
+
+
+class MergeChainHistoriesTest(unittest.TestCase):
+    def test_merged_history_keeps_the_single_chain_window(self):
+        snapshots = {
+            "ethereum": _snapshot(1_700_000_000, 3600),
+            "bnb": _snapshot(1_700_000_100, 3600),
+            "sepolia": _snapshot(1_600_000_000, 3600),  # entirely older than the other two
+        }
+        summary_df, tx_df = merge_chain_histories(WALLET, snapshots)
+
+        self.assertEqual(len(tx_df), HISTORY_PAGE_SIZE)
+        self.assertEqual(int(summary_df.iloc[0]["tx_count"]), HISTORY_PAGE_SIZE)
+        newest = sorted(pd.concat([s.tx_df for s in snapshots.values()])["timeStamp"], reverse=True)
+        self.assertEqual(tx_df["timeStamp"].tolist(), newest[:HISTORY_PAGE_SIZE])
+        self.assertNotIn("sepolia", set(tx_df["chain"]))
+        # Age still comes from the oldest chain, not the truncated window
+        self.assertEqual(float(summary_df.iloc[0]["wallet_age_days"]), 400.0)
+
+
+if __name__ == "__main__":
+    unittest.main()